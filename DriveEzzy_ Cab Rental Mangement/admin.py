@@ -0,0 +1,182 @@
+"""Admin-only endpoints
+
+A request is an admin request if it carries `Authorization: Bearer
+<ADMIN_API_TOKEN>` (for scripts) or comes from a logged-in user whose email
+is listed in ADMIN_EMAILS. Neither is configured by default, so every admin
+endpoint answers 403 until one is.
+
+    POST /admin/bookings/import   CSV or JSON Lines body (or a `file` upload);
+                                  ?format=csv|jsonl, otherwise guessed from
+                                  the Content-Type / file name
+    GET  /admin/bookings/export   ?format=csv|jsonl&since=<created_at>
+    POST /admin/bookings/cancel   car_type, start and end (ISO dates) as JSON
+                                  or form fields: cancel every confirmed
+                                  booking of that car type on those days;
+                                  dry_run=1 only counts them
+    GET  /admin/dashboard         revenue and cancellations per car type per
+                                  day, ?start=&end= (this month by default)
+    GET  /admin/api/rollups       the same report as JSON
+    GET  /admin/profiling         request profiling status and the newest
+                                  profiles (profiling.py)
+    POST /admin/profiling         seconds (default 300) and path (default /)
+                                  as JSON or form fields: profile every
+                                  request under path on every worker for that
+                                  long; seconds=0 turns it off
+    GET  /admin/profiling/<id>    a saved profile, ?format=speedscope|collapsed
+"""
+import hmac
+import io
+import os
+import re
+from functools import wraps
+
+from flask import (Response, current_app, jsonify, render_template, request, send_file, session,
+                   stream_with_context)
+
+from bulk import (CANCEL_CHUNK_SIZE, FORMATS, cancel_bookings, cancel_range, export_bookings, guess_format,
+                  import_bookings)
+from profiling import FORMATS as PROFILE_FORMATS
+from reports import booking_report, report_range
+from views import get_storage
+
+
+def is_admin():
+    token = current_app.config.get('ADMIN_API_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    if token and authorization.startswith('Bearer ') and hmac.compare_digest(authorization[7:], token):
+        return True
+
+    admin_emails = current_app.config.get('ADMIN_EMAILS') or ()
+    user_id = session.get('user_id')
+    if user_id and admin_emails:
+        user = get_storage().get_user(user_id)
+        return bool(user) and user['email'] in admin_emails
+    return False
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return jsonify(error="Admin access required"), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@admin_required
+def import_bookings_view():
+    upload = request.files.get('file')
+    if upload:
+        fmt = request.args.get('format') or guess_format(upload.filename)
+        stream = upload.stream
+    else:
+        fmt = request.args.get('format') or guess_format(request.mimetype)
+        stream = io.BufferedReader(request.stream)
+    if fmt not in FORMATS:
+        return jsonify(error=f"Unknown format: {fmt}"), 400
+
+    # Decoded a line at a time, never read into memory as a whole
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    report = import_bookings(text, fmt)
+    return jsonify(report.as_dict())
+
+
+@admin_required
+def export_bookings_view():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify(error=f"Unknown format: {fmt}"), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(export_bookings(fmt, request.args.get('since'))),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="bookings.{fmt}"'}
+    )
+
+
+@admin_required
+def cancel_bookings_view():
+    values = request.get_json(silent=True) or request.form
+    car_type = str(values.get('car_type') or '').strip()
+    try:
+        if not car_type:
+            raise ValueError("car_type is required")
+        start_day, end_day = cancel_range(values.get('start'), values.get('end'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    chunk_size = max(int(values.get('chunk_size') or CANCEL_CHUNK_SIZE), 1)
+    dry_run = str(values.get('dry_run') or '').lower() in ('1', 'true', 'yes')
+    report = cancel_bookings(car_type, start_day, end_day, chunk_size, dry_run)
+    return jsonify(report.as_dict())
+
+
+def requested_report():
+    """The booking report for ?start=&end=; raises ValueError for a bad range"""
+    start_day, end_day = report_range(request.args.get('start'), request.args.get('end'))
+    return booking_report(get_storage(), start_day, end_day)
+
+
+@admin_required
+def dashboard_view():
+    try:
+        report = requested_report()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return render_template('admin_dashboard.html', report=report)
+
+
+@admin_required
+def rollups_view():
+    try:
+        report = requested_report()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(report)
+
+
+def get_profiler():
+    return current_app.extensions.get('profiler')
+
+
+@admin_required
+def profiling_view():
+    profiler = get_profiler()
+    if profiler is None:
+        return jsonify(error="Profiling is disabled (PROFILING_ENABLED)"), 404
+    if request.method == 'POST':
+        values = request.get_json(silent=True) or request.form
+        try:
+            seconds = float(values.get('seconds', 300))
+        except (TypeError, ValueError):
+            return jsonify(error="seconds must be a number"), 400
+        path = str(values.get('path') or '/')
+        if not path.startswith('/'):
+            return jsonify(error="path must start with /"), 400
+        profiler.set_toggle(seconds, path)
+    return jsonify(toggle=profiler.toggle_status(), sample_rate=profiler.sample_rate,
+                   signed_header=bool(profiler.secret), profiles=profiler.profiles())
+
+
+@admin_required
+def profile_view(profile_id):
+    profiler = get_profiler()
+    fmt = request.args.get('format', 'speedscope')
+    if fmt not in PROFILE_FORMATS:
+        return jsonify(error=f"Unknown format: {fmt}"), 400
+    path = profiler.path(profile_id, fmt) if profiler and re.fullmatch(r'[\w-]+', profile_id) else None
+    if path is None or not os.path.exists(path):
+        return jsonify(error="No such profile"), 404
+    return send_file(path, mimetype=PROFILE_FORMATS[fmt][1], as_attachment=True,
+                     download_name=os.path.basename(path))
+
+
+def register_admin_views(app):
+    """Register the admin routes on a Flask app"""
+    app.add_url_rule('/admin/bookings/import', view_func=import_bookings_view, methods=['POST'])
+    app.add_url_rule('/admin/bookings/export', view_func=export_bookings_view)
+    app.add_url_rule('/admin/bookings/cancel', view_func=cancel_bookings_view, methods=['POST'])
+    app.add_url_rule('/admin/dashboard', view_func=dashboard_view)
+    app.add_url_rule('/admin/api/rollups', view_func=rollups_view)
+    app.add_url_rule('/admin/profiling', view_func=profiling_view, methods=['GET', 'POST'])
+    app.add_url_rule('/admin/profiling/<profile_id>', view_func=profile_view)
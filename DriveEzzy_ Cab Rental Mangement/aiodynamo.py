@@ -0,0 +1,183 @@
+"""Async DynamoDB backend for the ASGI app (aioboto3)
+
+Requests are built by the synchronous DynamoDBStorage (the same booking and
+cancellation transactions, the same My Bookings query) and sent with an
+aiobotocore client, so both modes write identical items. Python values are
+converted to the wire format here because, unlike boto3's resource client,
+a plain client doesn't do it. AsyncSingleTableStorage does the same for the
+single-table layout (singletable.py).
+"""
+import asyncio
+from contextlib import AsyncExitStack
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from aiostorage import AsyncStorage
+from singletable import email_key, user_key, without_keys
+from storage import BookingUnavailable, claimable_days
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def to_wire(values):
+    """{name: python value} -> {name: DynamoDB attribute value}"""
+    return {name: serializer.serialize(value) for name, value in values.items()}
+
+
+def from_wire(item):
+    return {name: deserializer.deserialize(value) for name, value in item.items()} if item else None
+
+
+def wire_request(request):
+    """Request arguments in plain Python values, for a plain client"""
+    request = dict(request)
+    for field in ('Item', 'Key', 'ExpressionAttributeValues'):
+        if field in request:
+            request[field] = to_wire(request[field])
+    return request
+
+
+def wire_action(action):
+    """A TransactWriteItems action in plain Python values, for a plain client"""
+    (kind, request), = action.items()
+    return {kind: wire_request(request)}
+
+
+class AsyncDynamoDBStorage(AsyncStorage):
+    """Async counterpart of a DynamoDBStorage, sharing its tables and config"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.names = storage.names
+        self.client = None
+        self.exit_stack = None
+        self.lock = None
+
+    async def get_client(self):
+        # One client per process, opened on first use inside the server's event loop
+        if self.client is None:
+            if self.lock is None:
+                self.lock = asyncio.Lock()
+            async with self.lock:
+                if self.client is None:
+                    import aioboto3  # optional dependency, only needed in async mode
+
+                    exit_stack = AsyncExitStack()
+                    client = await exit_stack.enter_async_context(
+                        aioboto3.Session().client('dynamodb', **self.storage.client_options)
+                    )
+                    if self.storage.resilience is not None:
+                        self.storage.resilience.instrument_async(client)
+                    self.client = client
+                    self.exit_stack = exit_stack
+        return self.client
+
+    async def get_user(self, user_id):
+        client = await self.get_client()
+        response = await client.get_item(TableName=self.names['users'], Key=to_wire({'id': user_id}))
+        return from_wire(response.get('Item'))
+
+    async def get_user_by_email(self, email):
+        client = await self.get_client()
+        response = await client.query(
+            TableName=self.names['users'],
+            IndexName='EmailIndex',
+            KeyConditionExpression='email = :email',
+            ExpressionAttributeValues=to_wire({':email': email})
+        )
+        return from_wire(response['Items'][0]) if response['Items'] else None
+
+    async def create_user(self, user):
+        client = await self.get_client()
+        await client.put_item(TableName=self.names['users'], Item=to_wire(user))
+
+    async def update_password(self, user_id, password):
+        client = await self.get_client()
+        await client.update_item(
+            TableName=self.names['users'],
+            Key=to_wire({'id': user_id}),
+            UpdateExpression='SET #password = :password',
+            ExpressionAttributeNames={'#password': 'password'},
+            ExpressionAttributeValues=to_wire({':password': password})
+        )
+
+    async def create_booking(self, booking, event=None):
+        car_type, days = claimable_days(booking)
+        capacity = self.storage.fleet_capacity
+        if capacity is None:
+            # The Fleet table is scanned once per process, off the event loop
+            await asyncio.to_thread(self.storage.capacity, car_type)
+            capacity = self.storage.fleet_capacity
+        if capacity[car_type] < 1:
+            raise BookingUnavailable(car_type)
+
+        client = await self.get_client()
+        actions = self.storage.booking_actions(booking, event, capacity[car_type])
+        try:
+            await client.transact_write_items(TransactItems=[wire_action(action) for action in actions])
+        except client.exceptions.TransactionCanceledException as e:
+            raise self.storage.booking_error(e, booking, car_type)
+
+    async def get_booking(self, booking_id):
+        client = await self.get_client()
+        response = await client.get_item(TableName=self.names['bookings'], Key=to_wire({'booking_id': booking_id}))
+        return from_wire(response.get('Item'))
+
+    async def list_bookings(self, user_id, limit=20, cursor=None):
+        client = await self.get_client()
+        response = await client.query(**self.storage.list_bookings_query(user_id, limit, cursor))
+        return self.storage.list_bookings_page(response, limit)
+
+    async def cancel_booking(self, booking_id, cancelled_at, user_id=None):
+        client = await self.get_client()
+        response = await client.get_item(**wire_request(self.storage.cancel_lookup(booking_id)))
+        booking = from_wire(response.get('Item'))
+        if not self.storage.cancellable(booking, user_id):
+            return False
+
+        actions = self.storage.cancel_actions(booking, cancelled_at, user_id)
+        try:
+            await client.transact_write_items(TransactItems=[wire_action(action) for action in actions])
+        except client.exceptions.TransactionCanceledException:
+            # Someone else cancelled it first
+            return False
+        return True
+
+    async def close(self):
+        if self.exit_stack is not None:
+            await self.exit_stack.aclose()
+            self.client = self.exit_stack = None
+
+
+class AsyncSingleTableStorage(AsyncDynamoDBStorage):
+    """Async counterpart of a SingleTableStorage; bookings, My Bookings and
+    cancellations are built by the storage and need no override"""
+
+    async def get_item(self, key, **kwargs):
+        client = await self.get_client()
+        response = await client.get_item(TableName=self.names['main'], Key=to_wire(key), ConsistentRead=True,
+                                         **kwargs)
+        return from_wire(response.get('Item'))
+
+    async def transact(self, actions):
+        client = await self.get_client()
+        await client.transact_write_items(TransactItems=[wire_action(action) for action in actions])
+
+    async def get_user(self, user_id):
+        return without_keys(await self.get_item(user_key(user_id)))
+
+    async def get_user_by_email(self, email):
+        return without_keys(await self.get_item(email_key(email)))
+
+    async def create_user(self, user):
+        await self.transact(self.storage.user_actions(user))
+
+    async def update_password(self, user_id, password):
+        user = await self.get_user(user_id)
+        if user is not None:
+            await self.transact(self.storage.password_actions(user, password))
+
+    async def get_booking(self, booking_id):
+        key = await self.get_item(self.storage.booking_id_key(booking_id))
+        return without_keys(await self.get_item(self.storage.booking_key(key))) if key else None
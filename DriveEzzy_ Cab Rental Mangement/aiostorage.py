@@ -0,0 +1,232 @@
+"""Async storage backends for the ASGI app (asgi.py)
+
+They implement the request-path half of the Storage interface (users,
+booking writes, My Bookings, cancellations) as coroutines with the same
+arguments, results and exceptions as the synchronous backends. Everything
+else (fleet, outbox, rate tables, rollups) is still read by the availability
+and pricing engines and the outbox worker through the synchronous backend,
+off the event loop.
+
+    memory    AsyncMemoryStorage wrapping the app's MemoryStorage
+    sqlite    aiosqlite; each connection runs its statements on its own thread
+    dynamodb  aioboto3 (aiodynamo.py)
+"""
+import sqlite3
+from collections import deque
+from contextlib import asynccontextmanager
+
+from pricing import to_paise
+from storage import (BookingUnavailable, DuplicateBooking, SQLiteStorage, booking_record, bookings_page,
+                     claimable_days, event_row, rollup_key)
+
+
+class AsyncStorage:
+    """Async repository interface implemented by every async backend"""
+
+    async def get_user(self, user_id):
+        raise NotImplementedError
+
+    async def get_user_by_email(self, email):
+        raise NotImplementedError
+
+    async def create_user(self, user):
+        raise NotImplementedError
+
+    async def update_password(self, user_id, password):
+        raise NotImplementedError
+
+    async def create_booking(self, booking, event=None):
+        """Same contract as Storage.create_booking"""
+        raise NotImplementedError
+
+    async def get_booking(self, booking_id):
+        raise NotImplementedError
+
+    async def list_bookings(self, user_id, limit=20, cursor=None):
+        raise NotImplementedError
+
+    async def cancel_booking(self, booking_id, cancelled_at, user_id=None):
+        """Same contract as Storage.cancel_booking"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Release connections; called when the server shuts down"""
+
+
+class AsyncMemoryStorage(AsyncStorage):
+    """Runs a MemoryStorage's methods inline (tests and benchmarks)"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def get_user(self, user_id):
+        return self.storage.get_user(user_id)
+
+    async def get_user_by_email(self, email):
+        return self.storage.get_user_by_email(email)
+
+    async def create_user(self, user):
+        self.storage.create_user(user)
+
+    async def update_password(self, user_id, password):
+        self.storage.update_password(user_id, password)
+
+    async def create_booking(self, booking, event=None):
+        self.storage.create_booking(booking, event)
+
+    async def get_booking(self, booking_id):
+        return self.storage.get_booking(booking_id)
+
+    async def list_bookings(self, user_id, limit=20, cursor=None):
+        return self.storage.list_bookings(user_id, limit, cursor)
+
+    async def cancel_booking(self, booking_id, cancelled_at, user_id=None):
+        return self.storage.cancel_booking(booking_id, cancelled_at, user_id)
+
+
+class AsyncSQLiteStorage(AsyncStorage):
+    """aiosqlite backend with the statements and pragmas of SQLiteStorage
+
+    Connections are pooled like SQLiteStorage's. SQLite itself is not
+    asynchronous: aiosqlite gives each connection a thread, so the event
+    loop never blocks, but statements still run one per connection at a time.
+    """
+
+    def __init__(self, database_path, pool_size=8, statement_cache_size=128):
+        self.database_path = database_path
+        self.pool_size = pool_size
+        self.statement_cache_size = statement_cache_size
+        # A deque rather than an asyncio.Queue, so the pool isn't tied to one event loop
+        self.pool = deque()
+
+    async def connect(self):
+        import aiosqlite  # optional dependency, only needed in async mode
+
+        conn = await aiosqlite.connect(self.database_path, timeout=5,
+                                       cached_statements=self.statement_cache_size)
+        conn.row_factory = sqlite3.Row
+        for pragma in SQLiteStorage.PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a pooled connection, opening one if the pool is empty"""
+        try:
+            conn = self.pool.pop()
+        except IndexError:
+            conn = await self.connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            if len(self.pool) < self.pool_size:
+                self.pool.append(conn)
+            else:
+                await conn.close()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """BEGIN IMMEDIATE transaction, as in SQLiteStorage.transaction"""
+        async with self.connection() as conn:
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+
+    async def fetch_one(self, query, params):
+        async with self.connection() as conn:
+            async with conn.execute(query, params) as cursor:
+                row = await cursor.fetchone()
+        return dict(row) if row else None
+
+    async def execute(self, query, params):
+        async with self.transaction() as conn:
+            await conn.execute(query, params)
+
+    async def get_user(self, user_id):
+        return await self.fetch_one("SELECT * FROM users WHERE id = ?", (user_id,))
+
+    async def get_user_by_email(self, email):
+        return await self.fetch_one("SELECT * FROM users WHERE email = ?", (email,))
+
+    async def create_user(self, user):
+        await self.execute(
+            "INSERT INTO users (id, name, email, password, mobile_number, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (user['id'], user['name'], user['email'], user['password'], user['mobile_number'], user['created_at'])
+        )
+
+    async def update_password(self, user_id, password):
+        await self.execute("UPDATE users SET password = ? WHERE id = ?", (password, user_id))
+
+    async def create_booking(self, booking, event=None):
+        car_type, days = claimable_days(booking)
+        async with self.transaction() as conn:
+            async with conn.execute("SELECT 1 FROM bookings WHERE booking_id = ?", (booking['booking_id'],)) as cursor:
+                if await cursor.fetchone():
+                    raise DuplicateBooking(booking['booking_id'])
+
+            async with conn.execute("SELECT COUNT(*) FROM fleet WHERE car_type = ?", (car_type,)) as cursor:
+                capacity = (await cursor.fetchone())[0]
+            for day in days:
+                cursor = await conn.execute(SQLiteStorage.CLAIM_DAY, (car_type, day, capacity))
+                if capacity < 1 or cursor.rowcount != 1:
+                    raise BookingUnavailable(car_type)
+
+            await conn.execute(SQLiteStorage.INSERT_BOOKING, booking)
+            await conn.execute(SQLiteStorage.ROLLUP_UPSERT, rollup_key(booking, 'confirmed', booking['created_at'])
+                               + (1, to_paise(booking['total_price'])))
+            if event:
+                await conn.execute(SQLiteStorage.INSERT_EVENT, event_row(event))
+
+    async def get_booking(self, booking_id):
+        return await self.fetch_one("SELECT * FROM bookings WHERE booking_id = ?", (booking_id,))
+
+    async def list_bookings(self, user_id, limit=20, cursor=None):
+        query, params = SQLiteStorage.list_bookings_query(user_id, limit, cursor)
+        async with self.connection() as conn:
+            rows = await conn.execute_fetchall(query, params)
+        return bookings_page([booking_record(row) for row in rows], limit)
+
+    async def cancel_booking(self, booking_id, cancelled_at, user_id=None):
+        query, params = SQLiteStorage.cancel_query([booking_id], cancelled_at, user_id)
+        async with self.transaction() as conn:
+            rows = await conn.execute_fetchall(query, params)
+            if not rows:
+                return False
+            inventory, rollups = SQLiteStorage.release_params(rows, cancelled_at)
+            await conn.executemany(SQLiteStorage.RELEASE_DAYS, inventory)
+            await conn.executemany(SQLiteStorage.ROLLUP_UPSERT, rollups)
+        return True
+
+    async def close(self):
+        while self.pool:
+            await self.pool.pop().close()
+
+
+def create_async_storage(config, storage):
+    """Async counterpart of the synchronous backend `storage`, selected by
+    config['STORAGE_BACKEND'] like create_storage"""
+    backend = config.get('STORAGE_BACKEND', 'sqlite')
+
+    if backend == 'sqlite':
+        return AsyncSQLiteStorage(
+            config.get('DATABASE_PATH', 'car_rental.db'),
+            pool_size=config.get('SQLITE_POOL_SIZE', 8)
+        )
+
+    if backend == 'memory':
+        return AsyncMemoryStorage(storage)
+
+    if backend == 'dynamodb':
+        from aiodynamo import AsyncDynamoDBStorage, AsyncSingleTableStorage
+
+        if config.get('DYNAMODB_LAYOUT', 'tables') == 'single':
+            return AsyncSingleTableStorage(storage)
+        return AsyncDynamoDBStorage(storage)
+
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,320 @@
+"""The booking routes of views.py as Quart coroutines (see asgi.py)
+
+Same URLs, templates, flash messages and session cookie as the Flask app;
+only the data access differs. Storage calls are awaited on the async
+backend (aiostorage.py), and work that doesn't depend on each other runs
+concurrently: the availability and pricing engines poll storage side by side
+on worker threads. A booking and its confirmation event stay a single
+transaction, so the confirmation can never be sent for a booking that failed.
+Form validation and what follows a booking or cancellation are the helpers
+views.py uses, so the two apps can't drift apart; in particular both replace
+the user's booking version, which the Flask app's My Bookings ETag is built on.
+"""
+import asyncio
+import uuid
+from datetime import date, datetime, timedelta
+
+from quart import current_app, flash, jsonify, redirect, render_template, request, session, url_for
+
+from credentials import HasherBusy
+from notifications import booking_confirmed_event
+from pricing import UnknownCarType
+from storage import BookingUnavailable, DuplicateBooking, StorageBusy
+from views import (BOOKINGS_PAGE_SIZE, BUSY_MESSAGE, HASHER_BUSY_MESSAGE, MAX_BOOKINGS_PAGE_SIZE, InvalidStay,
+                   booking_cancelled, booking_created, booking_from_form, format_money, new_user, parse_stay)
+
+
+def get_storage():
+    """Return the async storage backend attached to the current app"""
+    return current_app.extensions['async_storage']
+
+
+async def refresh_engines(*engines):
+    """Let the engines whose poll is due read storage, concurrently and off
+    the event loop"""
+    due = [engine for engine in engines if engine.refresh_due()]
+    if due:
+        await asyncio.gather(*(asyncio.to_thread(engine.refresh) for engine in due))
+
+
+async def home():
+    return await render_template('home.html')
+
+
+async def register():
+    if request.method == 'POST':
+        form = await request.form
+
+        try:
+            storage = get_storage()
+
+            # Check the email first, so a taken one costs no hashing
+            if await storage.get_user_by_email(form['email']):
+                await flash("Email already registered. Please login.", "danger")
+                return redirect(url_for('login'))
+
+            password_hash = await asyncio.to_thread(current_app.extensions['credentials'].hash, form['password'])
+            await storage.create_user(new_user(form, password_hash))
+
+            await flash("Thanks for registering!", "success")
+            return redirect(url_for('login'))
+        except HasherBusy:
+            await flash(HASHER_BUSY_MESSAGE, "danger")
+            return await render_template('register.html'), 503, {'Retry-After': '1'}
+        except StorageBusy:
+            await flash(BUSY_MESSAGE, "danger")
+        except Exception as e:
+            await flash(f"Error: {str(e)}", "danger")
+
+    return await render_template('register.html')
+
+
+async def login():
+    if request.method == 'POST':
+        form = await request.form
+        email = form['email']
+        password = form['password']
+
+        try:
+            storage = get_storage()
+            credentials = current_app.extensions['credentials']
+            user = await storage.get_user_by_email(email)
+
+            if user:
+                matches, needs_rehash = await asyncio.to_thread(credentials.verify, password, user['password'])
+            else:
+                matches, needs_rehash = await asyncio.to_thread(credentials.verify_unknown_user, password), False
+
+            if matches:
+                # Upgrade plaintext rows and hashes made with an old cost setting
+                if needs_rehash:
+                    await storage.update_password(user['id'], await asyncio.to_thread(credentials.hash, password))
+                session['user_id'] = user['id']
+                session['username'] = user['name']
+                await flash("Login successful!", "success")
+                return redirect(url_for('car_type'))
+            else:
+                await flash("Invalid login. Please try again.", "danger")
+        except HasherBusy:
+            await flash(HASHER_BUSY_MESSAGE, "danger")
+            return await render_template('login.html'), 503, {'Retry-After': '1'}
+        except StorageBusy:
+            await flash(BUSY_MESSAGE, "danger")
+        except Exception as e:
+            await flash(f"Error: {str(e)}", "danger")
+
+    return await render_template('login.html')
+
+
+async def car_type():
+    if request.method == 'POST':
+        car_type = (await request.form)['car_type']
+        return redirect(url_for('book', car_type=car_type))
+
+    availability_engine = current_app.extensions['availability']
+    pricing = current_app.extensions['pricing']
+    today = date.today()
+    try:
+        await refresh_engines(availability_engine, pricing)
+    except Exception as e:
+        print(f"Error refreshing availability and rates: {str(e)}")
+    try:
+        availability = availability_engine.summary(today, today + timedelta(days=1))
+    except Exception as e:
+        print(f"Error loading availability: {str(e)}")
+        availability = None
+    try:
+        rates = pricing.daily_rates()
+    except Exception as e:
+        print(f"Error loading rates: {str(e)}")
+        rates = {}
+    return await render_template('car_type.html', availability=availability, rates=rates)
+
+
+async def api_availability():
+    try:
+        check_in, check_out = parse_stay(request.args['check_in'], request.args['check_out'])
+    except InvalidStay as e:
+        return jsonify(error=str(e)), 400
+    except (KeyError, ValueError):
+        return jsonify(error="check_in and check_out must be YYYY-MM-DD dates"), 400
+
+    availability = current_app.extensions['availability']
+    await refresh_engines(availability)
+    return jsonify(availability.summary(check_in, check_out))
+
+
+async def api_quote():
+    try:
+        car_type = request.args['car_type']
+        check_in, check_out = parse_stay(request.args['check_in'], request.args['check_out'])
+    except InvalidStay as e:
+        return jsonify(error=str(e)), 400
+    except (KeyError, ValueError):
+        return jsonify(error="car_type, check_in and check_out (YYYY-MM-DD) are required"), 400
+
+    pricing = current_app.extensions['pricing']
+    await refresh_engines(pricing)
+    try:
+        return jsonify(pricing.quote(car_type, check_in, check_out))
+    except UnknownCarType:
+        return jsonify(error=f"Unknown car type: {car_type}"), 404
+
+
+async def book(car_type):
+    if 'user_id' not in session:
+        await flash("Please login first to book a car", "danger")
+        return redirect(url_for('login'))
+
+    availability = current_app.extensions['availability']
+    pricing = current_app.extensions['pricing']
+    await refresh_engines(availability, pricing)
+
+    daily_rate = pricing.daily_rates().get(car_type.lower())
+    if daily_rate is None:
+        await flash(f"Unknown car type: {car_type}", "danger")
+        return redirect(url_for('car_type'))
+
+    if request.method == 'GET':
+        return await render_template('booking.html', car_type=car_type, price_per_day=daily_rate,
+                                     idempotency_key=str(uuid.uuid4()))
+
+    try:
+        form = await request.form
+        user_id = session.get('user_id')
+
+        try:
+            booking = booking_from_form(form, user_id, car_type, pricing=pricing)
+        except InvalidStay as e:
+            await flash(str(e), "danger")
+            return redirect(url_for('book', car_type=car_type))
+        booking_id = booking['booking_id']
+
+        # Cheap in-memory check first; the storage write below is the one
+        # that guarantees no overbooking across workers
+        storage = get_storage()
+        if not availability.reserve(booking):
+            if await storage.get_booking(booking_id):
+                return redirect(url_for('thank_you'))  # retry of a booking that took the last car
+            await flash(f"Sorry, no {car_type} is available for those dates.", "danger")
+            return redirect(url_for('car_type'))
+
+        # The booking and its confirmation event commit together; the outbox
+        # worker sends the confirmation
+        event = booking_confirmed_event(booking, session.get('username'))
+        try:
+            await storage.create_booking(booking, event)
+        except DuplicateBooking:
+            return redirect(url_for('thank_you'))
+        except BookingUnavailable:
+            availability.release(booking_id)
+            await asyncio.to_thread(availability.refresh, True)
+            await flash(f"Sorry, no {car_type} is available for those dates.", "danger")
+            return redirect(url_for('car_type'))
+        except BaseException:
+            availability.release(booking_id)
+            raise
+
+        booking_created(current_app.extensions, session, user_id)
+
+        return redirect(url_for('thank_you'))
+
+    except StorageBusy:
+        await flash(BUSY_MESSAGE, "danger")
+        return redirect(url_for('book', car_type=car_type))
+    except Exception as e:
+        await flash(f"Error creating booking: {str(e)}", "danger")
+        return redirect(url_for('car_type'))
+
+
+async def thank_you():
+    return await render_template('thank_you.html')
+
+
+async def my_bookings():
+    user_id = session.get('user_id')
+    if not user_id:
+        await flash("You need to log in to view your bookings.", "danger")
+        return redirect(url_for('login'))
+
+    try:
+        cursor = request.args.get('cursor')
+        bookings_list, next_cursor = await get_storage().list_bookings(
+            user_id, limit=BOOKINGS_PAGE_SIZE, cursor=cursor
+        )
+        return await render_template('my_bookings.html', bookings=bookings_list,
+                                     next_cursor=next_cursor, is_first_page=not cursor)
+    except StorageBusy:
+        await flash(BUSY_MESSAGE, "danger")
+        return await render_template('my_bookings.html', bookings=[])
+    except Exception as e:
+        await flash(f"Error retrieving bookings: {str(e)}", "danger")
+        return await render_template('my_bookings.html', bookings=[])
+
+
+async def api_bookings():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify(error="Login required"), 401
+
+    limit = min(request.args.get('limit', BOOKINGS_PAGE_SIZE, type=int), MAX_BOOKINGS_PAGE_SIZE)
+    try:
+        bookings_list, next_cursor = await get_storage().list_bookings(
+            user_id, limit=max(limit, 1), cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except StorageBusy:
+        return jsonify(error=BUSY_MESSAGE), 503, {'Retry-After': '1'}
+
+    return jsonify(bookings=bookings_list, next_cursor=next_cursor)
+
+
+async def cancel_booking(booking_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        await flash("You need to log in to cancel bookings.", "danger")
+        return redirect(url_for('login'))
+
+    try:
+        if not await get_storage().cancel_booking(booking_id, datetime.now().isoformat(), user_id):
+            await flash("Booking not found or already cancelled.", "danger")
+            return redirect(url_for('my_bookings'))
+        booking_cancelled(current_app.extensions, session, booking_id, user_id)
+
+        await flash("Booking cancelled successfully.", "success")
+    except StorageBusy:
+        await flash(BUSY_MESSAGE, "danger")
+    except Exception as e:
+        await flash(f"Error cancelling booking: {str(e)}", "danger")
+
+    return redirect(url_for('my_bookings'))
+
+
+async def logout():
+    session.clear()
+    await flash("You have been logged out.", "success")
+    return redirect(url_for('home'))
+
+
+# Database throttled outside a view's own error handling
+async def storage_busy(error):
+    return BUSY_MESSAGE, 503, {'Retry-After': '1'}
+
+
+def register_async_views(app):
+    """Register the booking routes on a Quart app (the URLs of register_views)"""
+    app.add_template_filter(format_money, 'money')
+    app.add_url_rule('/', view_func=home)
+    app.add_url_rule('/register', view_func=register, methods=['GET', 'POST'])
+    app.add_url_rule('/login', view_func=login, methods=['GET', 'POST'])
+    app.add_url_rule('/car_type', view_func=car_type, methods=['GET', 'POST'])
+    app.add_url_rule('/book/<car_type>', view_func=book, methods=['GET', 'POST'])
+    app.add_url_rule('/api/availability', view_func=api_availability)
+    app.add_url_rule('/api/quote', view_func=api_quote)
+    app.add_url_rule('/thank_you', view_func=thank_you)
+    app.add_url_rule('/my_bookings', view_func=my_bookings)
+    app.add_url_rule('/api/bookings', view_func=api_bookings)
+    app.add_url_rule('/cancel_booking/<booking_id>', view_func=cancel_booking, methods=['POST'])
+    app.add_url_rule('/logout', view_func=logout)
+    app.register_error_handler(StorageBusy, storage_busy)
@@ -0,0 +1,25 @@
+"""ASGI entry point: the booking app with async storage
+
+    uvicorn asgi:app --workers 2
+    hypercorn asgi:app --workers 2
+
+Same routes, templates and session cookie as cab.py / app.py; needs quart and
+aiosqlite (SQLite) or aioboto3 (DynamoDB). Admin and /metrics endpoints are
+only served by the Flask app. Create the schema once with
+`flask --app cab init-db` (or `--app app`) first.
+"""
+import os
+
+from factory import create_async_app
+
+app = create_async_app({
+    'STORAGE_BACKEND': os.environ.get('STORAGE_BACKEND', 'sqlite'),
+    'DATABASE_PATH': os.environ.get('DATABASE_PATH', 'car_rental.db'),
+    'DYNAMODB_LAYOUT': os.environ.get('DYNAMODB_LAYOUT', 'tables'),
+    'DYNAMODB_BILLING_MODE': os.environ.get('DYNAMODB_BILLING_MODE', 'PROVISIONED'),
+    'DYNAMODB_CLIENT_THROTTLE': os.environ.get('DYNAMODB_CLIENT_THROTTLE') == '1',
+    'AWS_REGION': os.environ.get('AWS_REGION', 'ap-south-1')
+})
+
+if __name__ == '__main__':
+    app.run(debug=True)
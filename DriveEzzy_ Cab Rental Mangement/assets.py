@@ -0,0 +1,228 @@
+"""Static asset pipeline
+
+`flask build-assets` copies everything under static/ into static/dist/ with a
+content hash in the file name (styles.3f9a1c2b7d4e.css), writes gzip and
+brotli variants of text assets, and resizes the background images into
+AVIF/WebP/JPEG variants for small, medium and large screens. The mapping
+from source names to built files is kept in static/dist/manifest.json.
+
+At run time url_for('static', filename='styles.css') resolves to the hashed
+file, and the static view serves the best precompressed variant the browser
+accepts. Hashed files never change, so they are sent with a one-year
+immutable Cache-Control; everything is served with an ETag and answers
+If-None-Match with 304. Without a build, the original files are served as
+before. Pillow and brotli are optional; their variants are skipped if the
+package is missing.
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import shutil
+import threading
+
+from flask import abort, request, send_file, url_for
+from markupsafe import Markup
+from werkzeug.security import safe_join
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Text assets worth serving precompressed
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+
+# Images that get resized copies, and the widths to produce
+RESPONSIVE_IMAGES = {
+    'images/car-rental-bg.jpg': (640, 1280, 1920)
+}
+
+# Best first: (Pillow format, extension, MIME type, save options)
+IMAGE_FORMATS = (
+    ('AVIF', '.avif', 'image/avif', {'quality': 50}),
+    ('WEBP', '.webp', 'image/webp', {'quality': 75, 'method': 6}),
+    ('JPEG', '.jpg', 'image/jpeg', {'quality': 80, 'progressive': True, 'optimize': True}),
+)
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def hashed_name(filename, data):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def write_asset(dist, name, data):
+    """Write one built file, plus .gz/.br variants for text assets"""
+    path = os.path.join(dist, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if not name.endswith(COMPRESSIBLE):
+        return
+
+    variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+def resize_image(dist, filename, data, widths):
+    """Write the responsive variants of one image; returns their manifest entries"""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        print(f"Pillow is not installed; skipping responsive variants of {filename}")
+        return []
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert('RGB')
+    root = os.path.splitext(filename)[0]
+    variants = []
+    for width in widths:
+        if image.width > width:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        else:
+            resized = image
+        sources = []
+        for image_format, ext, mimetype, options in IMAGE_FORMATS:
+            buffer = io.BytesIO()
+            try:
+                resized.save(buffer, image_format, **options)
+            except (KeyError, OSError):
+                continue  # this Pillow build can't write the format
+            name = hashed_name(f"{root}-{width}{ext}", buffer.getvalue())
+            write_asset(dist, name, buffer.getvalue())
+            sources.append({'file': f"{DIST_DIR}/{name}", 'type': mimetype, 'bytes': buffer.tell()})
+        variants.append({'width': width, 'sources': sources})
+    return variants
+
+
+def build_assets(static_folder):
+    """Rebuild static/dist from the source assets and return the manifest"""
+    dist = os.path.join(static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {'files': {}, 'images': {}}
+
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            built = hashed_name(filename, data)
+            write_asset(dist, built, data)
+            manifest['files'][filename] = f"{DIST_DIR}/{built}"
+            if filename in RESPONSIVE_IMAGES:
+                manifest['images'][filename] = resize_image(dist, filename, data, RESPONSIVE_IMAGES[filename])
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetManifest:
+    """Built asset names, read from static/dist/manifest.json on first use"""
+
+    def __init__(self, static_folder, url_for=url_for):
+        self.static_folder = static_folder
+        self.url_for = url_for  # quart.url_for in the ASGI app
+        self.lock = threading.Lock()
+        self.files = None
+        self.images = None
+        self.built = frozenset()
+
+    def load(self):
+        with self.lock:
+            if self.files is not None:
+                return
+            try:
+                with open(os.path.join(self.static_folder, DIST_DIR, MANIFEST)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+            self.images = manifest.get('images', {})
+            self.built = frozenset(manifest.get('files', {}).values()).union(
+                source['file'] for variants in self.images.values() for v in variants for source in v['sources']
+            )
+            self.files = manifest.get('files', {})
+
+    def resolve(self, filename):
+        """Hashed name for a source asset (the source name if not built)"""
+        if self.files is None:
+            self.load()
+        return self.files.get(filename, filename)
+
+    def is_built(self, filename):
+        if self.files is None:
+            self.load()
+        return filename in self.built
+
+    def image_variants(self, filename):
+        """[(width, image-set() arguments)] for a responsive image, narrowest first"""
+        if self.files is None:
+            self.load()
+        # Built from our own manifest, so safe to drop into a <style> block unescaped
+        url_for = self.url_for
+        return [
+            (variant['width'], Markup(', '.join(f'url("{url_for("static", filename=source["file"])}") type("{source["type"]}")'
+                                                for source in variant['sources'])))
+            for variant in self.images.get(filename, [])
+        ]
+
+
+def send_static(manifest, static_folder, filename):
+    """Static view: precompressed variants, immutable caching for hashed files"""
+    path = safe_join(static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    encoding = None
+    compressible = filename.endswith(COMPRESSIBLE)
+    if compressible:
+        for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[name] and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, name
+                break
+
+    built = manifest.is_built(filename)
+    response = send_file(
+        path,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        conditional=True,
+        etag=True,
+        max_age=IMMUTABLE_MAX_AGE if built else None
+    )
+    if built:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_assets(app, url_for=url_for, serve=True):
+    """Point url_for('static') at built assets and serve them (unless the
+    app serves static files itself, as Quart does)"""
+    manifest = AssetManifest(app.static_folder, url_for)
+    app.extensions['assets'] = manifest
+
+    @app.url_defaults
+    def hashed_static_urls(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifest.resolve(values['filename'])
+
+    if serve:
+        app.view_functions['static'] = lambda filename: send_static(manifest, app.static_folder, filename)
+    app.add_template_global(manifest.image_variants, 'image_variants')
+    return manifest
@@ -0,0 +1,137 @@
+"""Fleet availability engine
+
+Keeps a per-day occupancy count for every car type in memory, so "how many
+SUVs are free from check_in to check_out" is answered from a few dictionary
+lookups instead of scanning bookings. The counts are built once from the
+active bookings and then kept up to date incrementally: bookings made through
+this process are applied immediately, and bookings made by other workers are
+picked up by polling the storage backend for changes.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+
+
+def parse_day(value):
+    """Turn a YYYY-MM-DD string (or date) into a day ordinal"""
+    if isinstance(value, str):
+        value = datetime.strptime(value[:10], "%Y-%m-%d").date()
+    return value.toordinal()
+
+
+def booked_days(pickup, dropoff):
+    """Days a car is out: pickup day up to (not including) the dropoff day"""
+    start = parse_day(pickup)
+    return range(start, max(parse_day(dropoff), start + 1))
+
+
+class AvailabilityEngine:
+    def __init__(self, storage, refresh_interval=2.0):
+        self.storage = storage
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.last_refresh = 0.0
+        self.watermark = None
+        self.fleet = Counter()
+        # car_type -> {day ordinal: cars out}, booking_id -> (car_type, days)
+        self.occupancy = defaultdict(Counter)
+        self.active = {}
+
+    def load(self):
+        """Rebuild fleet and occupancy from the storage backend"""
+        watermark = datetime.now().isoformat()
+        fleet = self.storage.get_fleet()
+        bookings = self.storage.active_bookings(date.today().isoformat())
+
+        with self.lock:
+            self.fleet = Counter(v['car_type'] for v in fleet)
+            self.occupancy = defaultdict(Counter)
+            self.active = {}
+            for booking in bookings:
+                self._apply(booking)
+            self.watermark = watermark
+            self.last_refresh = time.monotonic()
+            self.loaded = True
+
+    def refresh_due(self):
+        """Whether the next refresh() will read from storage"""
+        return not self.loaded or time.monotonic() - self.last_refresh >= self.refresh_interval
+
+    def refresh(self, force=False):
+        """Pick up bookings made or cancelled by other processes"""
+        if not self.loaded:
+            self.load()
+            return
+        if not force and time.monotonic() - self.last_refresh < self.refresh_interval:
+            return
+
+        watermark = datetime.now().isoformat()
+        changes = self.storage.changed_bookings(self.watermark)
+        with self.lock:
+            for booking in changes:
+                if booking['status'] == 'confirmed':
+                    self._apply(booking)
+                else:
+                    self._remove(booking['booking_id'])
+            self.watermark = watermark
+            self.last_refresh = time.monotonic()
+
+    def _apply(self, booking):
+        # Idempotent: bookings we reserved ourselves come back from refresh()
+        if booking['booking_id'] in self.active:
+            return
+        car_type = booking['car_type'].lower()
+        days = booked_days(booking['pickup'], booking['dropoff'])
+        self.active[booking['booking_id']] = (car_type, days)
+        occupancy = self.occupancy[car_type]
+        for day in days:
+            occupancy[day] += 1
+
+    def _remove(self, booking_id):
+        entry = self.active.pop(booking_id, None)
+        if entry:
+            car_type, days = entry
+            occupancy = self.occupancy[car_type]
+            for day in days:
+                occupancy[day] -= 1
+
+    def _available(self, car_type, days):
+        occupancy = self.occupancy[car_type]
+        return self.fleet[car_type] - max((occupancy[day] for day in days), default=0)
+
+    def available(self, car_type, check_in, check_out):
+        """Number of cars of this type free on every day of the range"""
+        self.refresh()
+        with self.lock:
+            return max(self._available(car_type.lower(), booked_days(check_in, check_out)), 0)
+
+    def summary(self, check_in, check_out):
+        """Availability of every car type for the range"""
+        self.refresh()
+        days = booked_days(check_in, check_out)
+        with self.lock:
+            return {car_type: max(self._available(car_type, days), 0) for car_type in self.fleet}
+
+    def reserve(self, booking):
+        """Claim a car for the booking if one is free; returns False otherwise"""
+        self.refresh()
+        with self.lock:
+            days = booked_days(booking['pickup'], booking['dropoff'])
+            if self._available(booking['car_type'].lower(), days) <= 0:
+                return False
+            self._apply(booking)
+            return True
+
+    def release(self, booking_id):
+        """Give back the car held by a booking (cancelled or failed to save)"""
+        with self.lock:
+            self._remove(booking_id)
+
+
+def init_availability(app, storage):
+    """Create the availability engine and attach it to the Flask app"""
+    engine = AvailabilityEngine(storage, app.config.get('AVAILABILITY_REFRESH_SECONDS', 2.0))
+    app.extensions['availability'] = engine
+    return engine
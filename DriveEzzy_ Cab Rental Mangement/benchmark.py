@@ -0,0 +1,1034 @@
+"""Side-by-side benchmark of the storage backends
+
+Usage:
+    python benchmark.py [memory] [sqlite] [dynamodb] [sqlite-pool] [availability]
+    python benchmark.py stress [memory|sqlite|dynamodb]
+    python benchmark.py pageview [tables|single]  # DynamoDB calls and capacity per page view
+    python benchmark.py deserialize   # DynamoDB item -> booking conversion cost
+    python benchmark.py startup       # import time of each entry point (tests/test_startup.py enforces it)
+    python benchmark.py cache         # login lookups with and without the user cache
+    python benchmark.py notify        # booking latency: inline notification vs. outbox
+    python benchmark.py pricing       # quote cost: per-day loop vs. prefix sums
+    python benchmark.py assets        # home page weight before/after `flask build-assets`
+    python benchmark.py passwords     # scrypt cost vs. logins per second per core
+    python benchmark.py metrics       # instrumentation overhead and per-route breakdown
+    python benchmark.py bulk          # bulk import/export rows per second (SQLite)
+    python benchmark.py rollups       # month report: rollups vs. aggregating bookings
+    python benchmark.py async         # concurrent clients: threaded Flask vs. the ASGI app
+    python benchmark.py warmup        # a new worker's first requests, cold vs. warmed up
+    python benchmark.py cancel        # bulk cancellation: bookings per second by chunk size
+    python benchmark.py throttle      # a throttled table: legacy retries vs. resilience.py
+    python benchmark.py pages         # page views rendered vs. cached vs. answered with a 304
+    python benchmark.py profile       # request profiling: not installed vs. idle vs. every request
+
+The DynamoDB backend is only benchmarked when DYNAMODB_ENDPOINT_URL points at
+DynamoDB Local (e.g. http://localhost:8000) with the tables already created.
+"""
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from availability import AvailabilityEngine, booked_days
+from storage import (BookingUnavailable, DuplicateBooking, MemoryStorage, SQLiteStorage, StorageBusy,
+                     create_storage)
+
+
+def make_booking(user_id, i):
+    # Spread bookings over the calendar so the default fleet never sells out
+    pickup = date(2025, 1, 1) + timedelta(days=i)
+    return {
+        'booking_id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'car_type': 'sedan',
+        'num_days': 2,
+        'pickup': pickup.isoformat(),
+        'dropoff': (pickup + timedelta(days=2)).isoformat(),
+        'special_requests': '',
+        'payment_mode': 'upi',
+        'total_price': 5000,
+        'status': 'confirmed',
+        'created_at': f"{datetime.now().isoformat()}-{i:06d}"
+    }
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<20} {count / elapsed:>10.0f} ops/s")
+
+
+def bench_storage(backend, users=50, bookings_per_user=20):
+    config = {
+        'STORAGE_BACKEND': backend,
+        'DATABASE_PATH': os.path.join(tempfile.mkdtemp(), 'bench.db'),
+        'DYNAMODB_ENDPOINT_URL': os.environ.get('DYNAMODB_ENDPOINT_URL'),
+        'AWS_REGION': os.environ.get('AWS_REGION', 'ap-south-1'),
+    }
+    storage = create_storage(config)
+    storage.init_db()
+    print(f"{backend}:")
+
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    timed('create_user', users, lambda i: storage.create_user({
+        'id': user_ids[i],
+        'name': f"User {i}",
+        'email': f"user{i}-{user_ids[i]}@example.com",
+        'password': 'secret',
+        'mobile_number': '9999999999',
+        'created_at': datetime.now().isoformat()
+    }))
+    total = users * bookings_per_user
+    timed('create_booking', total,
+          lambda i: storage.create_booking(make_booking(user_ids[i % users], i)))
+    timed('get_user', total, lambda i: storage.get_user(user_ids[i % users]))
+    timed('list_bookings', users * 5, lambda i: storage.list_bookings(user_ids[i % users]))
+
+
+class UnpooledSQLiteStorage(SQLiteStorage):
+    """The old behaviour: a fresh rollback-journal connection per call"""
+
+    def acquire(self):
+        conn = sqlite3.connect(self.database_path, timeout=5)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn):
+        conn.close()
+
+
+def bench_sqlite_pool(threads=8, seconds=3):
+    """Mixed read/write throughput with one writer and several readers"""
+    print(f"sqlite connection pool ({threads} threads, 1 writer):")
+    for label, cls in (('unpooled', UnpooledSQLiteStorage), ('pooled+WAL', SQLiteStorage)):
+        storage = cls(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+        storage.init_db()
+        user_id = str(uuid.uuid4())
+        for i in range(200):
+            storage.create_booking(make_booking(user_id, i))
+
+        counts = [0] * threads
+        deadline = time.perf_counter() + seconds
+
+        def worker(n):
+            i = 0
+            while time.perf_counter() < deadline:
+                if n == 0:
+                    storage.create_booking(make_booking(user_id, i))
+                else:
+                    storage.get_booking('missing')
+                    storage.list_bookings(str(n))
+                i += 1
+            counts[n] = i
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        print(f"  {label:<12} writes {counts[0] / seconds:>8.0f}/s   reads {sum(counts[1:]) / seconds:>9.0f}/s")
+
+
+def bench_availability(bookings=20000, queries=100000):
+    """Availability lookups with a large booking history loaded"""
+    storage = MemoryStorage()
+    storage.fleet = [{'vehicle_id': str(i), 'car_type': 'suv', 'location': 'Main Depot'}
+                     for i in range(bookings)]
+    today = date.today()
+    for i in range(bookings):
+        booking = make_booking('bench', i)
+        start = today + timedelta(days=i % 365)
+        booking.update(car_type='suv', pickup=start.isoformat(),
+                       dropoff=(start + timedelta(days=1 + i % 7)).isoformat())
+        storage.create_booking(booking)
+
+    engine = AvailabilityEngine(storage, refresh_interval=3600)
+    start = time.perf_counter()
+    engine.load()
+    print(f"availability ({bookings} bookings):")
+    print(f"  {'load':<20} {(time.perf_counter() - start) * 1000:>10.1f} ms")
+
+    ranges = [(today + timedelta(days=i % 365), today + timedelta(days=i % 365 + 1 + i % 14))
+              for i in range(1000)]
+    start = time.perf_counter()
+    for i in range(queries):
+        check_in, check_out = ranges[i % 1000]
+        engine.available('suv', check_in, check_out)
+    elapsed = time.perf_counter() - start
+    print(f"  {'available()':<20} {elapsed / queries * 1e6:>10.2f} us/query")
+
+
+def stress_booking(backend, threads=32, attempts=200):
+    """Many threads race for the same few cars; fails on any double-booking"""
+    config = {
+        'STORAGE_BACKEND': backend,
+        'DATABASE_PATH': os.path.join(tempfile.mkdtemp(), 'stress.db'),
+        'DYNAMODB_ENDPOINT_URL': os.environ.get('DYNAMODB_ENDPOINT_URL'),
+        'AWS_REGION': os.environ.get('AWS_REGION', 'ap-south-1'),
+    }
+    storage = create_storage(config)
+    storage.init_db()
+    capacity = sum(1 for v in storage.get_fleet() if v['car_type'] == 'suv')
+    outcomes = {'confirmed': 0, 'unavailable': 0, 'duplicate': 0}
+    outcomes_lock = threading.Lock()
+
+    def worker(n):
+        previous = None
+        for i in range(attempts):
+            booking = make_booking(f"user-{n}", 0)
+            # Overlapping ranges in a 10-day window; every 4th attempt is a
+            # browser retry that reuses the previous booking_id
+            start = date(2030, 1, 1) + timedelta(days=i % 10)
+            if i % 4 == 3 and previous is not None:
+                booking['booking_id'] = previous
+            booking.update(car_type='suv', pickup=start.isoformat(),
+                           dropoff=(start + timedelta(days=1 + i % 3)).isoformat())
+            previous = booking['booking_id']
+            try:
+                storage.create_booking(booking)
+                result = 'confirmed'
+            except BookingUnavailable:
+                result = 'unavailable'
+            except DuplicateBooking:
+                result = 'duplicate'
+            with outcomes_lock:
+                outcomes[result] += 1
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    # Recount from the stored bookings, independent of the inventory counters
+    per_day = {}
+    for n in range(threads):
+        bookings, cursor = storage.list_bookings(f"user-{n}", limit=attempts)
+        for booking in bookings:
+            for day in booked_days(booking.pickup, booking.dropoff):
+                per_day[day] = per_day.get(day, 0) + 1
+    worst = max(per_day.values(), default=0)
+
+    print(f"stress {backend}: {threads * attempts / elapsed:.0f} attempts/s, {outcomes}")
+    print(f"  max cars out on one day: {worst} (fleet: {capacity})")
+    if worst > capacity:
+        print("  DOUBLE-BOOKING DETECTED")
+        sys.exit(1)
+
+
+def bench_dynamodb_pageview(layout='tables'):
+    """Round trips and consumed capacity for each page of the booking flow"""
+    from factory import create_app, init_db
+
+    app = create_app({
+        'STORAGE_BACKEND': 'dynamodb',
+        'DYNAMODB_LAYOUT': layout,
+        'DYNAMODB_ENDPOINT_URL': os.environ.get('DYNAMODB_ENDPOINT_URL'),
+        'AWS_REGION': os.environ.get('AWS_REGION', 'ap-south-1'),
+        'SCHEMA_MARKER': os.path.join(tempfile.mkdtemp(), 'schema-ready.json')
+    })
+    init_db(app)
+    storage = app.extensions['storage']
+
+    calls = []
+
+    def ask_for_capacity(params, model, **kwargs):
+        if 'ReturnConsumedCapacity' in model.input_shape.members:
+            params['ReturnConsumedCapacity'] = 'TOTAL'
+
+    def record(http_response, parsed, model, **kwargs):
+        capacity = parsed.get('ConsumedCapacity') or []
+        if isinstance(capacity, dict):
+            capacity = [capacity]
+        calls.append((model.name, sum(c.get('CapacityUnits', 0) for c in capacity)))
+
+    for dynamodb_client in (storage.client, storage.raw_client):
+        events = dynamodb_client.meta.events
+        events.register('provide-client-params.dynamodb', ask_for_capacity)
+        events.register('after-call.dynamodb', record)
+
+    client = app.test_client()
+    email = f"bench-{uuid.uuid4()}@example.com"
+    pages = [
+        ('POST /register', lambda: client.post('/register', data={
+            'name': 'Bench', 'email': email, 'password': 'secret', 'mobile_number': '1'})),
+        ('POST /login', lambda: client.post('/login', data={'email': email, 'password': 'secret'})),
+        ('GET /car_type', lambda: client.get('/car_type')),
+        ('POST /book/suv', lambda: client.post('/book/suv', data={
+            'check_in': '2031-01-01', 'check_out': '2031-01-03', 'special_requests': '',
+            'payment_mode': 'upi', 'idempotency_key': str(uuid.uuid4())})),
+        ('GET /my_bookings', lambda: client.get('/my_bookings')),
+    ]
+    print(f"dynamodb page views ({layout} layout):")
+    for label, request in pages:
+        calls.clear()
+        request()
+        operations = ', '.join(name for name, units in calls)
+        print(f"  {label:<18} {len(calls):>2} calls {sum(u for _, u in calls):>6.1f} CU  ({operations})")
+
+
+def bench_deserialize(items=1000, rounds=50):
+    """Old json.dumps/json.loads round trip vs. booking_from_item, per page"""
+    import json
+    from decimal import Decimal
+
+    from boto3.dynamodb.types import TypeDeserializer
+
+    from dynamo import booking_from_item
+    from storage import booking_record
+
+    raw_page = []
+    for i in range(items):
+        booking = make_booking('bench', i)
+        raw_page.append({
+            'booking_id': {'S': booking['booking_id']}, 'user_id': {'S': 'bench'},
+            'created_at': {'S': booking['created_at']}, 'car_type': {'S': 'sedan'},
+            'pickup': {'S': booking['pickup']}, 'dropoff': {'S': booking['dropoff']},
+            'num_days': {'N': '2'}, 'total_price': {'N': '5000.50'}, 'status': {'S': 'confirmed'},
+            'special_requests': {'S': ''}, 'payment_mode': {'S': 'upi'}
+        })
+
+    class DecimalEncoder(json.JSONEncoder):
+        def default(self, o):
+            return float(o) if isinstance(o, Decimal) else super().default(o)
+
+    deserializer = TypeDeserializer()
+
+    def old_path():
+        page = [{k: deserializer.deserialize(v) for k, v in item.items()} for item in raw_page]
+        return [booking_record(b) for b in json.loads(json.dumps(page, cls=DecimalEncoder))]
+
+    def new_path():
+        return [booking_from_item(item) for item in raw_page]
+
+    print(f"deserialize ({items} items per page):")
+    for label, func in (('json round trip', old_path), ('booking_from_item', new_path)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        print(f"  {label:<20} {(time.perf_counter() - start) / rounds * 1000:>10.2f} ms/page")
+
+
+def bench_cache(users=200, lookups=20000):
+    """get_user_by_email (the login lookup) on SQLite, uncached vs. cached"""
+    from cache import CachedStorage, FakeRedis, LRUCache, RedisCache
+
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    storage.init_db()
+    emails = []
+    for i in range(users):
+        user_id = str(uuid.uuid4())
+        emails.append(f"user{i}@example.com")
+        storage.create_user({'id': user_id, 'name': f"User {i}", 'email': emails[i],
+                             'password': 'secret', 'mobile_number': '9999999999',
+                             'created_at': datetime.now().isoformat()})
+
+    print(f"cache ({users} users, {lookups} logins):")
+    for label, cache in (('none', None), ('memory LRU', LRUCache()), ('fake-redis', RedisCache(FakeRedis()))):
+        target = storage if cache is None else CachedStorage(storage, cache)
+        timed(label, lookups, lambda i: target.get_user_by_email(emails[i % users]))
+        if cache is not None:
+            stats = cache.stats.as_dict()
+            print(f"    hits {stats['hits']}  misses {stats['misses']}  hit rate {stats['hit_rate']:.1%}")
+
+
+def bench_notify(bookings=50, delay=0.1, failure_rate=0.2):
+    """Booking latency with a slow notifier sent inline vs. queued in the outbox"""
+    from notifications import FakeNotifier, OutboxWorker, booking_confirmed_event
+
+    print(f"notify ({bookings} bookings, notifier {delay * 1000:.0f} ms/send, {failure_rate:.0%} failures):")
+    for label in ('inline', 'outbox'):
+        storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+        storage.init_db()
+        notifier = FakeNotifier(delay, failure_rate if label == 'outbox' else 0.0)
+        latencies = []
+        for i in range(bookings):
+            booking = make_booking('bench', i)
+            event = booking_confirmed_event(booking, 'Bench')
+            start = time.perf_counter()
+            if label == 'inline':
+                storage.create_booking(booking)
+                notifier.send(event)
+            else:
+                storage.create_booking(booking, event)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f"  {label:<8} booking p50 {latencies[len(latencies) // 2] * 1000:>7.2f} ms  "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:>7.2f} ms")
+
+        if label == 'outbox':
+            worker = OutboxWorker(storage, notifier, workers=8, backoff_base=0.01, max_attempts=10)
+            start = time.perf_counter()
+            while len(notifier.sent) < bookings and time.perf_counter() - start < 30:
+                worker.drain()
+            elapsed = time.perf_counter() - start
+            print(f"  drained {len(notifier.sent)}/{bookings} in {elapsed:.2f}s "
+                  f"({len(notifier.sent) / elapsed:.0f}/s, {worker.stats()})")
+
+
+def bench_pricing(quotes=20000):
+    """Quote a 3-day and a 30-day rental, day by day vs. from the prefix sums"""
+    from migrations import DEFAULT_RATES
+    from pricing import CompiledRates
+
+    rates = dict(DEFAULT_RATES, seasons=[{'start': '2025-12-20', 'end': '2026-01-05', 'multiplier': 1.25}],
+                 duration_tiers=[{'min_days': 7, 'discount_percent': 10}])
+    start = time.perf_counter()
+    compiled = CompiledRates(1, rates, date.today().toordinal(), 730)
+    print(f"pricing (compile {(time.perf_counter() - start) * 1000:.1f} ms for 730 days x "
+          f"{len(rates['car_types'])} car types):")
+    for num_days in (3, 30):
+        days = range(date.today().toordinal() + 10, date.today().toordinal() + 10 + num_days)
+        for label, func in (('per-day loop', lambda: sum(compiled.day_price('suv', day) for day in days)),
+                            ('prefix sum', lambda: compiled.subtotal('suv', days))):
+            start = time.perf_counter()
+            for _ in range(quotes):
+                func()
+            print(f"  {num_days:>2} days {label:<14} {(time.perf_counter() - start) / quotes * 1e6:>8.2f} us/quote")
+
+
+def bench_assets():
+    """Bytes a first visit to the home page downloads, and requests a repeat visit makes"""
+    from factory import create_app
+
+    app = create_app({'STORAGE_BACKEND': 'memory', 'OUTBOX_ENABLED': False})
+    app.before_request_funcs.clear()  # static files only, no schema check
+    client = app.test_client()
+    manifest = app.extensions['assets']
+    if not manifest.resolve('styles.css').startswith('dist/'):
+        print("assets: run `flask --app cab build-assets` first")
+        return
+
+    def fetch(path, **headers):
+        response = client.get(path, headers=headers)
+        return response.status_code, len(response.data), response.headers
+
+    print("assets (home page: styles.css + hero background):")
+    css_bytes = fetch('/static/styles.css', **{'Accept-Encoding': ''})[1]
+    image_bytes = fetch('/static/images/car-rental-bg.jpg')[1]
+    print(f"  {'unbuilt':<22} {(css_bytes + image_bytes) / 1024:>8.1f} KB")
+
+    css = '/static/' + manifest.resolve('styles.css')
+    css_bytes = fetch(css, **{'Accept-Encoding': 'br, gzip'})[1]
+    with app.test_request_context():
+        variants = manifest.image_variants('images/car-rental-bg.jpg')
+    for width, image_set in variants:
+        for url, mimetype in re.findall(r'url\("([^"]+)"\) type\("([^"]+)"\)', image_set):
+            total = css_bytes + fetch(url)[1]
+            print(f"  {f'{width}w {mimetype}':<22} {total / 1024:>8.1f} KB")
+
+    etag = fetch(css, **{'Accept-Encoding': 'br'})[2]['ETag']
+    status, _, headers = fetch(css, **{'Accept-Encoding': 'br', 'If-None-Match': etag})
+    print(f"  revalidation: {status}; Cache-Control: {headers['Cache-Control']}")
+
+
+def bench_passwords(costs=(12, 13, 14, 15), logins=64):
+    """Hash time and pool throughput per scrypt cost, plus the verify cache"""
+    from credentials import PasswordHasher
+
+    workers = os.cpu_count() or 1
+    print(f"passwords ({workers} worker processes, {logins} logins per cost):")
+    for cost in costs:
+        hasher = PasswordHasher(cost=cost, workers=workers)
+        stored = hasher.hash('correct horse')  # also starts the pool
+        start = time.perf_counter()
+        hasher.hash('correct horse')
+        hash_ms = (time.perf_counter() - start) * 1000
+
+        # Cold logins: the verify cache is bypassed, so each one pays for a full hash
+        hasher.verified.ttl = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers * 4) as pool:
+            list(pool.map(lambda i: hasher.verify('correct horse', stored), range(logins)))
+        hasher.verified.ttl = 300
+        rate = logins / (time.perf_counter() - start)
+        print(f"  cost 2^{cost:<3} hash {hash_ms:>7.1f} ms  {rate:>7.1f} logins/s  {rate / workers:>7.1f} per core")
+
+        if cost == costs[-1]:
+            hasher.verify('correct horse', stored)
+            start = time.perf_counter()
+            for _ in range(10000):
+                hasher.verify('correct horse', stored)
+            print(f"  cached verify {(time.perf_counter() - start) / 10000 * 1e6:>10.1f} us/login")
+            start = time.perf_counter()
+            matches, rehash = hasher.verify('plaintext', 'plaintext')
+            upgraded = hasher.hash('plaintext')
+            print(f"  legacy plaintext row: matches={matches} rehash={rehash}; upgraded to "
+                  f"{upgraded[:upgraded.index('$', 8)]}$... in {(time.perf_counter() - start) * 1000:.1f} ms")
+        hasher.shutdown()
+
+
+def bench_metrics(bookings=100, page_views=500):
+    """Book and list bookings on SQLite with metrics off and on; report the
+    overhead and where the time went per route"""
+    from factory import create_app, init_db
+
+    print(f"metrics ({bookings} bookings, {page_views} x GET /my_bookings):")
+    for enabled in (False, True):
+        directory = tempfile.mkdtemp()
+        app = create_app({'DATABASE_PATH': os.path.join(directory, 'bench.db'),
+                          'SCHEMA_MARKER': os.path.join(directory, 'schema-ready.json'),
+                          'OUTBOX_ENABLED': False, 'METRICS_ENABLED': enabled,
+                          'METRICS_SLOW_REQUEST_SECONDS': 60.0, 'PASSWORD_HASH_COST': 12})
+        init_db(app)
+        client = app.test_client()
+        client.post('/register', data={'name': 'Bench', 'email': 'bench@example.com',
+                                       'password': 'secret', 'mobile_number': '1'})
+        client.post('/login', data={'email': 'bench@example.com', 'password': 'secret'})
+        start = time.perf_counter()
+        for i in range(bookings):
+            check_in = date(2031, 1, 1) + timedelta(days=i % 300)
+            client.post('/book/suv', data={'check_in': check_in.isoformat(),
+                                           'check_out': (check_in + timedelta(days=2)).isoformat(),
+                                           'special_requests': '', 'payment_mode': 'upi',
+                                           'idempotency_key': str(uuid.uuid4())})
+        for _ in range(page_views):
+            client.get('/my_bookings')
+        elapsed = time.perf_counter() - start
+        print(f"  metrics {'on ' if enabled else 'off'} {elapsed / (bookings + page_views) * 1000:>8.3f} ms/request")
+        app.extensions['credentials'].shutdown()
+
+    metrics = app.extensions['metrics']
+    queries = metrics.request_queries.summary()
+    for (method, route), (count, total) in sorted(metrics.request_seconds.summary().items()):
+        print(f"  {method:<5} {route:<18} {count:>5} requests  {total / count * 1000:>7.3f} ms avg  "
+              f"{queries[method, route][1] / count:>5.1f} queries")
+
+
+def bench_bulk(rows=20000):
+    """Import a CSV of bookings row by row vs. in chunks, then export it"""
+    import io
+    import tracemalloc
+
+    from bulk import export_bookings, import_bookings
+    from factory import create_app, init_db
+    from migrations import DEFAULT_FLEET
+
+    lines = ["user_email,car_type,pickup,dropoff,reference"]
+    for i in range(rows):
+        # Each car type has a car free on every day, so every row fits
+        car_type = list(DEFAULT_FLEET)[i % len(DEFAULT_FLEET)]
+        pickup = date(2031, 1, 1) + timedelta(days=(i // len(DEFAULT_FLEET)) * 2 % 3650)
+        lines.append(f"bulk@example.com,{car_type},{pickup},{pickup + timedelta(days=2)},{i}")
+    data = '\n'.join(lines) + '\n'
+
+    print(f"bulk ({rows} CSV rows, SQLite):")
+    for label, chunk_size in (('row by row', 1), ('chunks of 500', 500)):
+        directory = tempfile.mkdtemp()
+        app = create_app({'DATABASE_PATH': os.path.join(directory, 'bench.db'),
+                          'SCHEMA_MARKER': os.path.join(directory, 'schema-ready.json'),
+                          'OUTBOX_ENABLED': False, 'METRICS_ENABLED': False})
+        init_db(app)
+        app.extensions['storage'].create_user({'id': 'bulk', 'name': 'Bulk', 'email': 'bulk@example.com',
+                                               'password': 'x', 'mobile_number': '1',
+                                               'created_at': datetime.now().isoformat()})
+        with app.app_context():
+            report = import_bookings(io.StringIO(data), 'csv', chunk_size)
+        print(f"  import {label:<14} {report.as_dict()['rows_per_second']:>8} rows/s  "
+              f"({report.imported} imported, {report.rejected} rejected)")
+
+    for fmt in ('csv', 'jsonl'):
+        tracemalloc.start()
+        start = time.perf_counter()
+        with app.app_context():
+            size = sum(len(chunk) for chunk in export_bookings(fmt))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  export {fmt:<14} {rows / elapsed:>8.0f} rows/s  "
+              f"({size / 1024 / 1024:.1f} MB streamed, peak {peak / 1024 / 1024:.1f} MB held)")
+
+
+def bench_rollups(sizes=(10000, 40000, 160000), reports=50):
+    """One month's report from the rollups vs. GROUP BY over the bookings,
+    as the booking history grows (SQLite)"""
+    from migrations import DEFAULT_FLEET
+    from reports import booking_report
+
+    car_types = list(DEFAULT_FLEET)
+    print(f"rollups (report for 2030-06, {reports} runs each, SQLite):")
+    for size in sizes:
+        storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+        storage.init_db()
+        with storage.transaction() as conn:
+            # Written directly, spread over 2030; inventory doesn't matter here
+            conn.executemany(
+                "INSERT INTO bookings (booking_id, user_id, car_type, num_days, pickup, dropoff, special_requests, "
+                "payment_mode, total_price, status, created_at, cancelled_at) "
+                "VALUES (?, 'u', ?, 1, '2031-01-01', '2031-01-02', '', 'upi', ?, ?, ?, ?)",
+                [(str(i), car_types[i % 3], 2500 + i % 7 * 500, 'cancelled' if i % 10 == 0 else 'confirmed',
+                  (datetime(2030, 1, 1) + timedelta(minutes=i * 525600 // size)).isoformat(),
+                  (datetime(2030, 1, 2) + timedelta(minutes=i * 525600 // size)).isoformat() if i % 10 == 0 else None)
+                 for i in range(size)]
+            )
+        start = time.perf_counter()
+        rows = storage.rebuild_rollups()
+        backfill = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(reports):
+            storage.fetch_all(
+                "SELECT substr(created_at, 1, 10) AS day, lower(car_type) AS car_type, COUNT(*), SUM(total_price) "
+                "FROM bookings WHERE created_at BETWEEN ? AND ? GROUP BY 1, 2 "
+                "UNION ALL SELECT substr(cancelled_at, 1, 10), lower(car_type), COUNT(*), SUM(total_price) "
+                "FROM bookings WHERE status = 'cancelled' AND cancelled_at BETWEEN ? AND ? GROUP BY 1, 2",
+                ('2030-06-01', '2030-06-30~', '2030-06-01', '2030-06-30~')
+            )
+        scan = (time.perf_counter() - start) / reports
+
+        start = time.perf_counter()
+        for _ in range(reports):
+            booking_report(storage, '2030-06-01', '2030-06-30')
+        rollup = (time.perf_counter() - start) / reports
+        print(f"  {size:>7} bookings: aggregate bookings {scan * 1000:>7.2f} ms  "
+              f"rollups {rollup * 1000:>5.2f} ms  (backfill {rows} rows in {backfill:.2f}s)")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def bench_async(concurrency=(8, 64, 256), requests=2048, threads=8, latency=0.005):
+    """GET /api/bookings from many concurrent clients: the Flask app with
+    `threads` worker threads (gunicorn --threads) vs. one ASGI event loop
+
+    With the memory backend every storage call waits `latency` seconds, like
+    a DynamoDB round trip; the SQLite runs add no latency.
+    """
+    import asyncio
+
+    from factory import create_app, create_async_app, init_db
+
+    def slow_sync(method):
+        def call(*args, **kwargs):
+            time.sleep(latency)
+            return method(*args, **kwargs)
+        return call
+
+    def slow_async(method):
+        async def call(*args, **kwargs):
+            await asyncio.sleep(latency)
+            return method(*args, **kwargs)
+        return call
+
+    def threaded(app, users, clients):
+        # Clients beyond the worker threads queue, as they would for a free thread
+        workers = threading.BoundedSemaphore(threads)
+        latencies = []
+
+        def client(n):
+            test_client = app.test_client()
+            with test_client.session_transaction() as session:
+                session['user_id'] = users[n % len(users)]
+            for _ in range(requests // clients):
+                start = time.perf_counter()
+                with workers:
+                    test_client.get('/api/bookings')
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            list(pool.map(client, range(clients)))
+        return len(latencies) / (time.perf_counter() - start), percentile(latencies, 0.99)
+
+    async def evented(app, users, clients):
+        latencies = []
+        async with app.test_app() as test_app:
+            async def client(n):
+                test_client = test_app.test_client()
+                async with test_client.session_transaction() as session:
+                    session['user_id'] = users[n % len(users)]
+                for _ in range(requests // clients):
+                    start = time.perf_counter()
+                    await test_client.get('/api/bookings')
+                    latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client(n) for n in range(clients)))
+            elapsed = time.perf_counter() - start
+        return len(latencies) / elapsed, percentile(latencies, 0.99)
+
+    for backend in ('memory', 'sqlite'):
+        directory = tempfile.mkdtemp()
+        config = {'STORAGE_BACKEND': backend, 'DATABASE_PATH': os.path.join(directory, 'bench.db'),
+                  'SCHEMA_MARKER': os.path.join(directory, 'schema-ready.json'), 'CACHE_BACKEND': 'none',
+                  'OUTBOX_ENABLED': False, 'METRICS_ENABLED': False}
+        sync_app = create_app(config)
+        init_db(sync_app)
+        async_app = create_async_app(config)
+        storage = sync_app.extensions['storage']
+        if backend == 'memory':
+            # Both apps read the same bookings, each through its own kind of slow call
+            async_storage = async_app.extensions['async_storage']
+            async_storage.storage = storage
+            async_storage.list_bookings = slow_async(storage.list_bookings)
+            storage.list_bookings = slow_sync(storage.list_bookings)
+
+        users = [f"user-{n}" for n in range(32)]
+        for n, user_id in enumerate(users):
+            storage.create_user({'id': user_id, 'name': 'Bench', 'email': f"{user_id}@example.com",
+                                 'password': 'x', 'mobile_number': '1', 'created_at': datetime.now().isoformat()})
+            for i in range(5):
+                booking = make_booking(user_id, n * 5 + i)
+                storage.create_booking(booking)
+
+        delay = f", {latency * 1000:.0f} ms per storage call" if backend == 'memory' else ''
+        print(f"async ({backend}{delay}; {requests} x GET /api/bookings, {threads} threads vs. 1 event loop):")
+        for clients in concurrency:
+            sync_rate, sync_p99 = threaded(sync_app, users, clients)
+            async_rate, async_p99 = asyncio.run(evented(async_app, users, clients))
+            print(f"  {clients:>4} clients  threaded {sync_rate:>6.0f} req/s p99 {sync_p99 * 1000:>6.1f} ms   "
+                  f"async {async_rate:>6.0f} req/s p99 {async_p99 * 1000:>6.1f} ms")
+        sync_app.extensions['credentials'].shutdown()
+
+
+def bench_warmup(rounds=5):
+    """Latency of each route's first request in a new worker (a fresh app on
+    an existing database), without and with warmup.warm_up, and of a repeat"""
+    from factory import create_app, init_db
+    from warmup import warm_up
+
+    directory = tempfile.mkdtemp()
+    config = {'DATABASE_PATH': os.path.join(directory, 'bench.db'),
+              'SCHEMA_MARKER': os.path.join(directory, 'schema-ready.json'),
+              'OUTBOX_ENABLED': False, 'PASSWORD_HASH_COST': 12}
+    app = create_app(config)
+    init_db(app)
+    client = app.test_client()
+    client.post('/register', data={'name': 'Bench', 'email': 'bench@example.com',
+                                   'password': 'secret', 'mobile_number': '1'})
+    app.extensions['credentials'].shutdown()
+
+    requests = [
+        ('POST /login', lambda c: c.post('/login', data={'email': 'bench@example.com', 'password': 'secret'})),
+        ('GET /car_type', lambda c: c.get('/car_type')),
+        ('GET /my_bookings', lambda c: c.get('/my_bookings')),
+        ('GET /book/suv', lambda c: c.get('/book/suv')),
+    ]
+    print(f"warmup (SQLite, first request per route in a new worker, mean of {rounds}):")
+    results = {}
+    for mode in ('cold', 'warm'):
+        for _ in range(rounds):
+            app = create_app(config)
+            start = time.perf_counter()
+            if mode == 'warm':
+                warm_up(app, connections=4)
+            results.setdefault((mode, 'warm_up()'), []).append(time.perf_counter() - start)
+            client = app.test_client()
+            for label, send in requests:
+                start = time.perf_counter()
+                send(client)
+                results.setdefault((mode, label), []).append(time.perf_counter() - start)
+            # A second round on the same worker: the steady state
+            for label, send in requests:
+                start = time.perf_counter()
+                send(client)
+                results.setdefault(('repeat', label), []).append(time.perf_counter() - start)
+            app.extensions['outbox'].stop()
+            app.extensions['credentials'].shutdown()
+
+    def mean_ms(key):
+        return sum(results[key]) / len(results[key]) * 1000
+
+    print(f"  {'':<18} {'cold':>9} {'warmed up':>10} {'repeat':>9}")
+    print(f"  {'warm_up()':<18} {'':>9} {mean_ms(('warm', 'warm_up()')):>7.1f} ms")
+    for label, _ in requests:
+        print(f"  {label:<18} {mean_ms(('cold', label)):>6.1f} ms {mean_ms(('warm', label)):>7.1f} ms "
+              f"{mean_ms(('repeat', label)):>6.1f} ms")
+
+
+def bench_cancel(bookings=10000, chunk_sizes=(1, 10, 100, 500)):
+    """Cancel every booking of a car type over a range of days (a grounded
+    vehicle) on SQLite, `chunk` bookings per conditional UPDATE"""
+    from bulk import cancel_bookings
+    from factory import create_app, init_db
+    from migrations import DEFAULT_FLEET
+
+    print(f"cancel ({bookings} suv bookings, SQLite):")
+    for chunk_size in chunk_sizes:
+        directory = tempfile.mkdtemp()
+        app = create_app({'DATABASE_PATH': os.path.join(directory, 'bench.db'),
+                          'SCHEMA_MARKER': os.path.join(directory, 'schema-ready.json'),
+                          'OUTBOX_ENABLED': False, 'METRICS_ENABLED': False})
+        init_db(app)
+        storage = app.extensions['storage']
+        # Back-to-back two-day stays with every SUV booked
+        per_day = DEFAULT_FLEET['suv']
+        chunk = []
+        for i in range(bookings):
+            booking = make_booking('bench', i)
+            pickup = date(2031, 1, 1) + timedelta(days=(i // per_day) * 2)
+            booking.update(car_type='suv', pickup=pickup.isoformat(),
+                           dropoff=(pickup + timedelta(days=2)).isoformat())
+            chunk.append(booking)
+        for start in range(0, bookings, 500):
+            assert not storage.import_bookings(chunk[start:start + 500])
+
+        with app.app_context():
+            report = cancel_bookings('suv', '2031-01-01', '2099-12-31', chunk_size)
+        assert report.cancelled == bookings
+        print(f"  chunks of {chunk_size:>3}  {report.seconds:>6.2f}s  {report.cancelled / report.seconds:>8.0f} bookings/s")
+
+
+def bench_throttle(threads=16, attempts=40, capacity=40):
+    """The booking flow against tables that throttle past `capacity` items
+    per second (resilience.FaultInjector): botocore's legacy retries vs.
+    adaptive retries and coalesced reads, without and with the client-side
+    throttle"""
+    from botocore.exceptions import ClientError
+
+    prefix = f"bench{uuid.uuid4().hex[:6]}-"
+    base = {
+        'STORAGE_BACKEND': 'dynamodb',
+        'DYNAMODB_ENDPOINT_URL': os.environ.get('DYNAMODB_ENDPOINT_URL'),
+        'AWS_REGION': os.environ.get('AWS_REGION', 'ap-south-1'),
+        'DYNAMODB_TABLE_PREFIX': prefix,
+        'DYNAMODB_READ_CAPACITY': capacity,
+        'DYNAMODB_WRITE_CAPACITY': capacity
+    }
+    setup = create_storage(base)
+    setup.init_db()
+    setup.create_user({'id': 'hot', 'name': 'Hot', 'email': 'hot@example.com', 'password': '-',
+                       'mobile_number': '1', 'created_at': datetime.now().isoformat()})
+    scenarios = [
+        ('legacy retries', {'DYNAMODB_RETRY_MODE': 'legacy', 'DYNAMODB_MAX_ATTEMPTS': 11,
+                            'DYNAMODB_COALESCE_READS': False}),
+        ('adaptive', {}),
+        ('adaptive+bucket', {'DYNAMODB_CLIENT_THROTTLE': True}),
+    ]
+
+    print(f"throttle ({threads} threads x {attempts} requests, tables throttle past {capacity} items/s):")
+    for label, overrides in scenarios:
+        storage = create_storage(dict(base, DYNAMODB_FAULTS={'capacity': capacity, 'seed': 1}, **overrides))
+        outcomes = {'ok': 0, 'busy': 0, 'error': 0}
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(n):
+            for i in range(attempts):
+                start = time.perf_counter()
+                try:
+                    # A page view's mix: the session's user, a page of bookings, a booking
+                    if i % 4 == 0:
+                        booking = make_booking('hot', n * attempts + i)
+                        booking['pickup'] = (date(2032, 1, 1) + timedelta(days=n * attempts + i)).isoformat()
+                        storage.create_booking(booking)
+                    elif i % 4 == 1:
+                        storage.list_bookings('hot', limit=10)
+                    else:
+                        storage.get_user('hot')
+                    result = 'ok'
+                except (BookingUnavailable, DuplicateBooking):
+                    result = 'ok'
+                except StorageBusy:
+                    result = 'busy'
+                except ClientError:
+                    result = 'error'
+                with lock:
+                    outcomes[result] += 1
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(worker, range(threads)))
+        elapsed = time.perf_counter() - start
+
+        faults = storage.resilience.faults
+        stats = storage.resilience.stats()
+        print(f"  {label:<15} {len(latencies) / elapsed:>6.0f} req/s  ok {outcomes['ok']:>4}  "
+              f"failed {outcomes['busy'] + outcomes['error']:>4}  p50 {percentile(latencies, 0.5) * 1000:>6.1f} ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:>7.1f} ms")
+        print(f"  {'':<15} {sum(faults.requests.values())} DynamoDB requests, {stats['injected']} throttled, "
+              f"{stats['coalesced']} reads coalesced, {stats['client_throttled']} refused by the client")
+
+
+def bench_pages(bookings=20, page_views=2000):
+    """Page views on SQLite with the page cache off, on, and revalidated by a
+    browser that already has the page (If-None-Match)"""
+    from factory import create_app, init_db
+
+    print(f"pages ({page_views} views each, {bookings} bookings on My Bookings):")
+    for label, enabled, revalidate in (('rendered', False, False), ('cached', True, False), ('304', True, True)):
+        directory = tempfile.mkdtemp()
+        app = create_app({'DATABASE_PATH': os.path.join(directory, 'bench.db'),
+                          'SCHEMA_MARKER': os.path.join(directory, 'schema-ready.json'),
+                          'OUTBOX_ENABLED': False, 'METRICS_ENABLED': False, 'PASSWORD_HASH_COST': 12,
+                          'PAGE_CACHE_ENABLED': enabled})
+        init_db(app)
+        client = app.test_client()
+        client.post('/register', data={'name': 'Bench', 'email': 'bench@example.com',
+                                       'password': 'secret', 'mobile_number': '1'})
+        client.post('/login', data={'email': 'bench@example.com', 'password': 'secret'})
+        for i in range(bookings):
+            check_in = date(2031, 1, 1) + timedelta(days=i * 3)
+            client.post('/book/suv', data={'check_in': check_in.isoformat(),
+                                           'check_out': (check_in + timedelta(days=2)).isoformat(),
+                                           'special_requests': '', 'payment_mode': 'upi',
+                                           'idempotency_key': str(uuid.uuid4())})
+        client.get('/car_type')  # shows the flashed messages left by the requests above
+
+        results = []
+        for path in ('/', '/car_type', '/my_bookings'):
+            etag = client.get(path).headers.get('ETag')
+            headers = {'If-None-Match': etag} if revalidate and etag else {}
+            start = time.perf_counter()
+            for _ in range(page_views):
+                response = client.get(path, headers=headers)
+            elapsed = time.perf_counter() - start
+            results.append(f"{path} {elapsed / page_views * 1000:.3f} ms ({response.status_code})")
+        print(f"  {label:<9} " + '  '.join(results))
+        app.extensions['credentials'].shutdown()
+
+
+def bench_profile(bookings=20, page_views=1000, rounds=3):
+    """Page views on SQLite with profiling not installed, installed but idle
+    (the cost every request pays) and profiling every request; best of
+    `rounds` each"""
+    from factory import create_app, init_db
+    from profiling import PROFILE_HEADER, profile_token
+
+    paths = ('/', '/car_type', '/my_bookings')
+    print(f"profile ({page_views} x each of {', '.join(paths)}, best of {rounds}):")
+    baseline = None
+    for label, enabled, profiled in (('off', False, False), ('idle', True, False), ('profiled', True, True)):
+        directory = tempfile.mkdtemp()
+        app = create_app({'DATABASE_PATH': os.path.join(directory, 'bench.db'),
+                          'SCHEMA_MARKER': os.path.join(directory, 'schema-ready.json'),
+                          'OUTBOX_ENABLED': False, 'METRICS_ENABLED': False, 'PASSWORD_HASH_COST': 12,
+                          'PAGE_CACHE_ENABLED': False, 'PROFILING_ENABLED': enabled,
+                          'PROFILE_SECRET': 'bench', 'PROFILE_DIR': os.path.join(directory, 'profiles')})
+        init_db(app)
+        client = app.test_client()
+        client.post('/register', data={'name': 'Bench', 'email': 'bench@example.com',
+                                       'password': 'secret', 'mobile_number': '1'})
+        client.post('/login', data={'email': 'bench@example.com', 'password': 'secret'})
+        for i in range(bookings):
+            check_in = date(2031, 1, 1) + timedelta(days=i * 3)
+            client.post('/book/suv', data={'check_in': check_in.isoformat(),
+                                           'check_out': (check_in + timedelta(days=2)).isoformat(),
+                                           'special_requests': '', 'payment_mode': 'upi',
+                                           'idempotency_key': str(uuid.uuid4())})
+        client.get('/car_type')  # shows the flashed messages left by the requests above
+        headers = {PROFILE_HEADER: profile_token('bench')} if profiled else {}
+
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(page_views):
+                for path in paths:
+                    client.get(path, headers=headers)
+            elapsed = (time.perf_counter() - start) / (page_views * len(paths))
+            best = elapsed if best is None else min(best, elapsed)
+        baseline = baseline or best
+        # Profiled requests also write their two profile files
+        print(f"  {label:<9} {best * 1000:>7.3f} ms/request  {(best / baseline - 1) * 100:>+6.1f}%")
+        app.extensions['credentials'].shutdown()
+
+
+# Run in a child process: fail on any socket connect or database file open
+STARTUP_PROBE = """
+import socket, sqlite3, sys, time
+def refuse(*args, **kwargs):
+    raise RuntimeError('I/O at import time')
+socket.socket.connect = refuse
+sqlite3.connect = refuse
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(time.perf_counter() - start)
+"""
+
+
+def bench_startup(modules=('cab', 'app', 'app3')):
+    """Time a cold import of each entry point"""
+    env = dict(os.environ, DATABASE_PATH=os.path.join(tempfile.mkdtemp(), 'startup.db'))
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+    print("startup:")
+    for module in modules:
+        result = subprocess.run([sys.executable, '-c', STARTUP_PROBE, module], env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"  {module:<6} FAILED\n{result.stderr.strip()}")
+            continue
+        print(f"  {module:<6} {float(result.stdout.split()[-1]) * 1000:>8.0f} ms")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['profile']:
+        bench_profile()
+        sys.exit(0)
+    if sys.argv[1:2] == ['pages']:
+        bench_pages()
+        sys.exit(0)
+    if sys.argv[1:2] == ['throttle']:
+        bench_throttle()
+        sys.exit(0)
+    if sys.argv[1:2] == ['cancel']:
+        bench_cancel()
+        sys.exit(0)
+    if sys.argv[1:2] == ['warmup']:
+        bench_warmup()
+        sys.exit(0)
+    if sys.argv[1:2] == ['async']:
+        bench_async()
+        sys.exit(0)
+    if sys.argv[1:2] == ['rollups']:
+        bench_rollups()
+        sys.exit(0)
+    if sys.argv[1:2] == ['bulk']:
+        bench_bulk()
+        sys.exit(0)
+    if sys.argv[1:2] == ['metrics']:
+        bench_metrics()
+        sys.exit(0)
+    if sys.argv[1:2] == ['passwords']:
+        bench_passwords()
+        sys.exit(0)
+    if sys.argv[1:2] == ['assets']:
+        bench_assets()
+        sys.exit(0)
+    if sys.argv[1:2] == ['pricing']:
+        bench_pricing()
+        sys.exit(0)
+    if sys.argv[1:2] == ['notify']:
+        bench_notify()
+        sys.exit(0)
+    if sys.argv[1:2] == ['cache']:
+        bench_cache()
+        sys.exit(0)
+    if sys.argv[1:2] == ['startup']:
+        bench_startup()
+        sys.exit(0)
+    if sys.argv[1:2] == ['deserialize']:
+        bench_deserialize()
+        sys.exit(0)
+    if sys.argv[1:2] == ['pageview']:
+        for layout in sys.argv[2:] or ['tables', 'single']:
+            bench_dynamodb_pageview(layout)
+        sys.exit(0)
+    if sys.argv[1:2] == ['stress']:
+        for backend in sys.argv[2:] or ['memory', 'sqlite']:
+            stress_booking(backend)
+        sys.exit(0)
+
+    backends = sys.argv[1:] or ['memory', 'sqlite', 'sqlite-pool', 'availability']
+    if os.environ.get('DYNAMODB_ENDPOINT_URL') and not sys.argv[1:]:
+        backends.append('dynamodb')
+    for backend in backends:
+        if backend == 'sqlite-pool':
+            bench_sqlite_pool()
+        elif backend == 'availability':
+            bench_availability()
+        else:
+            bench_storage(backend)
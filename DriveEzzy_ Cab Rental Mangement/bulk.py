@@ -0,0 +1,253 @@
+"""Bulk booking import and export as CSV or JSON Lines, and bulk cancellation
+
+Both directions stream. Import reads one row at a time and writes chunks of
+IMPORT_CHUNK_SIZE bookings through Storage.import_bookings (executemany on
+SQLite, batch_writer on DynamoDB); export pages through
+Storage.iter_bookings and hands each page to the response as it arrives.
+
+Import rows need user_email (or user_id), car_type, pickup and dropoff
+(check_in/check_out are accepted too); booking_id, special_requests,
+payment_mode and created_at are optional. Every row is validated and priced
+exactly like the booking form (views.new_booking) and must fit the fleet's
+inventory. Rows without a booking_id get one derived from their contents
+plus an optional `reference` column, so importing the same file twice
+doesn't book anything twice. Imported bookings send no confirmations.
+
+Bulk cancellation takes back every confirmed booking of a car type on a
+range of days, e.g. when a vehicle is grounded. Bookings are cancelled
+CANCEL_CHUNK_SIZE at a time through Storage.cancel_bookings (one conditional
+UPDATE per chunk on SQLite, conditional UpdateItems on DynamoDB); a booking
+its owner cancels meanwhile is skipped, never cancelled twice.
+
+Used by `flask import-bookings` / `flask export-bookings` /
+`flask cancel-bookings` and the admin endpoints; all need an app context.
+"""
+import csv
+import io
+import json
+import time
+import uuid
+from dataclasses import fields
+from datetime import date, datetime
+
+from flask import current_app
+
+from pricing import UnknownCarType
+from storage import BookingRecord
+from views import new_booking
+
+FORMATS = ('csv', 'jsonl')
+IMPORT_CHUNK_SIZE = 500
+CANCEL_CHUNK_SIZE = 100
+EXPORT_COLUMNS = [field.name for field in fields(BookingRecord)]
+
+# Rejections kept in a report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+def guess_format(name, default='csv'):
+    """'csv' or 'jsonl' from a file name or MIME type"""
+    name = (name or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '/x-ndjson', '/jsonl', '/x-jsonlines')):
+        return 'jsonl'
+    if name.endswith(('.csv', '/csv')):
+        return 'csv'
+    return default
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []  # (line, reason), the first MAX_REPORTED_ERRORS
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, reason))
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'errors': [{'line': line, 'reason': reason} for line, reason in self.errors],
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows / self.seconds) if self.seconds else 0
+        }
+
+
+class CancelReport:
+    def __init__(self, car_type, start_day, end_day, dry_run=False):
+        self.car_type = car_type
+        self.start_day = start_day
+        self.end_day = end_day
+        self.dry_run = dry_run
+        self.matched = 0
+        self.cancelled = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'car_type': self.car_type,
+            'start': self.start_day,
+            'end': self.end_day,
+            'dry_run': self.dry_run,
+            'matched': self.matched,
+            'cancelled': self.cancelled,
+            'skipped': 0 if self.dry_run else self.matched - self.cancelled,
+            'chunks': self.chunks,
+            'seconds': round(self.seconds, 3),
+            'bookings_per_second': round(self.cancelled / self.seconds) if self.seconds else 0
+        }
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict) from a text stream; None for a row that
+    isn't a JSON object"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def booking_from_row(row, storage):
+    """The booking for one import row; raises ValueError with the reason"""
+    if row is None:
+        raise ValueError("not a JSON object")
+    if (row.get('status') or 'confirmed') != 'confirmed':
+        raise ValueError("only confirmed bookings can be imported")
+
+    if row.get('user_id'):
+        user = storage.get_user(row['user_id'])
+    elif row.get('user_email') or row.get('email'):
+        user = storage.get_user_by_email(row.get('user_email') or row.get('email'))
+    else:
+        raise ValueError("missing user_email")
+    if not user:
+        raise ValueError(f"unknown user {row.get('user_id') or row.get('user_email') or row.get('email')}")
+
+    car_type = str(row.get('car_type') or '').strip()
+    check_in = str(row.get('pickup') or row.get('check_in') or '').strip()
+    check_out = str(row.get('dropoff') or row.get('check_out') or '').strip()
+    for name, value in (('car_type', car_type), ('pickup', check_in), ('dropoff', check_out)):
+        if not value:
+            raise ValueError(f"missing {name}")
+
+    booking_id = row.get('booking_id') or str(uuid.uuid5(
+        uuid.NAMESPACE_URL,
+        f"import:{user['id']}:{car_type.lower()}:{check_in}:{check_out}:{row.get('reference') or ''}"
+    ))
+    try:
+        return new_booking(booking_id, user['id'], car_type, check_in, check_out,
+                           row.get('special_requests') or '', row.get('payment_mode') or 'invoice',
+                           row.get('created_at') or None)
+    except UnknownCarType:
+        raise ValueError(f"unknown car type {car_type}")
+
+
+def import_bookings(stream, fmt, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import every row of a text stream; returns an ImportReport"""
+    storage = current_app.extensions['storage']
+    report = ImportReport()
+    chunk = []  # (line, booking)
+
+    def flush():
+        rejected = storage.import_bookings([booking for _, booking in chunk])
+        lines = {id(booking): line for line, booking in chunk}
+        for booking, reason in rejected:
+            report.reject(lines[id(booking)], reason)
+        report.imported += len(chunk) - len(rejected)
+        chunk.clear()
+
+    for line, row in read_rows(stream, fmt):
+        report.rows += 1
+        try:
+            chunk.append((line, booking_from_row(row, storage)))
+        except ValueError as e:
+            report.reject(line, str(e))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    # The in-memory availability view doesn't know about rows written here,
+    # nor do the ETags of My Bookings pages
+    current_app.extensions['availability'].refresh(force=True)
+    if report.imported:
+        current_app.extensions['pages'].versions.bump_all()
+    report.errors.sort()
+    report.seconds = time.perf_counter() - report.started
+    return report
+
+
+def cancel_range(start, end):
+    """(start_day, end_day) ISO dates of a bulk cancellation; raises
+    ValueError if either is missing or malformed, or they are reversed"""
+    if not start or not end:
+        raise ValueError("start and end dates are required")
+    start_day, end_day = date.fromisoformat(start), date.fromisoformat(end)
+    if start_day > end_day:
+        raise ValueError("start is after end")
+    return start_day.isoformat(), end_day.isoformat()
+
+
+def cancel_bookings(car_type, start_day, end_day, chunk_size=CANCEL_CHUNK_SIZE, dry_run=False):
+    """Cancel every confirmed booking of car_type with a day between
+    start_day and end_day (ISO dates, both included); returns a CancelReport.
+    A dry run only counts them."""
+    storage = current_app.extensions['storage']
+    availability = current_app.extensions['availability']
+    car_type = car_type.strip().lower()
+    report = CancelReport(car_type, start_day, end_day, dry_run)
+
+    bookings = storage.confirmed_bookings_between(car_type, start_day, end_day)
+    report.matched = len(bookings)
+    if not dry_run:
+        cancelled_at = datetime.now().isoformat()
+        for start in range(0, len(bookings), chunk_size):
+            for booking_id in storage.cancel_bookings(bookings[start:start + chunk_size], cancelled_at):
+                availability.release(booking_id)
+                report.cancelled += 1
+            report.chunks += 1
+        if report.cancelled:
+            current_app.extensions['pages'].versions.bump_all()
+
+    report.seconds = time.perf_counter() - report.started
+    return report
+
+
+def export_bookings(fmt, since=None, rows_per_chunk=500):
+    """Yield the bookings as CSV or JSON Lines text, a chunk of rows at a time"""
+    storage = current_app.extensions['storage']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+
+    for count, record in enumerate(storage.iter_bookings(since), start=1):
+        if fmt == 'csv':
+            writer.writerow([getattr(record, column) for column in EXPORT_COLUMNS])
+        else:
+            buffer.write(json.dumps({column: getattr(record, column) for column in EXPORT_COLUMNS},
+                                    default=str) + '\n')
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
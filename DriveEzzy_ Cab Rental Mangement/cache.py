@@ -0,0 +1,208 @@
+"""Read-through cache in front of the storage backend
+
+User profiles are read on every register and login, but change only when a
+user is written, and a saved rate table never changes. CachedStorage answers
+those lookups from a cache and drops the affected keys whenever it writes, so
+a repeat lookup costs no database round trip.
+
+Backends:
+    memory      in-process LRU with a TTL (default, one per worker)
+    redis       any Redis-compatible server (REDIS_URL), shared by workers
+    fake-redis  in-process stand-in for Redis, for local runs and benchmarks
+    none        no caching
+"""
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class LRUCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds
+
+    Values are copied in and out, like RedisCache's JSON round trip, so a
+    caller changing a returned user dict can't change what others are served.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def get(self, key):
+        """Return the cached value, or None on a miss"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                self.stats.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            value = entry[1]
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        value = copy.deepcopy(value)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisCache:
+    """Cache on a Redis-compatible client; values are stored as JSON"""
+
+    def __init__(self, client, ttl=300, prefix='driveezzy:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()  # counts this worker's lookups only
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, json.dumps(value))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+class FakeRedis:
+    """The handful of Redis commands RedisCache uses, kept in a dict"""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.data.pop(key, None)
+                return None
+            return entry[1]
+
+    def setex(self, key, ttl, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + ttl, value.encode() if isinstance(value, str) else value)
+
+    def delete(self, *keys):
+        with self.lock:
+            return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match='*'):
+        prefix = match.rstrip('*')
+        with self.lock:
+            return [key for key in self.data if key.startswith(prefix)]
+
+
+class CachedStorage:
+    """Wraps a storage backend; user lookups are read through the cache and
+    every other call goes straight to the backend"""
+
+    def __init__(self, storage, cache):
+        self.storage = storage
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def get_or_load(self, key, loader):
+        """Cached value for key, calling loader() on a miss; None is not cached"""
+        value = self.cache.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.cache.set(key, value)
+        return value
+
+    def get_user(self, user_id):
+        return self.get_or_load(f"user:id:{user_id}", lambda: self.storage.get_user(user_id))
+
+    def get_user_by_email(self, email):
+        return self.get_or_load(f"user:email:{email}", lambda: self.storage.get_user_by_email(email))
+
+    def create_user(self, user):
+        self.storage.create_user(user)
+        self.invalidate_user(user)
+
+    def get_rate_table(self, version):
+        # Saved rate tables are immutable, so a version can be cached as long as it lives
+        return self.get_or_load(f"rates:v{version}", lambda: self.storage.get_rate_table(version))
+
+    def update_password(self, user_id, password):
+        user = self.storage.get_user(user_id)
+        self.storage.update_password(user_id, password)
+        if user:
+            self.invalidate_user(user)
+
+    def invalidate_user(self, user):
+        """Drop cached copies of a user after any write to it"""
+        self.cache.delete(f"user:id:{user['id']}", f"user:email:{user['email']}")
+
+
+def create_cache(config):
+    """Build the cache selected by config['CACHE_BACKEND'] (None for 'none')"""
+    backend = config.get('CACHE_BACKEND', 'memory')
+    ttl = config.get('CACHE_TTL_SECONDS', 300)
+
+    if backend == 'none':
+        return None
+
+    if backend == 'memory':
+        return LRUCache(config.get('CACHE_MAX_ENTRIES', 10000), ttl)
+
+    if backend == 'fake-redis':
+        return RedisCache(FakeRedis(), ttl)
+
+    if backend == 'redis':
+        import redis  # optional dependency, only needed for this backend
+
+        # from_url does not connect until the first command
+        return RedisCache(redis.Redis.from_url(config.get('REDIS_URL', 'redis://localhost:6379/0')), ttl)
+
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,130 @@
+"""Password hashing off the request thread
+
+Passwords are hashed with scrypt (hashlib, no extra dependency) and stored
+as "scrypt$<log2 N>$<r>$<p>$<salt>$<hash>". Hashing is deliberately slow, so
+it runs in a process pool sized to the machine's cores instead of inside the
+Flask worker; at most PASSWORD_HASH_MAX_PENDING hashes wait for the pool, and
+logins beyond that fail fast instead of piling up.
+
+Cost is tunable (PASSWORD_HASH_COST = log2 N). Rows written with a different
+cost, and legacy rows that still hold the plaintext password, verify as
+usual and are flagged for rehashing, so login() upgrades them in place.
+Successful verifications are remembered for a few minutes (keyed by an HMAC
+of the stored hash and the password, never the password itself), so a user
+logging in again on another device doesn't pay for a second hash.
+"""
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import LRUCache
+
+SCHEME = 'scrypt'
+
+
+class HasherBusy(Exception):
+    """Too many hashes already queued; the caller should ask the user to retry"""
+
+
+def scrypt_hash(password, cost, r, p, salt=None):
+    """Hash a password; runs inside the pool's worker processes"""
+    n = 2 ** cost
+    salt = salt or os.urandom(16)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * (n + p), dklen=32)
+    encoded = [base64.b64encode(part).decode() for part in (salt, key)]
+    return f"{SCHEME}${cost}${r}${p}${encoded[0]}${encoded[1]}"
+
+
+def scrypt_verify(password, stored):
+    _, cost, r, p, salt, _ = stored.split('$')
+    expected = scrypt_hash(password, int(cost), int(r), int(p), base64.b64decode(salt))
+    return hmac.compare_digest(expected, stored)
+
+
+class PasswordHasher:
+    def __init__(self, cost=14, r=8, p=1, workers=None, max_pending=None, cache_ttl=300):
+        self.cost = cost
+        self.r = r
+        self.p = p
+        self.workers = workers or os.cpu_count() or 1
+        self.pending = threading.BoundedSemaphore(max_pending or self.workers * 8)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.verified = LRUCache(max_entries=10000, ttl=cache_ttl)
+        self.cache_key = os.urandom(32)  # per process, so cached entries are useless elsewhere
+        self.dummy_hash = None
+
+    def get_pool(self):
+        # Created on first use, after any gunicorn fork; spawned workers don't
+        # inherit the app's threads or open connections
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    def run(self, func, *args, timeout=10.0):
+        # A full queue answers at once: waiting for a slot would hold the
+        # request thread as long as the hashes ahead of it
+        if not self.pending.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self.get_pool().submit(func, *args).result(timeout)
+        finally:
+            self.pending.release()
+
+    def hash(self, password):
+        return self.run(scrypt_hash, password, self.cost, self.r, self.p)
+
+    def needs_rehash(self, stored):
+        return not stored.startswith(f"{SCHEME}${self.cost}${self.r}${self.p}$")
+
+    def verify(self, password, stored):
+        """Return (matches, needs_rehash) for a password against a stored value"""
+        if not stored.startswith(SCHEME + '$'):
+            # Legacy row holding the plaintext password
+            return hmac.compare_digest(stored.encode(), password.encode()), True
+
+        key = hmac.new(self.cache_key, f"{stored}\0{password}".encode(), hashlib.sha256).hexdigest()
+        if self.verified.get(key):
+            return True, self.needs_rehash(stored)
+        matches = self.run(scrypt_verify, password, stored)
+        if matches:
+            self.verified.set(key, True)
+        return matches, matches and self.needs_rehash(stored)
+
+    def verify_unknown_user(self, password):
+        """Spend the same time as a real check, so response times don't
+        reveal which emails are registered"""
+        if self.dummy_hash is None:
+            self.dummy_hash = self.hash(os.urandom(16).hex())
+        self.run(scrypt_verify, password, self.dummy_hash)
+        return False
+
+    def warm_up(self):
+        """Start the pool's processes and make the unknown-user hash now,
+        so the first logins on a new worker don't wait for either"""
+        pool = self.get_pool()
+        for future in [pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+        if self.dummy_hash is None:
+            self.dummy_hash = self.hash(os.urandom(16).hex())
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def init_credentials(app):
+    """Create the password hasher and attach it to the Flask app"""
+    hasher = PasswordHasher(
+        cost=app.config.get('PASSWORD_HASH_COST', 14),
+        workers=app.config.get('PASSWORD_HASH_WORKERS'),
+        max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING')
+    )
+    app.extensions['credentials'] = hasher
+    return hasher
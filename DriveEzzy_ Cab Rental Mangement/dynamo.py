@@ -0,0 +1,1069 @@
+"""DynamoDB data access for app.py and app3.py
+
+All table names come from one naming scheme (TABLES plus an optional
+per-environment prefix), and the Table handles are built once per storage
+object instead of once per request. This is the default layout, one table
+each for users and bookings; DYNAMODB_LAYOUT=single keeps both in a single
+table instead (singletable.py). Every client retries, throttles and
+coalesces reads as resilience.py describes.
+
+The availability engine never scans the bookings: it loads from ActiveIndex
+(confirmed bookings by dropoff) and polls ChangesIndex (every booking by the
+time it was made or cancelled). Both are sparse GSIs split over
+BOOKING_SHARDS partitions; init_db adds them to existing tables and backfills
+their keys on bookings written before them.
+"""
+import hashlib
+import json
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import cached_property
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from migrations import DEFAULT_RATES, default_fleet
+from pricing import to_paise
+from storage import (BookingRecord, BookingTooLong, BookingUnavailable, DuplicateBooking, Storage, claimable_days,
+                     decode_cursor, encode_cursor, inventory_days, released_days, rollup_key, rollup_rows,
+                     tally_cancellations, tally_rollups)
+
+# Logical name -> DynamoDB table name (before the prefix is applied)
+TABLES = {
+    'users': 'Users',
+    'bookings': 'Bookings',
+    'inventory': 'Inventory',
+    'fleet': 'Fleet',
+    'outbox': 'Outbox',
+    'rates': 'RateTables',
+    'rollups': 'BookingRollups'
+}
+
+THROUGHPUT = {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+
+# Partitions of ChangesIndex and ActiveIndex; a booking's shard is a hash of
+# its id, so a burst of bookings doesn't write to one index partition
+BOOKING_SHARDS = 4
+
+# What the availability engine and bulk cancel read from those two indexes
+INDEXED_BOOKING_ATTRIBUTES = ('booking_id', 'user_id', 'created_at', 'car_type', 'pickup', 'dropoff', 'status',
+                              'total_price')
+
+# The attributes ChangesIndex and ActiveIndex are keyed on
+BOOKING_INDEX_DEFINITIONS = [
+    {'AttributeName': name, 'AttributeType': 'S'}
+    for name in ('change_shard', 'changed_at', 'active_shard', 'dropoff')
+]
+
+
+def booking_indexes(table_keys):
+    """The sparse GSIs that replace Scans of the bookings, for a table whose
+    primary key is table_keys:
+
+    ChangesIndex  change_shard, changed_at  every booking, by its last change
+    ActiveIndex   active_shard, dropoff     confirmed bookings only
+    """
+    indexes = []
+    for name, keys in (('ChangesIndex', ('change_shard', 'changed_at')), ('ActiveIndex', ('active_shard', 'dropoff'))):
+        indexes.append({
+            'IndexName': name,
+            'KeySchema': [
+                {'AttributeName': keys[0], 'KeyType': 'HASH'},
+                {'AttributeName': keys[1], 'KeyType': 'RANGE'}
+            ],
+            'Projection': {
+                'ProjectionType': 'INCLUDE',
+                'NonKeyAttributes': [name for name in INDEXED_BOOKING_ATTRIBUTES if name not in keys + table_keys]
+            },
+            'ProvisionedThroughput': THROUGHPUT
+        })
+    return indexes
+
+
+TABLE_SCHEMAS = {
+    'users': {
+        'KeySchema': [
+            {'AttributeName': 'id', 'KeyType': 'HASH'}  # Partition key
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'email', 'AttributeType': 'S'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'EmailIndex',
+                'KeySchema': [
+                    {'AttributeName': 'email', 'KeyType': 'HASH'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                },
+                'ProvisionedThroughput': THROUGHPUT
+            }
+        ],
+        'ProvisionedThroughput': THROUGHPUT
+    },
+    'bookings': {
+        'KeySchema': [
+            {'AttributeName': 'booking_id', 'KeyType': 'HASH'}  # Partition key
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'booking_id', 'AttributeType': 'S'},
+            {'AttributeName': 'user_id', 'AttributeType': 'S'},
+            {'AttributeName': 'created_at', 'AttributeType': 'S'},
+            *BOOKING_INDEX_DEFINITIONS
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'UserIdIndex',
+                'KeySchema': [
+                    {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+                    {'AttributeName': 'created_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                },
+                'ProvisionedThroughput': THROUGHPUT
+            },
+            *booking_indexes(('booking_id',))
+        ],
+        'ProvisionedThroughput': THROUGHPUT
+    },
+    'inventory': {
+        'KeySchema': [
+            {'AttributeName': 'slot', 'KeyType': 'HASH'}  # "<car_type>#<YYYY-MM-DD>"
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'slot', 'AttributeType': 'S'}
+        ],
+        'ProvisionedThroughput': THROUGHPUT
+    },
+    'fleet': {
+        'KeySchema': [
+            {'AttributeName': 'vehicle_id', 'KeyType': 'HASH'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'vehicle_id', 'AttributeType': 'S'}
+        ],
+        'ProvisionedThroughput': THROUGHPUT
+    },
+    'outbox': {
+        'KeySchema': [
+            {'AttributeName': 'event_id', 'KeyType': 'HASH'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'event_id', 'AttributeType': 'S'},
+            {'AttributeName': 'status', 'AttributeType': 'S'},
+            {'AttributeName': 'available_at', 'AttributeType': 'S'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'PendingIndex',
+                'KeySchema': [
+                    {'AttributeName': 'status', 'KeyType': 'HASH'},
+                    {'AttributeName': 'available_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                },
+                'ProvisionedThroughput': THROUGHPUT
+            }
+        ],
+        'ProvisionedThroughput': THROUGHPUT
+    },
+    'rates': {
+        'KeySchema': [
+            {'AttributeName': 'name', 'KeyType': 'HASH'},  # always RATE_TABLE_NAME
+            {'AttributeName': 'version', 'KeyType': 'RANGE'}
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'name', 'AttributeType': 'S'},
+            {'AttributeName': 'version', 'AttributeType': 'N'}
+        ],
+        'ProvisionedThroughput': THROUGHPUT
+    },
+    'rollups': {
+        'KeySchema': [
+            {'AttributeName': 'month', 'KeyType': 'HASH'},  # "<YYYY-MM>"
+            {'AttributeName': 'slot', 'KeyType': 'RANGE'}  # "<YYYY-MM-DD>#<car_type>#<status>"
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'month', 'AttributeType': 'S'},
+            {'AttributeName': 'slot', 'AttributeType': 'S'}
+        ],
+        'ProvisionedThroughput': THROUGHPUT
+    }
+}
+
+# Partition key of every rate table version (newest = highest sort key)
+RATE_TABLE_NAME = 'default'
+
+# What cancel_booking reads of a booking before cancelling it
+CANCEL_ATTRIBUTES = ('user_id', 'car_type', 'pickup', 'dropoff', 'status', 'total_price')
+
+# Concurrent conditional writes in a bulk cancel; below botocore's pool of 10 connections
+CANCEL_THREADS = 8
+
+# Columns my_bookings.html and /api/bookings render, plus the index keys
+BOOKING_LIST_ATTRIBUTES = BookingRecord.__slots__
+
+# LastEvaluatedKey of a UserIdIndex page: the table key and the index key
+LIST_CURSOR_FIELDS = ('booking_id', 'user_id', 'created_at')
+
+# How far back changed_bookings reads past its `since`: a GSI lags the table,
+# and a change that reaches ChangesIndex late must not fall behind the watermark
+INDEX_LAG_SECONDS = 10
+
+
+def booking_shard(booking_id):
+    """The ChangesIndex/ActiveIndex partition of a booking"""
+    return str(zlib.crc32(booking_id.encode()) % BOOKING_SHARDS)
+
+
+def table_names(prefix=''):
+    """Physical table name for every logical table"""
+    return {name: prefix + table for name, table in TABLES.items()}
+
+
+def projection(attributes):
+    """ProjectionExpression arguments with every attribute name aliased
+    (status and others are DynamoDB reserved words)"""
+    return {
+        'ProjectionExpression': ', '.join(f"#{name}" for name in attributes),
+        'ExpressionAttributeNames': {f"#{name}": name for name in attributes}
+    }
+
+
+def booking_from_item(item):
+    """Map a raw (wire-format) DynamoDB item straight onto a BookingRecord,
+    skipping boto3's generic deserializer; money stays a Decimal"""
+    return BookingRecord(
+        item['booking_id']['S'],
+        item['user_id']['S'],
+        item['created_at']['S'],
+        item['car_type']['S'],
+        item['pickup']['S'],
+        item['dropoff']['S'],
+        int(item['num_days']['N']),
+        Decimal(item['total_price']['N']),
+        item['status']['S']
+    )
+
+
+def rollup_item_key(key):
+    """Primary key of the BookingRollups item for a (day, car type, status)"""
+    day, car_type, status = key
+    return {'month': day[:7], 'slot': f"{day}#{car_type}#{status}"}
+
+
+def months_between(start_day, end_day):
+    """Every "YYYY-MM" from start_day's month to end_day's"""
+    year, month = int(start_day[:4]), int(start_day[5:7])
+    months = []
+    while f"{year:04d}-{month:02d}" <= end_day[:7]:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def billed_schema(schema, billing_mode='PROVISIONED', throughput=None):
+    """A table schema with its capacity settings: `throughput` in place of
+    the default on the table and its indexes, or none at all on demand"""
+    schema = dict(schema)
+    indexes = [dict(index) for index in schema.get('GlobalSecondaryIndexes', ())]
+    for entry in [schema] + indexes:
+        if billing_mode == 'PAY_PER_REQUEST':
+            entry.pop('ProvisionedThroughput', None)
+        elif throughput is not None:
+            entry['ProvisionedThroughput'] = throughput
+    if indexes:
+        schema['GlobalSecondaryIndexes'] = indexes
+    if billing_mode == 'PAY_PER_REQUEST':
+        schema['BillingMode'] = billing_mode
+    return schema
+
+
+def create_tables(dynamodb, names, schemas=TABLE_SCHEMAS, billing_mode='PROVISIONED', throughput=None):
+    """Create any missing tables, then wait for all of them at once
+
+    billing_mode and throughput only apply to tables created here; existing
+    tables keep theirs (change them with UpdateTable), and get any index of
+    their schema they lack.
+    """
+    existing = set(dynamodb.meta.client.list_tables()['TableNames'])
+    print(f"Successfully connected to DynamoDB. Found {len(existing)} tables.")
+
+    created = []
+    for name, table_name in names.items():
+        if table_name in existing:
+            print(f"{table_name} table already exists.")
+            add_missing_indexes(dynamodb.meta.client, table_name, schemas[name], throughput)
+            continue
+        dynamodb.create_table(TableName=table_name, **billed_schema(schemas[name], billing_mode, throughput))
+        created.append((name, table_name))
+
+    waiter = dynamodb.meta.client.get_waiter('table_exists')
+    for name, table_name in created:
+        waiter.wait(TableName=table_name)
+        print(f"{table_name} table created successfully!")
+        if name == 'fleet':
+            seed_fleet(dynamodb.Table(table_name))
+        if name == 'rates':
+            dynamodb.Table(table_name).put_item(Item={
+                'name': RATE_TABLE_NAME, 'version': 1, 'rates': json.dumps(DEFAULT_RATES)
+            })
+
+
+def add_missing_indexes(client, table_name, schema, throughput=None, poll_seconds=5):
+    """Create the GSIs of `schema` an existing table doesn't have yet, one
+    UpdateTable at a time (DynamoDB builds one at a time), billed like the
+    table, and wait until each is ACTIVE"""
+    table = client.describe_table(TableName=table_name)['Table']
+    existing = {index['IndexName'] for index in table.get('GlobalSecondaryIndexes', ())}
+    billing_mode = table.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+    for index in billed_schema(schema, billing_mode, throughput).get('GlobalSecondaryIndexes', ()):
+        if index['IndexName'] in existing:
+            continue
+        keys = {key['AttributeName'] for key in index['KeySchema']}
+        definitions = [entry for entry in schema['AttributeDefinitions'] if entry['AttributeName'] in keys]
+        client.update_table(TableName=table_name, AttributeDefinitions=definitions,
+                            GlobalSecondaryIndexUpdates=[{'Create': index}])
+        while not index_active(client, table_name, index['IndexName']):
+            time.sleep(poll_seconds)
+        print(f"{table_name}: index {index['IndexName']} created.")
+
+
+def index_active(client, table_name, index_name):
+    """Whether a table's GSI exists and is ACTIVE"""
+    table = client.describe_table(TableName=table_name)['Table']
+    return any(index['IndexName'] == index_name and index['IndexStatus'] == 'ACTIVE'
+               for index in table.get('GlobalSecondaryIndexes', ()))
+
+
+def seed_fleet(table):
+    """Load the default fleet with BatchWriteItem (25 vehicles per call)"""
+    with table.batch_writer() as batch:
+        for vehicle in default_fleet():
+            batch.put_item(Item=vehicle)
+
+
+class DynamoDBStorage(Storage):
+    """DynamoDB backend used by app.py and app3.py"""
+
+    # Logical table holding the booking items
+    BOOKINGS_TABLE = 'bookings'
+
+    def __init__(self, dynamodb=None, table_prefix='', raw_client=None, client_options=None,
+                 billing_mode='PROVISIONED', throughput=None, resilience=None):
+        # boto3 clients are built on first use: creating one resolves
+        # credentials, which on EC2 is a call to the instance metadata service
+        self.client_options = client_options or {}
+        self.billing_mode = billing_mode
+        self.throughput = throughput
+        # resilience.Resilience hooked into every client built here
+        self.resilience = resilience
+        if dynamodb is not None:
+            self.dynamodb = dynamodb
+        if raw_client is not None:
+            self.raw_client = raw_client
+        self.names = table_names(table_prefix)
+        self.fleet_capacity = None
+
+    @cached_property
+    def dynamodb(self):
+        import boto3
+
+        dynamodb = boto3.resource('dynamodb', **self.client_options)
+        if self.resilience is not None:
+            self.resilience.instrument(dynamodb.meta.client)
+        if self.metrics is not None:
+            self.metrics.instrument_boto3(dynamodb.meta.client)
+        return dynamodb
+
+    @cached_property
+    def client(self):
+        return self.dynamodb.meta.client
+
+    @cached_property
+    def raw_client(self):
+        # The resource's client converts every item to Python types; pages of
+        # bookings are read with a plain client and mapped by booking_from_item
+        import boto3
+
+        options = self.client_options or {
+            'region_name': self.client.meta.region_name,
+            'endpoint_url': self.client.meta.endpoint_url
+        }
+        raw_client = boto3.client('dynamodb', **options)
+        if self.resilience is not None:
+            self.resilience.instrument(raw_client)
+        if self.metrics is not None:
+            self.metrics.instrument_boto3(raw_client)
+        return raw_client
+
+    @cached_property
+    def tables(self):
+        return {name: self.dynamodb.Table(table_name) for name, table_name in self.names.items()}
+
+    def instrument(self, metrics):
+        # Clients are built lazily and hooked when they are; hook any that already exist
+        self.metrics = metrics
+        for name in ('dynamodb', 'raw_client'):
+            if name in self.__dict__:
+                client = self.__dict__[name]
+                metrics.instrument_boto3(getattr(client.meta, 'client', client))
+
+    def warm_up(self, connections=1):
+        # Builds both clients (resolving credentials) and opens an HTTPS
+        # connection on each with a read of a key that doesn't exist
+        self.tables['users'].get_item(Key={'id': 'warm-up'})
+        self.raw_client.query(**self.list_bookings_query('warm-up', 1, None))
+
+    def init_db(self):
+        create_tables(self.dynamodb, self.names, TABLE_SCHEMAS, self.billing_mode, self.throughput)
+        self.backfill_booking_indexes()
+
+    def schema_id(self):
+        digest = hashlib.sha1(json.dumps(TABLE_SCHEMAS, sort_keys=True).encode()).hexdigest()[:12]
+        meta = self.client.meta
+        return f"dynamodb:{meta.region_name}:{meta.endpoint_url}:{self.names['users']}:{digest}"
+
+    def check_schema(self):
+        """DescribeTable on each table; no ListTables, no waiters"""
+        for name, table_name in self.names.items():
+            try:
+                table = self.client.describe_table(TableName=table_name)['Table']
+            except self.client.exceptions.ResourceNotFoundException:
+                return False
+            if table['TableStatus'] != 'ACTIVE':
+                return False
+            indexes = {index['IndexName']: index['IndexStatus'] for index in table.get('GlobalSecondaryIndexes', ())}
+            if any(status != 'ACTIVE' for status in indexes.values()):
+                return False
+            # Tables from before ChangesIndex and ActiveIndex need init_db
+            if name == self.BOOKINGS_TABLE and not {'ChangesIndex', 'ActiveIndex'} <= indexes.keys():
+                return False
+        return True
+
+    def get_user(self, user_id):
+        response = self.tables['users'].get_item(Key={'id': user_id})
+        return response.get('Item')
+
+    def get_user_by_email(self, email):
+        response = self.tables['users'].query(
+            IndexName='EmailIndex',
+            KeyConditionExpression=Key('email').eq(email)
+        )
+        return response['Items'][0] if response['Items'] else None
+
+    def create_user(self, user):
+        self.tables['users'].put_item(Item=user)
+
+    def update_password(self, user_id, password):
+        self.tables['users'].update_item(
+            Key={'id': user_id},
+            UpdateExpression='SET #password = :password',
+            ExpressionAttributeNames={'#password': 'password'},
+            ExpressionAttributeValues={':password': password}
+        )
+
+    def create_booking(self, booking, event=None):
+        car_type, days = claimable_days(booking)
+        capacity = self.capacity(car_type)
+        if capacity < 1:
+            raise BookingUnavailable(car_type)
+
+        try:
+            self.client.transact_write_items(TransactItems=self.booking_actions(booking, event, capacity))
+        except self.client.exceptions.TransactionCanceledException as e:
+            raise self.booking_error(e, booking, car_type)
+
+    def booking_item(self, booking):
+        """A booking as its DynamoDB item, with the keys of ChangesIndex and
+        (while it is confirmed) ActiveIndex"""
+        item = dict(booking)
+        item['total_price'] = Decimal(str(booking['total_price']))  # Convert to Decimal for DynamoDB
+        item['change_shard'] = booking_shard(booking['booking_id'])
+        item['changed_at'] = booking.get('cancelled_at') or booking['created_at']
+        if booking['status'] == 'confirmed':
+            item['active_shard'] = item['change_shard']
+        else:
+            item.pop('active_shard', None)
+        return item
+
+    def booking_items(self, booking):
+        """Every item stored for a booking (import_bookings writes them)"""
+        return [self.booking_item(booking)]
+
+    def booking_puts(self, booking):
+        """The puts create_booking's transaction starts with; the first one
+        fails on a retried booking_id (booking_error looks for it there)"""
+        return [{
+            'Put': {
+                'TableName': self.names['bookings'],
+                'Item': self.booking_item(booking),
+                'ConditionExpression': 'attribute_not_exists(booking_id)'
+            }
+        }]
+
+    def booking_actions(self, booking, event, capacity):
+        """TransactWriteItems actions of create_booking, in plain Python values"""
+        car_type, days = inventory_days(booking)
+
+        # One transaction: the booking put fails on a retried booking_id, and
+        # each day's counter update fails once that day is sold out. The
+        # resource's client takes plain Python values, like Table does.
+        actions = self.booking_puts(booking)
+        for day in days:
+            actions.append({
+                'Update': {
+                    'TableName': self.names['inventory'],
+                    'Key': {'slot': f"{car_type}#{day}"},
+                    'UpdateExpression': 'ADD booked :one',
+                    'ConditionExpression': 'attribute_not_exists(booked) OR booked < :capacity',
+                    'ExpressionAttributeValues': {
+                        ':one': 1,
+                        ':capacity': capacity
+                    }
+                }
+            })
+        actions.append(self.rollup_update(rollup_key(booking, 'confirmed', booking['created_at']),
+                                          1, to_paise(booking['total_price'])))
+        if event:
+            actions.append({
+                'Put': {
+                    'TableName': self.names['outbox'],
+                    'Item': {
+                        'event_id': event['event_id'],
+                        'event_type': event['event_type'],
+                        'payload': json.dumps(event['payload'], default=str),
+                        'status': 'pending',
+                        'attempts': 0,
+                        'available_at': event['created_at'],
+                        'created_at': event['created_at']
+                    }
+                }
+            })
+        return actions
+
+    @staticmethod
+    def booking_error(error, booking, car_type):
+        """The exception to raise for a cancelled booking transaction"""
+        reasons = error.response.get('CancellationReasons', [])
+        if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+            return DuplicateBooking(booking['booking_id'])
+        if any(r.get('Code') == 'ConditionalCheckFailed' for r in reasons):
+            return BookingUnavailable(car_type)
+        return error
+
+    def import_bookings(self, bookings):
+        # Per chunk: skip ids that already exist (BatchGetItem), claim each
+        # (car type, day) once with its total count, then write the bookings
+        # 25 per call with batch_writer. If a day would overflow, the claims
+        # made so far are undone and the chunk falls back to one transaction
+        # per booking, so only the bookings that don't fit are rejected.
+        rejected, fresh, seen = [], [], set()
+        claims = Counter()
+        existing = self.existing_booking_ids([booking['booking_id'] for booking in bookings])
+        for booking in bookings:
+            if booking['booking_id'] in existing or booking['booking_id'] in seen:
+                rejected.append((booking, 'duplicate booking_id'))
+                continue
+            try:
+                car_type, days = claimable_days(booking)
+            except BookingTooLong as e:
+                rejected.append((booking, str(e)))
+                continue
+            seen.add(booking['booking_id'])
+            fresh.append(booking)
+            claims.update((car_type, day) for day in days)
+
+        claimed = []
+        try:
+            for (car_type, day), count in claims.items():
+                capacity = self.capacity(car_type)
+                if count > capacity:
+                    raise BookingUnavailable(car_type)
+                self.claim_inventory(car_type, day, count, capacity)
+                claimed.append((car_type, day, count))
+        except (BookingUnavailable, self.client.exceptions.ConditionalCheckFailedException):
+            self.release_inventory(claimed)
+            return rejected + super().import_bookings(fresh)
+
+        try:
+            with self.tables[self.BOOKINGS_TABLE].batch_writer() as batch:
+                for booking in fresh:
+                    for item in self.booking_items(booking):
+                        batch.put_item(Item=item)
+            # Only once every booking is in, so a failed chunk adds nothing
+            for key, (count, paise) in tally_rollups(fresh).items():
+                self.client.update_item(**self.rollup_update(key, count, paise)['Update'])
+        except Exception:
+            # Give back the days of every booking that didn't make it
+            written = self.existing_booking_ids([booking['booking_id'] for booking in fresh])
+            missing = Counter()
+            for booking in fresh:
+                if booking['booking_id'] not in written:
+                    car_type, days = inventory_days(booking)
+                    missing.update((car_type, day) for day in days)
+            self.release_inventory([(car_type, day, count) for (car_type, day), count in missing.items()])
+            raise
+        return rejected
+
+    def claim_inventory(self, car_type, day, count, capacity):
+        self.tables['inventory'].update_item(
+            Key={'slot': f"{car_type}#{day}"},
+            UpdateExpression='ADD booked :count',
+            ConditionExpression='attribute_not_exists(booked) OR booked <= :limit',
+            ExpressionAttributeValues={':count': count, ':limit': capacity - count}
+        )
+
+    def release_inventory(self, claims):
+        for car_type, day, count in claims:
+            self.tables['inventory'].update_item(
+                Key={'slot': f"{car_type}#{day}"},
+                UpdateExpression='ADD booked :count',
+                ExpressionAttributeValues={':count': -count}
+            )
+
+    def booking_id_key(self, booking_id):
+        """Primary key of the item that makes a booking_id unique"""
+        return {'booking_id': booking_id}
+
+    def existing_booking_ids(self, booking_ids):
+        """The subset of booking_ids already stored (BatchGetItem, 100 keys per call)"""
+        found = set()
+        unique = list(dict.fromkeys(booking_ids))
+        table_name = self.names[self.BOOKINGS_TABLE]
+        for start in range(0, len(unique), 100):
+            request = {table_name: {
+                'Keys': [{name: {'S': value} for name, value in self.booking_id_key(booking_id).items()}
+                         for booking_id in unique[start:start + 100]],
+                'ProjectionExpression': 'booking_id'
+            }}
+            while request:
+                response = self.raw_client.batch_get_item(RequestItems=request)
+                found.update(item['booking_id']['S'] for item in response['Responses'].get(table_name, []))
+                request = response.get('UnprocessedKeys')
+        return found
+
+    def iter_bookings(self, since=None, page_size=500):
+        # Scan order is arbitrary; pages come back as raw items and are
+        # mapped straight onto BookingRecords
+        kwargs = self.iter_bookings_scan(since, page_size)
+        while True:
+            response = self.raw_client.scan(**kwargs)
+            for item in response['Items']:
+                yield booking_from_item(item)
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def iter_bookings_scan(self, since, page_size):
+        """Scan arguments (wire format) of iter_bookings"""
+        kwargs = {'TableName': self.names['bookings'], 'Limit': page_size}
+        if since:
+            kwargs['FilterExpression'] = 'created_at >= :since'
+            kwargs['ExpressionAttributeValues'] = {':since': {'S': since}}
+        return kwargs
+
+    def get_booking(self, booking_id):
+        response = self.tables['bookings'].get_item(Key={'booking_id': booking_id})
+        return response.get('Item')
+
+    def list_bookings(self, user_id, limit=20, cursor=None):
+        response = self.raw_client.query(**self.list_bookings_query(user_id, limit, cursor))
+        return self.list_bookings_page(response, limit)
+
+    def list_bookings_query(self, user_id, limit, cursor):
+        """Query arguments (wire format) for one page of list_bookings"""
+        # UserIdIndex is sorted by created_at, so DynamoDB returns the page
+        # newest first. One row more than the page is read: a full page also
+        # comes with a LastEvaluatedKey, even when nothing follows it. Only
+        # the rendered columns are read back.
+        names = projection(BOOKING_LIST_ATTRIBUTES)
+        names['ExpressionAttributeNames']['#pk'] = 'user_id'
+        query = {
+            'TableName': self.names['bookings'],
+            'IndexName': 'UserIdIndex',
+            'KeyConditionExpression': '#pk = :user_id',
+            'ExpressionAttributeValues': {':user_id': {'S': user_id}},
+            'ScanIndexForward': False,
+            'Limit': limit + 1,
+            **names
+        }
+        if cursor:
+            # Exactly the index key of the last item; anything else would
+            # come back from DynamoDB as a ValidationException
+            key = decode_cursor(cursor, LIST_CURSOR_FIELDS)
+            if len(key) != len(LIST_CURSOR_FIELDS) or key['user_id'] != user_id:
+                raise ValueError("Invalid cursor")
+            query['ExclusiveStartKey'] = {k: {'S': v} for k, v in key.items()}
+        return query
+
+    def list_bookings_page(self, response, limit):
+        """(BookingRecords, next_cursor) from a list_bookings Query response;
+        there is a next page only if the extra row came back"""
+        records = [booking_from_item(item) for item in response['Items']]
+        page = records[:limit]
+        if len(records) <= limit:
+            return page, None
+        return page, encode_cursor(self.list_cursor_key(page[-1]))
+
+    @staticmethod
+    def list_cursor_key(record):
+        """The ExclusiveStartKey (as strings) of the page after `record`"""
+        return {'booking_id': record.booking_id, 'user_id': record.user_id, 'created_at': record.created_at}
+
+    def cancel_booking(self, booking_id, cancelled_at, user_id=None):
+        # The days to give back have to be read first; whether the booking
+        # may be cancelled is decided by the transaction's condition
+        booking = self.client.get_item(**self.cancel_lookup(booking_id)).get('Item')
+        if not self.cancellable(booking, user_id):
+            return False
+
+        actions = self.cancel_actions(booking, cancelled_at, user_id)
+        try:
+            self.client.transact_write_items(TransactItems=actions)
+        except self.client.exceptions.TransactionCanceledException:
+            # Someone else cancelled it first
+            return False
+        return True
+
+    def cancel_lookup(self, booking_id):
+        """GetItem arguments reading what cancel_booking needs of a booking,
+        in plain Python values"""
+        return {
+            'TableName': self.names['bookings'],
+            'Key': {'booking_id': booking_id},
+            **projection(('booking_id',) + CANCEL_ATTRIBUTES)
+        }
+
+    @staticmethod
+    def cancellable(booking, user_id):
+        """Whether the cancel_lookup item may be cancelled by user_id (anyone if None)"""
+        if not booking or booking['status'] != 'confirmed':
+            return False
+        return user_id is None or booking['user_id'] == user_id
+
+    def booking_key(self, booking):
+        """Primary key of a booking's item"""
+        return {'booking_id': booking['booking_id']}
+
+    def cancel_update(self, booking, cancelled_at, user_id=None):
+        """UpdateItem arguments that cancel a booking only while it is still
+        confirmed (and owned by user_id, if given), in plain Python values"""
+        update = {
+            'TableName': self.names[self.BOOKINGS_TABLE],
+            'Key': self.booking_key(booking),
+            # Moves the booking in ChangesIndex and takes it out of ActiveIndex
+            'UpdateExpression': 'SET #status = :s, cancelled_at = :c, changed_at = :c, change_shard = :shard '
+                                'REMOVE active_shard',
+            'ConditionExpression': '#status = :confirmed',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {
+                ':s': 'cancelled',
+                ':c': cancelled_at,
+                ':shard': booking_shard(booking['booking_id']),
+                ':confirmed': 'confirmed'
+            }
+        }
+        if user_id is not None:
+            update['ConditionExpression'] += ' AND user_id = :user_id'
+            update['ExpressionAttributeValues'][':user_id'] = user_id
+        return update
+
+    def cancel_actions(self, booking, cancelled_at, user_id=None):
+        """TransactWriteItems actions of cancel_booking, in plain Python values"""
+        # The status condition makes a concurrent second cancel fail instead
+        # of giving the same days back twice
+        car_type, days = inventory_days(booking)
+        actions = [{'Update': self.cancel_update(booking, cancelled_at, user_id)}]
+        for day in days:
+            actions.append({
+                'Update': {
+                    'TableName': self.names['inventory'],
+                    'Key': {'slot': f"{car_type}#{day}"},
+                    'UpdateExpression': 'ADD booked :minus_one',
+                    'ExpressionAttributeValues': {':minus_one': -1}
+                }
+            })
+        actions.append(self.rollup_update(rollup_key(booking, 'cancelled', cancelled_at),
+                                          1, to_paise(booking['total_price'])))
+        return actions
+
+    def confirmed_bookings_between(self, car_type, start_day, end_day):
+        # ActiveIndex holds confirmed bookings only, sorted by dropoff. Car
+        # types are stored as booked (any case), so that part of the filter
+        # is applied here
+        items = self.query_booking_index(
+            'ActiveIndex', lambda shard: Key('active_shard').eq(shard) & Key('dropoff').gt(start_day),
+            FilterExpression=Attr('pickup').lte(end_day)
+        )
+        return [item for item in items if item['car_type'].lower() == car_type]
+
+    def cancel_bookings(self, bookings, cancelled_at):
+        # One conditional UpdateItem per booking, several at a time; then the
+        # days and rollups of the whole chunk are given back together, one
+        # write per inventory slot instead of one per booking and day. Unlike
+        # cancel_booking this is not one transaction: a failure in between
+        # leaves days claimed (cars go unsold, never double-booked).
+        def cancel(booking):
+            try:
+                self.client.update_item(**self.cancel_update(booking, cancelled_at))
+            except self.client.exceptions.ConditionalCheckFailedException:
+                return False
+            return True
+
+        with ThreadPoolExecutor(CANCEL_THREADS) as pool:
+            cancelled = [booking for booking, done in zip(bookings, pool.map(cancel, bookings)) if done]
+        self.release_inventory([(car_type, day, count) for (car_type, day), count in released_days(cancelled).items()])
+        for key, (count, paise) in tally_cancellations(cancelled, cancelled_at).items():
+            self.client.update_item(**self.rollup_update(key, count, paise)['Update'])
+        return [booking['booking_id'] for booking in cancelled]
+
+    def rollup_update(self, key, count, paise):
+        """TransactWriteItems action adding to one BookingRollups item"""
+        return {
+            'Update': {
+                'TableName': self.names['rollups'],
+                'Key': rollup_item_key(key),
+                'UpdateExpression': 'SET #day = :day, car_type = :car_type, #status = :status '
+                                    'ADD bookings :count, revenue_paise :paise',
+                'ExpressionAttributeNames': {'#day': 'day', '#status': 'status'},
+                'ExpressionAttributeValues': {
+                    ':day': key[0], ':car_type': key[1], ':status': key[2], ':count': count, ':paise': paise
+                }
+            }
+        }
+
+    def rollups(self, start_day, end_day):
+        # One Query per month partition, sliced by the sort key; a day's rows
+        # sort before "<day>#~"
+        totals = {}
+        for month in months_between(start_day, end_day):
+            kwargs = {
+                'TableName': self.names['rollups'],
+                'KeyConditionExpression': '#month = :month AND #slot BETWEEN :start AND :end',
+                'ExpressionAttributeNames': {'#month': 'month', '#slot': 'slot'},
+                'ExpressionAttributeValues': {
+                    ':month': {'S': month}, ':start': {'S': start_day}, ':end': {'S': end_day + '#~'}
+                }
+            }
+            while True:
+                response = self.raw_client.query(**kwargs)
+                for item in response['Items']:
+                    day, car_type, status = item['slot']['S'].split('#')
+                    totals[day, car_type, status] = (int(item['bookings']['N']), int(item['revenue_paise']['N']))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return rollup_rows(totals)
+
+    def rebuild_rollups(self, since=None):
+        # A one-off job and the only place rollups are built from a full
+        # Scan. Bookings made while it runs can be counted twice or not at
+        # all, so run it before the dashboard is relied on or when traffic is quiet.
+        since = (since or '')[:10]
+        bookings = self.scan_bookings(
+            None, **projection(('car_type', 'created_at', 'cancelled_at', 'status', 'total_price'))
+        )
+        totals = tally_rollups(bookings, since)
+        stale = [item for item in self.scan(self.tables['rollups'], **projection(('month', 'slot')))
+                 if item['slot'][:10] >= since]
+        with self.tables['rollups'].batch_writer() as batch:
+            for item in stale:
+                batch.delete_item(Key={'month': item['month'], 'slot': item['slot']})
+        with self.tables['rollups'].batch_writer() as batch:
+            for key, (count, paise) in totals.items():
+                day, car_type, status = key
+                batch.put_item(Item=dict(rollup_item_key(key), day=day, car_type=car_type, status=status,
+                                         bookings=count, revenue_paise=paise))
+        return len(totals)
+
+    def get_fleet(self):
+        return self.scan(self.tables['fleet'])
+
+    def capacity(self, car_type):
+        """Fleet size for a car type (the Fleet table is scanned only once)"""
+        if self.fleet_capacity is None:
+            self.fleet_capacity = Counter(v['car_type'] for v in self.get_fleet())
+        return self.fleet_capacity[car_type]
+
+    def scan(self, table, **kwargs):
+        """Scan a table following LastEvaluatedKey until the end"""
+        items = []
+        while True:
+            response = table.scan(**kwargs)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def query(self, table, **kwargs):
+        """Query a table or index following LastEvaluatedKey until the end"""
+        items = []
+        while True:
+            response = table.query(**kwargs)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def scan_bookings(self, condition=None, **kwargs):
+        """Scan every booking, optionally filtered by a boto3 condition"""
+        if condition is not None:
+            kwargs['FilterExpression'] = condition
+        return self.scan(self.tables['bookings'], **kwargs)
+
+    def query_booking_index(self, index_name, key_condition, **kwargs):
+        """Query every shard of ChangesIndex or ActiveIndex;
+        key_condition(shard) is the boto3 key condition of one shard"""
+        items = []
+        for shard in range(BOOKING_SHARDS):
+            items.extend(self.query(self.tables[self.BOOKINGS_TABLE], IndexName=index_name,
+                                    KeyConditionExpression=key_condition(str(shard)), **kwargs))
+        return items
+
+    def backfill_booking_indexes(self):
+        """Give bookings written before ChangesIndex and ActiveIndex existed
+        their index keys; returns how many were updated"""
+        stale = self.scan_bookings(Attr('change_shard').not_exists(),
+                                   **projection(INDEXED_BOOKING_ATTRIBUTES + ('cancelled_at',)))
+        for booking in stale:
+            item = self.booking_item(booking)
+            update = 'SET change_shard = :shard, changed_at = :changed'
+            values = {':shard': item['change_shard'], ':changed': item['changed_at'], ':status': booking['status']}
+            if 'active_shard' in item:
+                update += ', active_shard = :shard'
+            try:
+                # A cancel in the meantime sets the keys itself
+                self.client.update_item(
+                    TableName=self.names[self.BOOKINGS_TABLE], Key=self.booking_key(booking),
+                    UpdateExpression=update, ConditionExpression='#status = :status',
+                    ExpressionAttributeNames={'#status': 'status'}, ExpressionAttributeValues=values
+                )
+            except self.client.exceptions.ConditionalCheckFailedException:
+                pass
+        if stale:
+            print(f"{self.names[self.BOOKINGS_TABLE]}: {len(stale)} bookings added to ChangesIndex and ActiveIndex.")
+        return len(stale)
+
+    def active_bookings(self, today):
+        return self.query_booking_index(
+            'ActiveIndex', lambda shard: Key('active_shard').eq(shard) & Key('dropoff').gt(today)
+        )
+
+    def changed_bookings(self, since):
+        # Reads INDEX_LAG_SECONDS of changes again; the availability engine
+        # applies a booking idempotently
+        since = (datetime.fromisoformat(since) - timedelta(seconds=INDEX_LAG_SECONDS)).isoformat()
+        return self.query_booking_index(
+            'ChangesIndex', lambda shard: Key('change_shard').eq(shard) & Key('changed_at').gte(since)
+        )
+
+    def claim_events(self, limit, now, lease_until):
+        response = self.tables['outbox'].query(
+            IndexName='PendingIndex',
+            KeyConditionExpression=Key('status').eq('pending') & Key('available_at').lte(now),
+            Limit=limit
+        )
+        claimed = []
+        for item in response['Items']:
+            # Optimistic lease: only one worker can move available_at on
+            try:
+                self.tables['outbox'].update_item(
+                    Key={'event_id': item['event_id']},
+                    UpdateExpression='SET available_at = :lease',
+                    ConditionExpression=Attr('available_at').eq(item['available_at']) & Attr('status').eq('pending'),
+                    ExpressionAttributeValues={':lease': lease_until}
+                )
+            except self.client.exceptions.ConditionalCheckFailedException:
+                continue
+            claimed.append({
+                'event_id': item['event_id'],
+                'event_type': item['event_type'],
+                'payload': json.loads(item['payload']),
+                'attempts': int(item['attempts'])
+            })
+        return claimed
+
+    def complete_event(self, event_id):
+        self.tables['outbox'].delete_item(Key={'event_id': event_id})
+
+    def retry_event(self, event_id, attempts, available_at, error, dead=False):
+        self.tables['outbox'].update_item(
+            Key={'event_id': event_id},
+            UpdateExpression='SET attempts = :attempts, available_at = :available_at, '
+                             'last_error = :error, #status = :status',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':attempts': attempts,
+                ':available_at': available_at,
+                ':error': error,
+                ':status': 'dead' if dead else 'pending'
+            }
+        )
+
+    def latest_rate_version(self):
+        response = self.tables['rates'].query(
+            KeyConditionExpression=Key('name').eq(RATE_TABLE_NAME),
+            ScanIndexForward=False,
+            Limit=1,
+            **projection(('version',))
+        )
+        return int(response['Items'][0]['version']) if response['Items'] else None
+
+    def get_rate_table(self, version):
+        response = self.tables['rates'].get_item(Key={'name': RATE_TABLE_NAME, 'version': version})
+        item = response.get('Item')
+        return json.loads(item['rates']) if item else None
+
+    def save_rate_table(self, rates, created_at):
+        version = (self.latest_rate_version() or 0) + 1
+        # Fails instead of overwriting if another writer took this version
+        self.tables['rates'].put_item(
+            Item={'name': RATE_TABLE_NAME, 'version': version, 'rates': json.dumps(rates),
+                  'created_at': created_at},
+            ConditionExpression=Attr('version').not_exists()
+        )
+        return version
+
+
+def create_dynamodb_storage(config):
+    """Build a DynamoDBStorage from Flask-style config (no AWS calls yet);
+    config['DYNAMODB_LAYOUT'] picks 'tables' (default) or 'single', and
+    DYNAMODB_BILLING_MODE 'PROVISIONED' (default) or 'PAY_PER_REQUEST' for
+    the tables init-db creates"""
+    from resilience import create_resilience, retry_config
+
+    # When running on EC2 with an IAM role, boto3 will automatically use the instance profile credentials
+    options = {
+        'region_name': config.get('AWS_REGION', 'ap-south-1'),
+        'endpoint_url': config.get('DYNAMODB_ENDPOINT_URL') or None,
+        'aws_access_key_id': config.get('AWS_ACCESS_KEY_ID') or None,
+        'aws_secret_access_key': config.get('AWS_SECRET_ACCESS_KEY') or None,
+        'config': retry_config(config)
+    }
+    layout = config.get('DYNAMODB_LAYOUT', 'tables')
+    if layout == 'single':
+        from singletable import SingleTableStorage
+
+        storage_class = SingleTableStorage
+    elif layout == 'tables':
+        storage_class = DynamoDBStorage
+    else:
+        raise ValueError(f"Unknown DynamoDB layout: {layout}")
+    return storage_class(
+        table_prefix=config.get('DYNAMODB_TABLE_PREFIX', ''),
+        client_options=options,
+        billing_mode=config.get('DYNAMODB_BILLING_MODE', 'PROVISIONED'),
+        throughput={
+            'ReadCapacityUnits': config.get('DYNAMODB_READ_CAPACITY', 5),
+            'WriteCapacityUnits': config.get('DYNAMODB_WRITE_CAPACITY', 5)
+        },
+        resilience=create_resilience(config)
+    )
@@ -0,0 +1,301 @@
+"""Application factory shared by cab.py, app.py and app3.py
+
+create_app() only wires objects together: it opens no database files and
+makes no network calls, so importing an entry point (or forking a gunicorn
+worker) is fast. Creating tables and running migrations is an explicit,
+once-per-deployment step:
+
+    flask --app app init-db      # DynamoDB tables (waits until ACTIVE)
+    flask --app cab init-db      # SQLite migrations
+
+Workers check the schema lazily before their first request. The result is
+remembered in a marker file (SCHEMA_MARKER, by default in the instance
+folder), so after the first successful check no worker on the host repeats it.
+
+Background threads (the notification outbox worker) are also started on the
+first request, after any gunicorn fork. Under gunicorn (gunicorn.conf.py)
+both happen earlier, in each worker's warmup (warmup.py), before it is
+reported ready.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+import click
+from flask import Flask, request
+
+from admin import register_admin_views
+from assets import build_assets, init_assets
+from availability import init_availability
+from bulk import (CANCEL_CHUNK_SIZE, FORMATS, IMPORT_CHUNK_SIZE, cancel_bookings, cancel_range, export_bookings,
+                  guess_format, import_bookings)
+from cache import create_cache
+from credentials import init_credentials
+from metrics import init_metrics
+from notifications import init_notifications
+from pagecache import init_page_cache
+from pricing import init_pricing, validate_rates
+from profiling import init_profiling, profile_token
+from storage import create_storage, init_storage
+from views import register_views
+from warmup import PROBE_ENDPOINTS, init_warmup
+
+DEFAULT_CONFIG = {
+    'SECRET_KEY': 'your_secret_key',
+    'STORAGE_BACKEND': 'sqlite',
+    'DATABASE_PATH': 'car_rental.db',
+}
+
+
+class SchemaNotReady(RuntimeError):
+    pass
+
+
+def schema_marker(app):
+    return app.config.get('SCHEMA_MARKER') or os.path.join(app.instance_path, 'schema-ready.json')
+
+
+def read_marker(path):
+    try:
+        with open(path) as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def write_marker(path, schema_id):
+    """Add schema_id to the marker file (atomic replace, safe across workers)"""
+    ready = read_marker(path) | {schema_id}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(sorted(ready), f)
+    os.replace(tmp_path, path)
+
+
+def init_db(app):
+    """Create or upgrade the schema, then record it as ready"""
+    storage = app.extensions['storage']
+    storage.init_db()
+    schema_id = storage.schema_id()
+    if schema_id:
+        write_marker(schema_marker(app), schema_id)
+    app.extensions['schema_ready'] = True
+    return schema_id
+
+
+def ensure_schema(app):
+    """Verify the schema once per worker, and once per host via the marker"""
+    if app.extensions.get('schema_ready'):
+        return
+    with app.extensions['schema_lock']:
+        if app.extensions.get('schema_ready'):
+            return
+        storage = app.extensions['storage']
+        schema_id = storage.schema_id()
+        if schema_id and schema_id not in read_marker(schema_marker(app)):
+            if not storage.check_schema():
+                raise SchemaNotReady("Database schema is missing or out of date; run `flask init-db`")
+            write_marker(schema_marker(app), schema_id)
+        app.extensions['schema_ready'] = True
+
+
+def start_background_work(app):
+    """Start the outbox worker in this process before its first request"""
+    if app.config.get('OUTBOX_ENABLED', True):
+        app.extensions['outbox'].start()
+
+
+def create_app(config=None):
+    """Build the Flask app without touching the database"""
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+
+    storage = init_storage(app)
+    init_availability(app, storage)
+    init_notifications(app, storage)
+    init_pricing(app, storage)
+    init_credentials(app)
+    init_page_cache(app)
+    init_profiling(app)
+    init_metrics(app, storage)
+    init_assets(app)
+    register_views(app)
+    register_admin_views(app)
+    init_warmup(app)
+
+    app.extensions['schema_lock'] = threading.Lock()
+
+    @app.before_request
+    def before_first_requests():
+        # The probes report on warmup instead of waiting for it
+        if request.endpoint in PROBE_ENDPOINTS:
+            return
+        ensure_schema(app)
+        start_background_work(app)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create tables / run migrations for the configured backend."""
+        schema_id = init_db(app)
+        click.echo(f"Schema ready: {schema_id or app.config['STORAGE_BACKEND']}")
+
+    @app.cli.command('set-rates')
+    @click.argument('rates_file', type=click.File())
+    def set_rates_command(rates_file):
+        """Save RATES_FILE (JSON) as the newest rate table version."""
+        rates = json.load(rates_file)
+        validate_rates(rates)
+        version = app.extensions['storage'].save_rate_table(rates, datetime.now().isoformat())
+        click.echo(f"Saved rate table version {version}; workers pick it up within "
+                   f"{app.config.get('PRICING_REFRESH_SECONDS', 30.0)}s")
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Fingerprint, precompress and resize static assets into static/dist."""
+        manifest = build_assets(app.static_folder)
+        for source, built in sorted(manifest['files'].items()):
+            click.echo(f"{source} -> {built}")
+        for source, variants in sorted(manifest['images'].items()):
+            for variant in variants:
+                sizes = ', '.join(f"{s['type'].split('/')[1]} {s['bytes'] // 1024} KB" for s in variant['sources'])
+                click.echo(f"{source} @{variant['width']}w: {sizes}")
+
+    @app.cli.command('import-bookings')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), help="Default: from the file extension.")
+    @click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True, help="Bookings per write.")
+    def import_bookings_command(path, fmt, chunk_size):
+        """Import bookings from a CSV or JSON Lines file (- for stdin)."""
+        fmt = fmt or guess_format(path)
+        if path == '-':
+            report = import_bookings(sys.stdin, fmt, chunk_size)
+        else:
+            with open(path, encoding='utf-8-sig', newline='') as f:
+                report = import_bookings(f, fmt, chunk_size)
+        click.echo(f"Imported {report.imported} of {report.rows} rows in {report.seconds:.2f}s "
+                   f"({report.as_dict()['rows_per_second']} rows/s); {report.rejected} rejected")
+        for line, reason in report.errors:
+            click.echo(f"  line {line}: {reason}")
+
+    @app.cli.command('export-bookings')
+    @click.argument('path', default='-', type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), help="Default: from the file extension.")
+    @click.option('--since', help="Only bookings created at or after this ISO timestamp.")
+    def export_bookings_command(path, fmt, since):
+        """Export bookings to a CSV or JSON Lines file (default: stdout)."""
+        fmt = fmt or guess_format(path)
+        if path == '-':
+            sys.stdout.writelines(export_bookings(fmt, since))
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(export_bookings(fmt, since))
+
+    @app.cli.command('cancel-bookings')
+    @click.argument('car_type')
+    @click.argument('start')
+    @click.argument('end')
+    @click.option('--chunk-size', default=CANCEL_CHUNK_SIZE, show_default=True, help="Bookings per write.")
+    @click.option('--dry-run', is_flag=True, help="Only count the bookings that would be cancelled.")
+    def cancel_bookings_command(car_type, start, end, chunk_size, dry_run):
+        """Cancel every confirmed CAR_TYPE booking with a day from START to END (ISO dates)."""
+        try:
+            start_day, end_day = cancel_range(start, end)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        report = cancel_bookings(car_type, start_day, end_day, chunk_size, dry_run)
+        if dry_run:
+            click.echo(f"{report.matched} confirmed {report.car_type} bookings from {start_day} to {end_day}")
+            return
+        summary = report.as_dict()
+        click.echo(f"Cancelled {report.cancelled} of {report.matched} bookings in {report.seconds:.2f}s "
+                   f"({summary['bookings_per_second']} bookings/s); {summary['skipped']} already cancelled")
+
+    @app.cli.command('backfill-rollups')
+    @click.option('--since', help="Only rebuild days from this ISO date on (default: all of history).")
+    def backfill_rollups_command(since):
+        """Rebuild the daily booking rollups from the bookings."""
+        rows = app.extensions['storage'].rebuild_rollups(since)
+        click.echo(f"Rebuilt {rows} rollup rows" + (f" from {since}" if since else ""))
+
+    @app.cli.command('migrate-dynamodb')
+    @click.option('--segments', default=8, show_default=True, help="Parallel Scan segments per table.")
+    def migrate_dynamodb_command(segments):
+        """Copy DynamoDB users and bookings into the single-table layout."""
+        from dynamo import create_dynamodb_storage
+        from singletable import migrate_to_single_table
+
+        source = create_dynamodb_storage(dict(app.config, DYNAMODB_LAYOUT='tables'))
+        target = create_dynamodb_storage(dict(app.config, DYNAMODB_LAYOUT='single'))
+        report = migrate_to_single_table(source, target, segments)
+        click.echo(f"Copied {report.users} users and {report.bookings} bookings ({report.items} items) "
+                   f"in {report.seconds:.2f}s ({report.as_dict()['items_per_second']} items/s); "
+                   f"set DYNAMODB_LAYOUT=single to switch")
+
+    @app.cli.command('profile-token')
+    @click.option('--ttl', default=600, show_default=True, help="Seconds the token stays valid.")
+    def profile_token_command(ttl):
+        """Print an X-Profile header value that profiles requests (needs PROFILE_SECRET)."""
+        if not app.config.get('PROFILE_SECRET'):
+            raise click.UsageError("PROFILE_SECRET is not set")
+        click.echo(f"X-Profile: {profile_token(app.config['PROFILE_SECRET'], ttl)}")
+
+    @app.cli.command('drain-outbox')
+    def drain_outbox_command():
+        """Deliver every notification that is due now, then exit."""
+        worker = app.extensions['outbox']
+        worker.drain()
+        click.echo(f"Outbox: {worker.stats()}")
+
+    return app
+
+
+def create_async_app(config=None):
+    """Build the Quart (ASGI) app: the booking routes and templates of
+    create_app with async storage. Like create_app, it does no I/O."""
+    from quart import Quart, url_for
+
+    from aiostorage import create_async_storage
+    from aioviews import register_async_views
+
+    app = Quart(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+
+    # The availability and pricing engines and the outbox worker keep using
+    # the synchronous backend, always from worker threads
+    storage = create_storage(app.config)
+    app.extensions['storage'] = storage
+    async_storage = app.extensions['async_storage'] = create_async_storage(app.config, storage)
+    # Only for booking versions, so bookings made here change the Flask
+    # app's My Bookings ETags (immediately when the cache is Redis)
+    cache = create_cache(app.config)
+    if cache is not None:
+        app.extensions['cache'] = cache
+    init_availability(app, storage)
+    init_notifications(app, storage)
+    init_pricing(app, storage)
+    init_credentials(app)
+    init_page_cache(app)
+    init_assets(app, url_for, serve=False)
+    register_async_views(app)
+
+    app.extensions['schema_lock'] = threading.Lock()
+
+    @app.before_request
+    async def before_first_requests():
+        if not app.extensions.get('schema_ready'):
+            await asyncio.to_thread(ensure_schema, app)
+        start_background_work(app)
+
+    @app.after_serving
+    async def shutdown():
+        await async_storage.close()
+        await asyncio.to_thread(app.extensions['outbox'].stop)
+        app.extensions['credentials'].shutdown()
+
+    return app
@@ -0,0 +1,84 @@
+"""gunicorn settings for the Flask app (cab.py, app.py, app3.py)
+
+    gunicorn -c gunicorn.conf.py                       # cab:app on SQLite
+    APP_MODULE=app:app gunicorn -c gunicorn.conf.py    # DynamoDB
+
+Run `flask --app <module> init-db` once per deployment first.
+
+The worker model follows STORAGE_BACKEND (default: the entry point's own):
+
+    sqlite    2 x cores + 1 processes with 4 threads each. Requests are
+              mostly CPU (templates, pricing, JSON); WAL lets reads run in
+              parallel but SQLite takes one writer at a time, so more threads
+              per process would only queue on the write lock.
+    dynamodb  one process per core with 10 threads each. Requests mostly
+              wait on DynamoDB round trips, which threads overlap; 10 is the
+              size of botocore's connection pool per client.
+    memory    a single process (the data lives in it) with 8 threads.
+
+WEB_CONCURRENCY and GUNICORN_THREADS override the counts, GUNICORN_BIND (or
+PORT) the address.
+
+Every worker warms up after the fork (warmup.py) before it accepts a
+connection, and /readyz reports it ready only after that.
+
+Graceful reload: `kill -HUP <master pid>` forks new workers, which import
+the current code and warm up, and stops the old ones after their in-flight
+requests finish (up to graceful_timeout). No connection is refused; new ones
+wait in the listen backlog until a fresh worker is warm. To avoid even that
+wait, start a second master with `kill -USR2` and retire the old one with
+`kill -TERM` once the new workers report ready.
+"""
+import os
+
+wsgi_app = os.environ.get('APP_MODULE', 'cab:app')
+
+# cab.py defaults to SQLite, app.py and app3.py to DynamoDB
+backend = os.environ.get('STORAGE_BACKEND') or ('sqlite' if wsgi_app.startswith('cab:') else 'dynamodb')
+cores = os.cpu_count() or 1
+
+if backend == 'memory':
+    default_workers, default_threads = 1, 8
+elif backend == 'dynamodb':
+    default_workers, default_threads = cores, 10
+else:
+    default_workers, default_threads = 2 * cores + 1, 4
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+worker_class = 'gthread'
+workers = 1 if backend == 'memory' else int(os.environ.get('WEB_CONCURRENCY', default_workers))
+threads = int(os.environ.get('GUNICORN_THREADS', default_threads))
+
+# Not preloaded: each worker imports the app itself, so a HUP picks up new
+# code (create_app does no I/O, so this costs little)
+preload_app = False
+timeout = 30
+graceful_timeout = 30
+keepalive = 5  # behind a load balancer that reuses connections
+
+# Heartbeat files on tmpfs; a slow disk can otherwise get workers killed as hung
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def post_worker_init(worker):
+    """Warm the new worker up before its first accept()"""
+    from warmup import warm_up
+
+    try:
+        steps = warm_up(worker.wsgi, connections=worker.cfg.threads)
+    except Exception as e:
+        # Staying up but unready beats a boot failure, which would stop gunicorn
+        worker.log.warning(f"Worker {worker.pid} is not ready, warmup failed: {e}")
+        return
+    timings = ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in steps.items())
+    worker.log.info(f"Worker {worker.pid} ready in {sum(steps.values()) * 1000:.0f} ms ({timings})")
+
+
+def worker_exit(server, worker):
+    """Finish the outbox and the hashing processes as a worker leaves"""
+    from warmup import shut_down
+
+    app = getattr(worker, 'wsgi', None)
+    if app is not None:
+        shut_down(app)
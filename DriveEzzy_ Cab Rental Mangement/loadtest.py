@@ -0,0 +1,334 @@
+"""Load test of the booking funnel
+
+Seeds a fresh database with --users users and --bookings bookings, then runs
+--concurrency virtual users, each going through the funnel --iterations
+times against the real Flask app (in-process test clients, so the numbers
+are app + storage time without a web server in front):
+
+    register -> login -> car_type -> book/<car_type> (GET, POST)
+             -> my_bookings -> cancel_booking
+
+A --returning share of funnels log in as a seeded user (who already has
+bookings to list) instead of registering. Reports p50/p95/p99 latency and
+throughput per route; --json writes the results (with the git commit) and
+--compare checks them against an earlier file, exiting 1 if any route's p95
+got worse by more than --max-regression (and --min-delta-ms).
+
+Usage:
+    python loadtest.py --backend sqlite --users 500 --bookings 5000 --concurrency 8
+    python loadtest.py --backend moto --json results.json
+    python loadtest.py --json new.json --compare baseline.json
+
+Backends: sqlite (temp file), memory, moto (in-process DynamoDB; runs one
+virtual user at a time because moto is not thread-safe) and dynamodb
+(DYNAMODB_ENDPOINT_URL, e.g. DynamoDB Local; tables get a unique prefix).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import quote
+
+from migrations import DEFAULT_FLEET
+from storage import BookingUnavailable
+
+SEED_PASSWORD = 'loadtest-password'
+
+# Bookings start a month out and spread over a year, inside the window the
+# pricing engine precomputes
+FIRST_DAY = date.today() + timedelta(days=30)
+BOOKING_WINDOW_DAYS = 365
+
+ROUTES = (
+    'POST /register', 'POST /login', 'GET /car_type', 'GET /book/<car_type>',
+    'POST /book/<car_type>', 'GET /my_bookings', 'POST /cancel_booking/<booking_id>',
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the booking funnel")
+    parser.add_argument('--backend', default='sqlite', choices=('sqlite', 'memory', 'moto', 'dynamodb'))
+    parser.add_argument('--users', type=int, default=200, help="users to seed")
+    parser.add_argument('--bookings', type=int, default=2000, help="bookings to seed")
+    parser.add_argument('--concurrency', type=int, default=4, help="virtual users running at once")
+    parser.add_argument('--iterations', type=int, default=25, help="funnels per virtual user")
+    parser.add_argument('--returning', type=float, default=0.5, help="share of funnels that log in as a seeded user")
+    parser.add_argument('--seed', type=int, default=1, help="random seed, for repeatable runs")
+    parser.add_argument('--hash-cost', type=int, help="PASSWORD_HASH_COST (default: the app's)")
+    parser.add_argument('--json', metavar='PATH', help="write results as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="compare with an earlier --json file")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="allowed p95 slowdown (0.2 = 20%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help="ignore p95 slowdowns smaller than this, which are noise on fast routes")
+    return parser.parse_args(argv)
+
+
+def build_app(args):
+    from factory import create_app, init_db
+
+    directory = tempfile.mkdtemp(prefix='loadtest-')
+    config = {
+        'STORAGE_BACKEND': 'dynamodb' if args.backend == 'moto' else args.backend,
+        'DATABASE_PATH': os.path.join(directory, 'loadtest.db'),
+        'SCHEMA_MARKER': os.path.join(directory, 'schema-ready.json'),
+        'AWS_REGION': os.environ.get('AWS_REGION', 'ap-south-1'),
+        'DYNAMODB_ENDPOINT_URL': os.environ.get('DYNAMODB_ENDPOINT_URL'),
+        'DYNAMODB_TABLE_PREFIX': f"loadtest-{uuid.uuid4().hex[:8]}-" if args.backend == 'dynamodb' else '',
+        'NOTIFIER': 'fake',  # the log notifier would print every booking
+        'METRICS_SLOW_REQUEST_SECONDS': 60.0,
+    }
+    if args.hash_cost:
+        config['PASSWORD_HASH_COST'] = args.hash_cost
+    app = create_app(config)
+    init_db(app)
+    return app
+
+
+def seed(app, users, bookings, rng):
+    """Insert users and bookings straight into storage; returns the emails"""
+    storage = app.extensions['storage']
+    password = app.extensions['credentials'].hash(SEED_PASSWORD)  # one hash, shared by every seeded user
+    user_ids, emails = [], []
+    for i in range(users):
+        user_ids.append(str(uuid.uuid4()))
+        emails.append(f"seed{i}-{user_ids[i][:8]}@example.com")
+        storage.create_user({'id': user_ids[i], 'name': f"Seed {i}", 'email': emails[i], 'password': password,
+                             'mobile_number': '9999999999', 'created_at': datetime.now().isoformat()})
+
+    car_types = list(DEFAULT_FLEET)
+    created = 0
+    for i in range(bookings):
+        pickup = FIRST_DAY + timedelta(days=rng.randrange(BOOKING_WINDOW_DAYS))
+        num_days = rng.randint(1, 5)
+        booking = {
+            'booking_id': str(uuid.uuid4()),
+            'user_id': user_ids[i % users],
+            'car_type': rng.choice(car_types),
+            'num_days': num_days,
+            'pickup': pickup.isoformat(),
+            'dropoff': (pickup + timedelta(days=num_days)).isoformat(),
+            'special_requests': '',
+            'payment_mode': 'upi',
+            'total_price': 2500 * num_days,
+            'status': 'confirmed',
+            'created_at': f"{datetime.now().isoformat()}-{i:07d}"
+        }
+        try:
+            storage.create_booking(booking)
+            created += 1
+        except BookingUnavailable:
+            pass  # that car type is sold out on one of the days
+    app.extensions['availability'].refresh(force=True)
+    return emails, created
+
+
+class Recorder:
+    """Latencies and errors per route, shared by the virtual users"""
+
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+        self.booked = 0
+        self.sold_out = 0
+        self.lock = threading.Lock()
+        self.enabled = True
+
+    def request(self, route, call, expected):
+        start = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - start
+        ok = response.status_code in expected
+        if self.enabled:
+            with self.lock:
+                self.latencies[route].append(elapsed)
+                if not ok:
+                    self.errors[route] += 1
+        return response if ok else None
+
+
+def run_funnel(app, recorder, rng, seeded_emails, returning):
+    """One pass through the funnel with a fresh cookie jar"""
+    client = app.test_client()
+    if seeded_emails and rng.random() < returning:
+        email, password = rng.choice(seeded_emails), SEED_PASSWORD
+    else:
+        email, password = f"load-{uuid.uuid4().hex}@example.com", 'load-test-password'
+        if not recorder.request('POST /register', lambda: client.post('/register', data={
+                'name': 'Load Test', 'email': email, 'password': password, 'mobile_number': '9999999999'}), (302,)):
+            return
+    if not recorder.request('POST /login', lambda: client.post('/login', data={
+            'email': email, 'password': password}), (302,)):
+        return
+    if not recorder.request('GET /car_type', lambda: client.get('/car_type'), (200,)):
+        return
+
+    path = '/book/' + quote(rng.choice(list(DEFAULT_FLEET)))
+    page = recorder.request('GET /book/<car_type>', lambda: client.get(path), (200,))
+    if page is None:
+        return
+    key = re.search(rb'name="idempotency_key" value="([^"]+)"', page.data)
+    pickup = FIRST_DAY + timedelta(days=rng.randrange(BOOKING_WINDOW_DAYS))
+    response = recorder.request('POST /book/<car_type>', lambda: client.post(path, data={
+        'check_in': pickup.isoformat(),
+        'check_out': (pickup + timedelta(days=rng.randint(1, 5))).isoformat(),
+        'special_requests': '', 'payment_mode': 'upi',
+        'idempotency_key': key.group(1).decode() if key else str(uuid.uuid4())}), (302,))
+    if response is None:
+        return
+    booked = 'thank_you' in response.location
+    with recorder.lock:
+        if booked:
+            recorder.booked += 1
+        else:
+            recorder.sold_out += 1
+
+    listing = recorder.request('GET /my_bookings', lambda: client.get('/my_bookings'), (200,))
+    if listing is None or not booked:
+        return
+    # Newest first, so the first cancel form is the booking just made
+    booking_id = re.search(rb'/cancel_booking/([\w-]+)', listing.data)
+    if booking_id:
+        recorder.request('POST /cancel_booking/<booking_id>',
+                         lambda: client.post(f"/cancel_booking/{booking_id.group(1).decode()}"), (302,))
+
+
+def percentile(ordered, share):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(share * len(ordered))) - 1))]
+
+
+def summarize(recorder, seconds):
+    routes = {}
+    for route in ROUTES:
+        ordered = sorted(recorder.latencies[route])
+        if not ordered:
+            continue
+        routes[route] = {
+            'count': len(ordered),
+            'errors': recorder.errors[route],
+            'throughput_rps': round(len(ordered) / seconds, 2),
+            'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+            'max_ms': round(ordered[-1] * 1000, 3),
+        }
+    requests = sum(route['count'] for route in routes.values())
+    return routes, {
+        'requests': requests,
+        'errors': sum(route['errors'] for route in routes.values()),
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(requests / seconds, 2),
+        'booked': recorder.booked,
+        'sold_out': recorder.sold_out,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(routes, total):
+    print(f"{'route':<34} {'count':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in routes.items():
+        print(f"{route:<34} {stats['count']:>6} {stats['errors']:>4} {stats['throughput_rps']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    print(f"total: {total['requests']} requests in {total['seconds']:.2f}s ({total['throughput_rps']:.1f}/s), "
+          f"{total['errors']} errors; {total['booked']} booked, {total['sold_out']} sold out")
+
+
+def compare(routes, baseline_path, max_regression, min_delta_ms):
+    """Print p95 changes against a baseline file; True if none regressed too far"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"p95 vs. {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    ok = True
+    for route, stats in routes.items():
+        before = baseline['routes'].get(route)
+        if not before or not before['p95_ms']:
+            continue
+        change = stats['p95_ms'] / before['p95_ms'] - 1
+        regressed = change > max_regression and stats['p95_ms'] - before['p95_ms'] > min_delta_ms
+        ok = ok and not regressed
+        print(f"  {route:<34} {before['p95_ms']:>8.2f} -> {stats['p95_ms']:>8.2f} ms  {change:>+7.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.backend == 'moto':
+        from moto import mock_aws
+
+        for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+            os.environ.setdefault(name, 'testing')
+        mock_aws().start()
+        if args.concurrency > 1:
+            print("moto is not thread-safe; running one virtual user at a time")
+            args.concurrency = 1
+    if args.backend == 'dynamodb' and not os.environ.get('DYNAMODB_ENDPOINT_URL'):
+        sys.exit("Set DYNAMODB_ENDPOINT_URL (e.g. http://localhost:8000) to load test DynamoDB")
+
+    rng = random.Random(args.seed)
+    app = build_app(args)
+    start = time.perf_counter()
+    emails, seeded = seed(app, args.users, args.bookings, rng)
+    print(f"{args.backend}: seeded {len(emails)} users and {seeded} bookings in {time.perf_counter() - start:.1f}s")
+
+    recorder = Recorder()
+    # Warm up outside the measurement: schema check, hashing pool, caches
+    recorder.enabled = False
+    run_funnel(app, recorder, random.Random(0), emails, 0.0)
+    run_funnel(app, recorder, random.Random(0), emails, 1.0)
+    recorder = Recorder()
+
+    def virtual_user(index):
+        user_rng = random.Random(f"{args.seed}:{index}")
+        for _ in range(args.iterations):
+            run_funnel(app, recorder, user_rng, emails, args.returning)
+
+    print(f"running {args.concurrency} virtual users x {args.iterations} funnels")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(virtual_user, range(args.concurrency)))
+    routes, total = summarize(recorder, time.perf_counter() - start)
+    app.extensions['credentials'].shutdown()
+
+    print_results(routes, total)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'args': {name: value for name, value in vars(args).items() if name not in ('json', 'compare')},
+        },
+        'routes': routes,
+        'total': total,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.json}")
+    if args.compare and not compare(routes, args.compare, args.max_regression, args.min_delta_ms):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
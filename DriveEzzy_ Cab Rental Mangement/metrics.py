@@ -0,0 +1,282 @@
+"""Request, database and cache metrics, served at /metrics
+
+Every request is timed per route, and every database call made while
+serving it is timed too: SQLite statements through an instrumented
+connection class, DynamoDB calls through botocore event hooks (which also
+ask DynamoDB for the capacity each call consumed). Cache hit rates, and
+the DynamoDB clients' throttling and coalescing counts (resilience.py),
+are read when /metrics is scraped.
+
+/metrics uses the Prometheus text format. Each gunicorn worker keeps its own
+numbers, so scrape every worker or sum them in Prometheus. Requests slower
+than METRICS_SLOW_REQUEST_SECONDS are logged with every query they ran.
+
+Config:
+    METRICS_ENABLED               default True
+    METRICS_SLOW_REQUEST_SECONDS  default 0.5
+"""
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from flask import Response, g, has_app_context, request
+
+PREFIX = 'driveezzy_'
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+# Queries listed in a slow request log line
+SLOW_LOG_MAX_QUERIES = 50
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [count per bucket..., +Inf count, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 3)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def summary(self):
+        """{labels: (count, total)}, for benchmarks"""
+        with self.lock:
+            return {labels: (series[-1], series[-2]) for labels, series in self.series.items()}
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    cumulative += count
+                    bucket_labels = format_labels(self.labels, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {series[-1]}")
+        return lines
+
+
+@lru_cache(maxsize=1024)
+def statement_labels(sql):
+    """(operation, table) for a SQL statement, e.g. ('SELECT', 'bookings')"""
+    words = sql.split(None, 1)
+    operation = words[0].upper() if words else ''
+    match = re.search(r'\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', sql, re.IGNORECASE)
+    return operation, match.group(1) if match else '-'
+
+
+class Metrics:
+    def __init__(self, slow_request_seconds=0.5):
+        self.slow_request_seconds = slow_request_seconds
+        self.requests = Counter(PREFIX + 'requests_total', 'Requests served', ('method', 'route', 'status'))
+        self.request_seconds = Histogram(PREFIX + 'request_duration_seconds', 'Request latency by route',
+                                         ('method', 'route'), REQUEST_BUCKETS)
+        self.request_queries = Histogram(PREFIX + 'request_queries', 'Database calls per request',
+                                         ('method', 'route'), QUERY_COUNT_BUCKETS)
+        self.query_seconds = Histogram(PREFIX + 'db_query_duration_seconds', 'Database call latency',
+                                       ('backend', 'operation', 'table'), QUERY_BUCKETS)
+        self.capacity = Counter(PREFIX + 'dynamodb_consumed_capacity_total',
+                                'DynamoDB capacity units consumed', ('operation', 'table'))
+        self.collectors = []  # callables returning extra exposition lines at scrape time
+
+    def record_query(self, backend, operation, table, seconds, statement):
+        self.query_seconds.observe((backend, operation, table), seconds)
+        if has_app_context():
+            queries = g.get('metrics_queries')
+            if queries is not None:
+                queries.append((backend, statement, seconds))
+
+    def connection_factory(self):
+        """sqlite3 Connection class whose statements are timed into this registry"""
+        metrics = self
+
+        class InstrumentedConnection(sqlite3.Connection):
+            def execute(self, sql, parameters=()):
+                start = time.perf_counter()
+                try:
+                    return super().execute(sql, parameters)
+                finally:
+                    metrics.record_query('sqlite', *statement_labels(sql), time.perf_counter() - start, sql)
+
+            def executemany(self, sql, parameters):
+                start = time.perf_counter()
+                try:
+                    return super().executemany(sql, parameters)
+                finally:
+                    metrics.record_query('sqlite', *statement_labels(sql), time.perf_counter() - start, sql)
+
+            def commit(self):
+                # Where a write actually hits the WAL
+                start = time.perf_counter()
+                try:
+                    return super().commit()
+                finally:
+                    metrics.record_query('sqlite', 'COMMIT', '-', time.perf_counter() - start, 'COMMIT')
+
+        return InstrumentedConnection
+
+    def instrument_boto3(self, client):
+        """Time every call a DynamoDB client makes and count consumed capacity"""
+        events = client.meta.events
+        events.register('provide-client-params.dynamodb', self.before_dynamodb_call)
+        events.register('after-call.dynamodb', self.after_dynamodb_call)
+        events.register('after-call-error.dynamodb', self.after_dynamodb_call)
+
+    def before_dynamodb_call(self, params, model, context, **kwargs):
+        if 'ReturnConsumedCapacity' in model.input_shape.members:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        context['metrics_table'] = params.get('TableName', '*')
+        context['metrics_start'] = time.perf_counter()
+
+    def after_dynamodb_call(self, model, context, parsed=None, **kwargs):
+        start = context.pop('metrics_start', None)
+        if start is None:
+            return
+        table = context.pop('metrics_table', '*')
+        capacity = (parsed or {}).get('ConsumedCapacity') or []
+        if isinstance(capacity, dict):
+            capacity = [capacity]
+        units = 0.0
+        for entry in capacity:
+            units += entry.get('CapacityUnits', 0)
+            self.capacity.inc((model.name, entry.get('TableName', table)), entry.get('CapacityUnits', 0))
+        statement = f"{model.name} {table}" + (f" ({units:g} CU)" if capacity else '')
+        self.record_query('dynamodb', model.name, table, time.perf_counter() - start, statement)
+
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = []
+
+    def finish_request(self, response, logger):
+        start = g.pop('metrics_start', None)
+        queries = g.pop('metrics_queries', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        labels = (request.method, route)
+        self.requests.inc(labels + (str(response.status_code),))
+        self.request_seconds.observe(labels, elapsed)
+        self.request_queries.observe(labels, len(queries))
+
+        if elapsed >= self.slow_request_seconds:
+            lines = [f"Slow request: {request.method} {request.path} {response.status_code} in "
+                     f"{elapsed * 1000:.1f} ms, {len(queries)} queries "
+                     f"({sum(seconds for _, _, seconds in queries) * 1000:.1f} ms)"]
+            for backend, statement, seconds in queries[:SLOW_LOG_MAX_QUERIES]:
+                lines.append(f"  {seconds * 1000:>8.2f} ms  {backend:<8} {' '.join(statement.split())[:160]}")
+            logger.warning('\n'.join(lines))
+        return response
+
+    def expose(self):
+        lines = []
+        for metric in (self.requests, self.request_seconds, self.request_queries,
+                       self.query_seconds, self.capacity):
+            lines.extend(metric.expose())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+def cache_collector(caches):
+    """Exposition lines for the hit/miss counts of named caches"""
+    def collect():
+        lines = []
+        for metric, kind, help in (('hits', 'counter', 'Cache hits'), ('misses', 'counter', 'Cache misses'),
+                                   ('evictions', 'counter', 'Cache evictions'),
+                                   ('hit_rate', 'gauge', 'Cache hit rate since start')):
+            name = PREFIX + 'cache_' + metric + ('_total' if kind == 'counter' else '')
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            for cache_name, cache in caches:
+                lines.append(f'{name}{{cache="{cache_name}"}} {cache.stats.as_dict()[metric]}')
+        return lines
+    return collect
+
+
+def resilience_collector(resilience):
+    """Exposition lines for a resilience.Resilience's counts"""
+    def collect():
+        lines = []
+        for key, help in (('coalesced', 'DynamoDB reads answered by an identical read in flight'),
+                          ('client_throttled', 'DynamoDB calls refused by the client-side throttle'),
+                          ('busy', 'DynamoDB calls still throttled after every retry'),
+                          ('injected', 'Throttling errors injected by DYNAMODB_FAULTS')):
+            name = f"{PREFIX}dynamodb_{key}_total"
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter", f"{name} {resilience.stats()[key]}"]
+        return lines
+    return collect
+
+
+def init_metrics(app, storage):
+    """Instrument the storage backend, time requests and serve /metrics"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return None
+
+    metrics = Metrics(app.config.get('METRICS_SLOW_REQUEST_SECONDS', 0.5))
+    storage.instrument(metrics)
+    caches = [('storage', app.extensions['cache'])] if 'cache' in app.extensions else []
+    if 'credentials' in app.extensions:
+        caches.append(('password', app.extensions['credentials'].verified))
+    if 'pages' in app.extensions:
+        caches.append(('pages', app.extensions['pages'].pages))
+    if caches:
+        metrics.collectors.append(cache_collector(caches))
+    if getattr(storage, 'resilience', None) is not None:
+        metrics.collectors.append(resilience_collector(storage.resilience))
+
+    app.before_request(metrics.start_request)
+    app.after_request(lambda response: metrics.finish_request(response, app.logger))
+    app.add_url_rule('/metrics', 'metrics',
+                     lambda: Response(metrics.expose(), mimetype='text/plain; version=0.0.4'))
+    app.extensions['metrics'] = metrics
+    return metrics
@@ -0,0 +1,269 @@
+"""Versioned schema migrations for the SQLite database
+
+The schema version lives in `PRAGMA user_version`. Each entry in MIGRATIONS
+upgrades the database by one version, so existing car_rental.db files pick
+up new tables and indexes in place the next time the app starts.
+
+Usage:
+    python migrations.py [database_path]   # migrate and check query plans
+"""
+import json
+import sqlite3
+import sys
+
+# Vehicles every new installation starts with (all at the main depot)
+DEFAULT_FLEET = {
+    'sedan': 10,
+    'suv': 6,
+    'mini campervan': 4
+}
+DEFAULT_LOCATION = 'Main Depot'
+
+# Rate table version 1: the old flat PRICE_PER_DAY rates, no surcharges or
+# discounts. Newer versions are added with `flask set-rates` (see pricing.py).
+DEFAULT_RATES = {
+    'car_types': {
+        'sedan': {'daily': 2500, 'weekend': 2500},
+        'suv': {'daily': 4000, 'weekend': 4000},
+        'mini campervan': {'daily': 6000, 'weekend': 6000}
+    },
+    'seasons': [],
+    'duration_tiers': []
+}
+
+
+# Rebuilds booking_rollups for every day >= the parameter from the bookings:
+# one row per (day, car type) for bookings made and one for cancellations.
+# Money is summed in paise so the totals match what the app adds up.
+ROLLUP_BACKFILL = (
+    "DELETE FROM booking_rollups WHERE day >= ?",
+    '''
+    INSERT INTO booking_rollups (day, car_type, status, bookings, revenue_paise)
+    SELECT substr(created_at, 1, 10), lower(car_type), 'confirmed', COUNT(*),
+           SUM(CAST(ROUND(total_price * 100) AS INTEGER))
+    FROM bookings WHERE created_at >= ? GROUP BY 1, 2
+    UNION ALL
+    SELECT substr(cancelled_at, 1, 10), lower(car_type), 'cancelled', COUNT(*),
+           SUM(CAST(ROUND(total_price * 100) AS INTEGER))
+    FROM bookings WHERE status = 'cancelled' AND cancelled_at >= ? GROUP BY 1, 2
+    ''',
+)
+
+
+def default_fleet():
+    """Expand DEFAULT_FLEET into vehicle rows"""
+    vehicles = []
+    for car_type, count in DEFAULT_FLEET.items():
+        prefix = car_type.replace(' ', '-').upper()
+        for n in range(1, count + 1):
+            vehicles.append({
+                'vehicle_id': f"{prefix}-{n:03d}",
+                'car_type': car_type,
+                'location': DEFAULT_LOCATION
+            })
+    return vehicles
+
+
+MIGRATIONS = [
+    # 1: initial schema
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            mobile_number TEXT,
+            created_at TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS bookings (
+            booking_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            car_type TEXT NOT NULL,
+            num_days INTEGER NOT NULL,
+            pickup TEXT NOT NULL,
+            dropoff TEXT NOT NULL,
+            special_requests TEXT,
+            payment_mode TEXT NOT NULL,
+            total_price REAL NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT,
+            cancelled_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+    ),
+    # 2: indexes for My Bookings and status filters
+    (
+        "CREATE INDEX IF NOT EXISTS idx_bookings_user_created ON bookings (user_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings (status)",
+    ),
+    # 3: booking_id tie-breaker so keyset pagination never sorts
+    (
+        "DROP INDEX IF EXISTS idx_bookings_user_created",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_user_page ON bookings (user_id, created_at DESC, booking_id DESC)",
+    ),
+    # 4: fleet inventory, plus indexes for rebuilding availability
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS fleet (
+            vehicle_id TEXT PRIMARY KEY,
+            car_type TEXT NOT NULL,
+            location TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_fleet_car_type ON fleet (car_type, location)",
+        "DROP INDEX IF EXISTS idx_bookings_status",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_status_dropoff ON bookings (status, dropoff)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_cancelled ON bookings (cancelled_at)",
+    ) + tuple(
+        f"INSERT OR IGNORE INTO fleet (vehicle_id, car_type, location) "
+        f"VALUES ('{v['vehicle_id']}', '{v['car_type']}', '{v['location']}')"
+        for v in default_fleet()
+    ),
+    # 5: per-day inventory counters, backfilled from confirmed bookings
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS inventory (
+            car_type TEXT NOT NULL,
+            day TEXT NOT NULL,
+            booked INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (car_type, day)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT OR REPLACE INTO inventory (car_type, day, booked)
+        WITH RECURSIVE booked_days (car_type, day, dropoff) AS (
+            SELECT lower(car_type), date(pickup), date(dropoff) FROM bookings
+            WHERE status = 'confirmed' AND date(pickup) IS NOT NULL
+            UNION ALL
+            SELECT car_type, date(day, '+1 day'), dropoff FROM booked_days
+            WHERE date(day, '+1 day') < dropoff
+        )
+        SELECT car_type, day, COUNT(*) FROM booked_days GROUP BY car_type, day
+        ''',
+    ),
+    # 6: transactional outbox for booking notifications
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            event_id TEXT PRIMARY KEY,
+            event_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at TEXT NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, available_at)",
+    ),
+    # 7: versioned rate tables for the pricing engine
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS rate_tables (
+            version INTEGER PRIMARY KEY,
+            rates TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO rate_tables (version, rates, created_at) "
+        f"VALUES (1, '{json.dumps(DEFAULT_RATES)}', datetime('now'))",
+    ),
+    # 8: booking_id tie-breaker for paging through all bookings (export)
+    (
+        "DROP INDEX IF EXISTS idx_bookings_created",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings (created_at, booking_id)",
+    ),
+    # 9: daily booking rollups for the admin dashboard, backfilled from history
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS booking_rollups (
+            day TEXT NOT NULL,
+            car_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            revenue_paise INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, car_type, status)
+        ) WITHOUT ROWID
+        ''',
+    ) + tuple(statement.replace('?', "''") for statement in ROLLUP_BACKFILL),
+    # 10: confirmed bookings of a car type on a range of days (admin bulk cancel)
+    (
+        "CREATE INDEX IF NOT EXISTS idx_bookings_car_type_dropoff ON bookings (lower(car_type), status, dropoff)",
+    ),
+]
+
+# Queries on the request path; each one must be answered from an index
+HOT_QUERIES = [
+    ("SELECT * FROM users WHERE id = ?", ('',)),
+    ("SELECT * FROM users WHERE email = ?", ('',)),
+    ("SELECT * FROM bookings WHERE booking_id = ?", ('',)),
+    ("SELECT * FROM bookings WHERE user_id = ? ORDER BY created_at DESC, booking_id DESC LIMIT ?", ('', 0)),
+    ("SELECT * FROM bookings WHERE user_id = ? AND (created_at, booking_id) < (?, ?) "
+     "ORDER BY created_at DESC, booking_id DESC LIMIT ?", ('', '', '', 0)),
+    ("SELECT COUNT(*) FROM bookings WHERE status = ?", ('',)),
+    ("SELECT * FROM bookings WHERE status = 'confirmed' AND dropoff > ?", ('',)),
+    ("SELECT * FROM bookings WHERE created_at >= ? UNION ALL SELECT * FROM bookings WHERE cancelled_at >= ?", ('', '')),
+    ("SELECT * FROM outbox WHERE status = 'pending' AND available_at <= ? ORDER BY available_at LIMIT ?", ('', 0)),
+    ("SELECT * FROM bookings WHERE (created_at, booking_id) > (?, ?) ORDER BY created_at, booking_id LIMIT ?",
+     ('', '', 0)),
+    ("SELECT MAX(version) FROM rate_tables", ()),
+    ("SELECT day, car_type, status, bookings, revenue_paise FROM booking_rollups "
+     "WHERE day BETWEEN ? AND ? ORDER BY day, car_type, status", ('', '')),
+    ("SELECT rates FROM rate_tables WHERE version = ?", (0,)),
+    ("SELECT booking_id, user_id, car_type, pickup, dropoff, total_price FROM bookings "
+     "WHERE lower(car_type) = ? AND status = 'confirmed' AND dropoff > ? AND pickup <= ?", ('', '', '')),
+    ("UPDATE bookings SET status = 'cancelled', cancelled_at = ? WHERE booking_id IN (?) AND +status = 'confirmed' "
+     "AND user_id = ? RETURNING booking_id, car_type, pickup, dropoff, total_price", ('', '', '')),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply every pending migration, one transaction per version"""
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        if schema_version(conn) >= version:
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have migrated while we waited for the lock
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migrated database to version {version}")
+
+
+def unindexed_queries(conn):
+    """Return (query, plan) for every hot query that scans or sorts a table"""
+    problems = []
+    for query, params in HOT_QUERIES:
+        plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        if any(step.startswith('SCAN') or 'TEMP B-TREE' in step for step in plan):
+            problems.append((query, plan))
+    return problems
+
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else 'car_rental.db')
+    migrate(conn)
+    print(f"Schema version: {schema_version(conn)}")
+    problems = unindexed_queries(conn)
+    for query, plan in problems:
+        print(f"Not indexed: {query}\n    {'; '.join(plan)}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,218 @@
+"""Booking notifications, delivered from the outbox off the request path
+
+book() only writes a booking_confirmed event into the outbox, in the same
+transaction as the booking. An OutboxWorker in each app process claims due
+events in batches, hands them to a pool of sender threads and deletes each
+one once the notifier accepts it. Failed sends are retried with exponential
+backoff; after OUTBOX_MAX_ATTEMPTS the event is parked as 'dead'.
+
+Notifiers (NOTIFIER config):
+    log   print the confirmation (default, what book() used to do inline)
+    fake  keep events in memory, with optional delay and failures (tests)
+    sns   publish to the SNS topic in NOTIFY_SNS_TOPIC_ARN
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+
+def booking_confirmed_event(booking, name):
+    """Outbox event for a new booking; the event_id is derived from the
+    booking_id so a retried booking can't queue a second confirmation"""
+    return {
+        'event_id': f"booking_confirmed:{booking['booking_id']}",
+        'event_type': 'booking_confirmed',
+        'payload': {
+            'booking_id': booking['booking_id'],
+            'user_id': booking['user_id'],
+            'name': name,
+            'car_type': booking['car_type'],
+            'num_days': booking['num_days'],
+            'pickup': booking['pickup'],
+            'dropoff': booking['dropoff'],
+            'total_price': booking['total_price']
+        },
+        'created_at': booking['created_at']
+    }
+
+
+class LogNotifier:
+    def send(self, event):
+        payload = event['payload']
+        print(f"Booking Confirmation for {payload['name']}: {payload['car_type']} for {payload['num_days']} days")
+
+
+class FakeNotifier:
+    """Collects delivered events; `delay` seconds per send and a
+    `failure_rate` share of sends raising, to exercise the retry path"""
+
+    def __init__(self, delay=0.0, failure_rate=0.0):
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.sent = []
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def send(self, event):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            with self.lock:
+                self.failures += 1
+            raise RuntimeError("fake notifier failure")
+        with self.lock:
+            self.sent.append(event)
+
+
+class SNSNotifier:
+    def __init__(self, topic_arn, region_name=None):
+        import boto3
+
+        self.topic_arn = topic_arn
+        self.client = boto3.client('sns', region_name=region_name)
+
+    def send(self, event):
+        self.client.publish(
+            TopicArn=self.topic_arn,
+            Message=json.dumps(event['payload'], default=str),
+            MessageAttributes={'event_type': {'DataType': 'String', 'StringValue': event['event_type']}}
+        )
+
+
+def create_notifier(config):
+    """Build the notifier selected by config['NOTIFIER']"""
+    notifier = config.get('NOTIFIER', 'log')
+
+    if notifier == 'log':
+        return LogNotifier()
+
+    if notifier == 'fake':
+        return FakeNotifier(config.get('FAKE_NOTIFIER_DELAY', 0.0), config.get('FAKE_NOTIFIER_FAILURE_RATE', 0.0))
+
+    if notifier == 'sns':
+        return SNSNotifier(config['NOTIFY_SNS_TOPIC_ARN'], config.get('AWS_REGION'))
+
+    raise ValueError(f"Unknown notifier: {notifier}")
+
+
+class OutboxWorker:
+    """Drains the outbox: one dispatcher thread claims batches, a thread pool sends them"""
+
+    def __init__(self, storage, notifier, workers=4, batch_size=20, poll_interval=1.0,
+                 max_attempts=5, backoff_base=2.0, backoff_max=300.0, lease_seconds=60):
+        self.storage = storage
+        self.notifier = notifier
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pool = None
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    def start(self):
+        """Start the dispatcher thread (once per process)"""
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='outbox-send')
+            self.thread = threading.Thread(target=self.run, name='outbox-dispatch', daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=5.0):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.pool.shutdown(wait=True)
+
+    def wake(self):
+        """Called after a booking commits, so its event goes out without
+        waiting for the next poll"""
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                claimed = self.process_batch()
+            except Exception as e:
+                print(f"Outbox worker error: {str(e)}")
+                claimed = 0
+            if claimed < self.batch_size:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+    def process_batch(self, pool=None):
+        """Claim one batch of due events and deliver it; returns the batch size"""
+        now = datetime.now()
+        events = self.storage.claim_events(
+            self.batch_size, now.isoformat(), (now + timedelta(seconds=self.lease_seconds)).isoformat()
+        )
+        pool = pool or self.pool
+        if pool is None:
+            results = [self.deliver(event) for event in events]
+        else:
+            results = list(pool.map(self.deliver, events))
+        return len(results)
+
+    def deliver(self, event):
+        try:
+            self.notifier.send(event)
+        except Exception as e:
+            self.fail(event, e)
+            return False
+        self.storage.complete_event(event['event_id'])
+        with self.lock:
+            self.delivered += 1
+        return True
+
+    def fail(self, event, error):
+        attempts = event['attempts'] + 1
+        dead = attempts >= self.max_attempts
+        # Exponential backoff with jitter, so failed events don't retry in lockstep
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max) * random.uniform(0.5, 1.0)
+        available_at = (datetime.now() + timedelta(seconds=delay)).isoformat()
+        self.storage.retry_event(event['event_id'], attempts, available_at, str(error), dead=dead)
+        with self.lock:
+            if dead:
+                self.dead += 1
+            else:
+                self.retried += 1
+
+    def drain(self, timeout=30.0):
+        """Deliver everything that is due now (used by the CLI and benchmarks)"""
+        deadline = time.monotonic() + timeout
+        with ThreadPoolExecutor(self.workers) as pool:
+            while time.monotonic() < deadline and self.process_batch(pool):
+                pass
+
+    def stats(self):
+        return {'delivered': self.delivered, 'retried': self.retried, 'dead': self.dead}
+
+
+def init_notifications(app, storage):
+    """Create the outbox worker and attach it to the Flask app; it starts on
+    the first request, so no threads exist before gunicorn forks"""
+    worker = OutboxWorker(
+        storage,
+        create_notifier(app.config),
+        workers=app.config.get('OUTBOX_WORKERS', 4),
+        batch_size=app.config.get('OUTBOX_BATCH_SIZE', 20),
+        poll_interval=app.config.get('OUTBOX_POLL_SECONDS', 1.0),
+        max_attempts=app.config.get('OUTBOX_MAX_ATTEMPTS', 5)
+    )
+    app.extensions['outbox'] = worker
+    return worker
@@ -0,0 +1,180 @@
+"""Full-page caching and conditional GETs for the booking pages
+
+Home, Thank You and the car type list look the same to every visitor except
+for the nav bar, which only asks whether someone is logged in. Each is
+rendered once per variant (logged in or not; for the car types, also per
+day's availability and rate table) and then served from memory. Every page
+carries an ETag computed from what it was rendered from, so a browser
+revalidating an unchanged page gets a 304 without anything being rendered.
+
+My Bookings is per user, so it isn't kept, but its ETag comes from the
+user's booking version: a token that book() and cancel_booking() replace
+(in the Quart app too, see aioviews.py), and that bulk imports and
+cancellations replace for everyone. An unchanged
+My Bookings page costs no query and no render.
+
+Booking versions are kept in the storage cache (CACHE_BACKEND), so with Redis
+every worker sees a new one at once. The in-memory cache is per worker, so
+the session carries a copy of the user's version too: a user's own booking
+changes their ETag on every worker. Changes made by an admin show up on other
+workers within CACHE_TTL_SECONDS. A version that has dropped out of the cache
+is replaced, never reused, so eviction can't bring back an old ETag.
+
+Pages with flashed messages waiting are rendered as usual and never cached.
+Every ETag also covers the release (templates and built assets), so a deploy
+changes all of them. Warmup (warmup.py) pre-renders the pages that don't
+depend on data.
+
+Config:
+    PAGE_CACHE_ENABLED      default True
+    PAGE_CACHE_MAX_PAGES    default 64
+"""
+import hashlib
+import json
+import threading
+import uuid
+
+from flask import make_response, request, session
+
+from cache import LRUCache
+
+# Pages rendered once per logged-in state, pre-rendered by warm_up
+STATIC_PAGES = ('home', 'thank_you')
+
+# Session key for the copy of the user's booking version
+SESSION_VERSION = 'bookings_version'
+
+# Rendered pages are keyed by their ETag, so only memory limits their life
+PAGE_TTL_SECONDS = 24 * 3600
+
+# Cache key of the version replaced by changes to everyone's bookings
+ALL_USERS_KEY = 'bookings:version'
+
+
+class BookingVersions:
+    """A random token per user, replaced whenever their bookings change,
+    plus one for changes that touch everyone's"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, user_id):
+        return f"{self.current(ALL_USERS_KEY)}.{self.current(f'{ALL_USERS_KEY}:{user_id}')}"
+
+    def bump(self, user_id, user_session):
+        """New version for a user's bookings; also kept in their session
+        (Flask's or Quart's, which share the cookie)"""
+        version = self.replace(f"{ALL_USERS_KEY}:{user_id}")
+        if user_session.get('user_id') == user_id:
+            user_session[SESSION_VERSION] = version
+        return version
+
+    def bump_all(self):
+        """New version for everyone's bookings (bulk imports and cancellations)"""
+        return self.replace(ALL_USERS_KEY)
+
+    def current(self, key):
+        version = self.cache.get(key)
+        return version if version is not None else self.replace(key)
+
+    def replace(self, key):
+        version = uuid.uuid4().hex[:16]
+        self.cache.set(key, version)
+        return version
+
+
+class PageCache:
+    """Rendered pages by ETag, and the ETags of per-user pages"""
+
+    def __init__(self, app, versions, max_pages=64, enabled=True):
+        self.app = app
+        self.versions = versions
+        self.enabled = enabled
+        self.pages = LRUCache(max_pages, PAGE_TTL_SECONDS)
+        self.lock = threading.Lock()
+        self.release = None
+
+    def release_id(self):
+        """Hash of every template and the asset manifest, read on first use"""
+        if self.release is None:
+            with self.lock:
+                if self.release is None:
+                    env = self.app.jinja_env
+                    digest = hashlib.sha1()
+                    for name in sorted(env.list_templates()):
+                        digest.update(name.encode())
+                        digest.update(env.loader.get_source(env, name)[0].encode())
+                    assets = self.app.extensions['assets']
+                    assets.load()
+                    digest.update(json.dumps([assets.files, assets.images], sort_keys=True).encode())
+                    self.release = digest.hexdigest()[:12]
+        return self.release
+
+    def etag(self, *parts):
+        """ETag of a page rendered from `parts`, or None if it can't be cached
+        (caching disabled, or flashed messages waiting to be shown)"""
+        if not self.enabled or session.get('_flashes'):
+            return None
+        key = json.dumps([self.release_id(), request.script_root, *parts], default=str, sort_keys=True)
+        return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+    def user_etag(self, user_id, *parts):
+        """ETag of a page rendered from a user's bookings (and `parts`)"""
+        return self.etag('user', user_id, session.get('username'), self.versions.get(user_id),
+                         session.get(SESSION_VERSION), *parts)
+
+    def not_modified(self, tag):
+        """A 304 if the browser already has the page tagged `tag`, else None"""
+        if tag is None or not request.if_none_match.contains_weak(tag):
+            return None
+        return self.respond('', tag, 304)
+
+    def respond(self, body, tag, status=200):
+        response = make_response(body, status)
+        if tag is not None:
+            response.set_etag(tag)
+            # Stored, but revalidated on every use; private as the nav bar
+            # and My Bookings depend on the session
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        return response
+
+    def page(self, render, *parts):
+        """Response for a page that only varies by `parts` and whether the
+        visitor is logged in; render() is called on a miss"""
+        tag = self.etag('page', request.endpoint, bool(session.get('user_id')), *parts)
+        if tag is None:
+            return render()
+        response = self.not_modified(tag)
+        if response is not None:
+            return response
+        body = self.pages.get(tag)
+        if body is None:
+            body = render()
+            self.pages.set(tag, body)
+        return self.respond(body, tag)
+
+    def warm_up(self):
+        """Pre-render STATIC_PAGES for visitors logged in and out"""
+        if not self.enabled:
+            return 0
+        self.release_id()
+        for endpoint in STATIC_PAGES:
+            path = next(self.app.url_map.iter_rules(endpoint)).rule
+            for user_id in (None, 'warm-up'):
+                with self.app.test_request_context(path):
+                    if user_id:
+                        session['user_id'] = user_id
+                    self.app.view_functions[endpoint]()
+        return len(self.pages.entries)
+
+
+def init_page_cache(app):
+    """Cache pages and keep booking versions in the storage cache (or a
+    private one under CACHE_BACKEND=none)"""
+    versions = BookingVersions(app.extensions.get('cache') or LRUCache(app.config.get('CACHE_MAX_ENTRIES', 10000),
+                                                                       app.config.get('CACHE_TTL_SECONDS', 300)))
+    pages = PageCache(app, versions, app.config.get('PAGE_CACHE_MAX_PAGES', 64),
+                      app.config.get('PAGE_CACHE_ENABLED', True))
+    app.extensions['pages'] = pages
+    return pages
@@ -0,0 +1,196 @@
+"""Pricing engine backed by versioned rate tables
+
+A rate table is a JSON document stored by the storage backend; every change
+is saved as a new version (`flask set-rates rates.json`). Example:
+
+    {
+        "car_types": {"suv": {"daily": 4000, "weekend": 4500}, ...},
+        "seasons": [{"start": "2025-12-20", "end": "2026-01-05", "multiplier": 1.25}],
+        "duration_tiers": [{"min_days": 7, "discount_percent": 10}]
+    }
+
+Season end dates are exclusive. When a version is loaded, the price of
+every day over the next PRICING_HORIZON_DAYS is worked out once per car type
+and kept as a running total (in paise), so quoting any date range is two
+array lookups. Workers poll for a newer version every PRICING_REFRESH_SECONDS
+and swap it in without a restart.
+"""
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+
+from availability import booked_days, parse_day
+
+
+class UnknownCarType(ValueError):
+    pass
+
+
+@dataclass(slots=True)
+class Quote:
+    car_type: str
+    check_in: str
+    check_out: str
+    num_days: int
+    subtotal: Decimal
+    discount: Decimal
+    total: Decimal
+    rate_version: int
+
+
+def to_paise(amount):
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+
+def from_paise(paise):
+    return Decimal(paise) / 100
+
+
+def validate_rates(rates):
+    """Raise ValueError if a rate table document is malformed"""
+    car_types = rates.get('car_types')
+    if not isinstance(car_types, dict) or not car_types:
+        raise ValueError("car_types must map each car type to its rates")
+    for car_type, rate in car_types.items():
+        if car_type != car_type.lower():
+            raise ValueError(f"Car type names must be lower case: {car_type}")
+        if Decimal(str(rate['daily'])) <= 0 or Decimal(str(rate.get('weekend', rate['daily']))) <= 0:
+            raise ValueError(f"Rates for {car_type} must be positive")
+    for season in rates.get('seasons', []):
+        if parse_day(season['end']) <= parse_day(season['start']) or Decimal(str(season['multiplier'])) <= 0:
+            raise ValueError(f"Invalid season: {season}")
+    for tier in rates.get('duration_tiers', []):
+        if int(tier['min_days']) < 1 or not 0 <= Decimal(str(tier['discount_percent'])) < 100:
+            raise ValueError(f"Invalid duration tier: {tier}")
+
+
+class CompiledRates:
+    """One rate table version, compiled into per-day running totals"""
+
+    def __init__(self, version, rates, origin, horizon_days):
+        self.version = version
+        self.rates = rates
+        self.origin = origin  # day ordinal of prefix[car_type][0]
+        self.horizon_days = horizon_days
+        self.seasons = [(parse_day(s['start']), parse_day(s['end']), Decimal(str(s['multiplier'])))
+                        for s in rates.get('seasons', [])]
+        self.tiers = sorted(((int(t['min_days']), Decimal(str(t['discount_percent'])))
+                             for t in rates.get('duration_tiers', [])), reverse=True)
+        self.daily = {car_type: to_paise(rate['daily']) for car_type, rate in rates['car_types'].items()}
+
+        # prefix[car_type][i] = price of the days origin .. origin + i - 1
+        self.prefix = {}
+        for car_type in rates['car_types']:
+            running = 0
+            sums = array('q', [0])
+            for day in range(origin, origin + horizon_days):
+                running += self.day_price(car_type, day)
+                sums.append(running)
+            self.prefix[car_type] = sums
+
+    def day_price(self, car_type, day):
+        """Price of one day in paise"""
+        rate = self.rates['car_types'][car_type]
+        weekend = date.fromordinal(day).weekday() >= 5
+        price = Decimal(str(rate.get('weekend', rate['daily']) if weekend else rate['daily']))
+        for start, end, multiplier in self.seasons:
+            if start <= day < end:
+                price *= multiplier
+        return to_paise(price)
+
+    def subtotal(self, car_type, days):
+        start, stop = days.start - self.origin, days.stop - self.origin
+        if 0 <= start and stop <= self.horizon_days:
+            sums = self.prefix[car_type]
+            return sums[stop] - sums[start]
+        # Outside the compiled window (far-future bookings): price day by day
+        return sum(self.day_price(car_type, day) for day in days)
+
+    def discount_percent(self, num_days):
+        for min_days, percent in self.tiers:
+            if num_days >= min_days:
+                return percent
+        return Decimal(0)
+
+
+class PricingEngine:
+    def __init__(self, storage, refresh_interval=30.0, horizon_days=730):
+        self.storage = storage
+        self.refresh_interval = refresh_interval
+        self.horizon_days = horizon_days
+        self.lock = threading.Lock()
+        self.compiled = None
+        self.last_refresh = 0.0
+
+    def load(self, version=None):
+        """Compile a rate table version (the newest by default) and swap it in"""
+        if version is None:
+            version = self.storage.latest_rate_version()
+        rates = self.storage.get_rate_table(version)
+        if rates is None:
+            raise LookupError(f"No rate table version {version}")
+        # Start a day back so quotes made just after midnight still hit the arrays
+        compiled = CompiledRates(version, rates, date.today().toordinal() - 1, self.horizon_days)
+        self.compiled = compiled
+        self.last_refresh = time.monotonic()
+        return compiled
+
+    def refresh_due(self):
+        """Whether the next refresh() will read from storage"""
+        return self.compiled is None or time.monotonic() - self.last_refresh >= self.refresh_interval
+
+    def refresh(self, force=False):
+        """Return the current rates, picking up a newer version at most once
+        per refresh interval"""
+        compiled = self.compiled
+        if compiled is not None and not force and time.monotonic() - self.last_refresh < self.refresh_interval:
+            return compiled
+        with self.lock:
+            # Another thread may have refreshed while we waited for the lock
+            compiled = self.compiled
+            if compiled is not None and not force and time.monotonic() - self.last_refresh < self.refresh_interval:
+                return compiled
+            version = self.storage.latest_rate_version()
+            stale_window = compiled is not None and compiled.origin < date.today().toordinal() - 1
+            if compiled is None or version != compiled.version or stale_window:
+                return self.load(version)
+            self.last_refresh = time.monotonic()
+            return compiled
+
+    def quote(self, car_type, check_in, check_out):
+        """Price a rental from check_in up to (not including) check_out"""
+        compiled = self.refresh()
+        key = car_type.lower()
+        if key not in compiled.prefix:
+            raise UnknownCarType(car_type)
+        days = booked_days(check_in, check_out)
+        subtotal = compiled.subtotal(key, days)
+        discount = int((subtotal * compiled.discount_percent(len(days)) / 100).quantize(Decimal(1), ROUND_HALF_UP))
+        return Quote(
+            key,
+            date.fromordinal(days.start).isoformat(),
+            date.fromordinal(days.stop).isoformat(),
+            len(days),
+            from_paise(subtotal),
+            from_paise(discount),
+            from_paise(subtotal - discount),
+            compiled.version
+        )
+
+    def daily_rates(self):
+        """Weekday rate of every car type, for the car cards"""
+        return {car_type: from_paise(paise) for car_type, paise in self.refresh().daily.items()}
+
+
+def init_pricing(app, storage):
+    """Create the pricing engine and attach it to the Flask app"""
+    engine = PricingEngine(
+        storage,
+        app.config.get('PRICING_REFRESH_SECONDS', 30.0),
+        app.config.get('PRICING_HORIZON_DAYS', 730)
+    )
+    app.extensions['pricing'] = engine
+    return engine
@@ -0,0 +1,439 @@
+"""On-demand sampling profiler for single requests
+
+Nothing is profiled unless asked for. A request is profiled when one of
+these holds:
+
+    X-Profile header   `<expires>.<signature>`: an HMAC-SHA256 of the expiry
+                       (Unix seconds) under PROFILE_SECRET; mint one with
+                       `flask --app cab profile-token`. Off unless
+                       PROFILE_SECRET is set.
+    admin toggle       POST /admin/profiling (admin.py) profiles every
+                       request, or those under a path prefix, for a while.
+                       The toggle is a file in PROFILE_DIR, so every worker on
+                       the host follows it (each re-reads it once a second).
+    sample rate        PROFILE_SAMPLE_RATE of all requests (default 0).
+
+While a request is profiled, one background thread per worker looks at the
+request thread's Python stack every PROFILE_INTERVAL_SECONDS
+(sys._current_frames, so the request runs unmodified) and weighs each sample
+by the time since the previous one. While any request is profiled the
+worker's GIL switch interval is lowered to half the sampling interval, so
+the sampler gets its turn during CPU-bound code. Stacks start at Flask's
+wsgi_app and are marked where the time went:
+
+    [jinja] <template>  rendering; compiled template blocks appear as
+                        `home.html:block_content`
+    [dynamodb]          inside boto3/botocore (signing, HTTP, parsing)
+    [sqlite]            in the sqlite3 module, called from the frame below
+    anything else       Python code: the views, storage and the framework
+
+Each profile is written to PROFILE_DIR as a speedscope file
+(https://www.speedscope.app) and as collapsed stacks in microseconds
+(flamegraph.pl --countname=us, or speedscope too); the response carries
+its id in X-Profile-Id. GET /admin/profiling lists them. The newest
+PROFILE_MAX_FILES are kept.
+
+When no request is profiled the cost is one before_request hook that
+checks a header, a float and a timestamp (`python benchmark.py profile`).
+Sampling works under threaded servers (gunicorn gthread, the Flask dev
+server); the ASGI app (asgi.py) isn't covered.
+
+Config:
+    PROFILING_ENABLED          default True; False installs nothing
+    PROFILE_SECRET             key for X-Profile signatures (default None)
+    PROFILE_SAMPLE_RATE        default 0.0
+    PROFILE_INTERVAL_SECONDS   default 0.001
+    PROFILE_DIR                default <instance path>/profiles
+    PROFILE_MAX_FILES          default 200
+"""
+import hashlib
+import hmac
+import json
+import linecache
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, request
+
+# Request header that asks for a profile, and the response header naming it
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# How often a worker re-reads the admin toggle file
+TOGGLE_CHECK_SECONDS = 1.0
+
+FORMATS = {
+    'speedscope': ('.speedscope.json', 'application/json'),
+    'collapsed': ('.collapsed.txt', 'text/plain'),
+}
+
+# A leaf frame on one of these lines is waiting in the sqlite3 C module
+SQLITE_CALL = re.compile(r'\.(?:connect|execute|executemany|executescript|commit|rollback|fetchone|fetchall|fetchmany)\(')
+
+DYNAMODB_PACKAGES = tuple(f"{os.sep}{name}{os.sep}" for name in ('boto3', 'botocore', 'urllib3', 'aioboto3',
+                                                                   'aiobotocore', 'aiohttp'))
+JINJA_PACKAGE = f"{os.sep}jinja2{os.sep}"
+
+
+def sign(secret, expires):
+    return hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+
+
+def profile_token(secret, ttl=600):
+    """X-Profile header value valid for `ttl` seconds"""
+    expires = int(time.time() + ttl)
+    return f"{expires}.{sign(secret, expires)}"
+
+
+def valid_token(secret, token):
+    expires, _, signature = token.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, sign(secret, expires))
+
+
+class Session:
+    """Samples of one request's thread"""
+
+    def __init__(self, profile_id, name, root):
+        self.profile_id = profile_id
+        self.name = name
+        self.root = root  # the wsgi_app frame; stacks stop there
+        self.lock = threading.Lock()
+        self.samples = []  # [stack (tuple of labels, root first), seconds]
+        self.count = 0
+        self.started = self.last = time.perf_counter()
+        self.finished = None
+
+    def add(self, stack, now):
+        with self.lock:
+            if self.finished is not None:
+                return
+            weight = now - self.last
+            self.last = now
+            self.count += 1
+            if self.samples and self.samples[-1][0] == stack:
+                self.samples[-1][1] += weight
+            else:
+                self.samples.append([stack, weight])
+
+    def finish(self):
+        with self.lock:
+            self.finished = time.perf_counter()
+            self.root = None
+
+
+class Sampler:
+    """One thread sampling the stacks of every request being profiled"""
+
+    def __init__(self, interval, template_dirs):
+        self.interval = interval
+        self.template_dirs = tuple(os.path.join(os.path.abspath(d), '') for d in template_dirs)
+        self.sessions = {}  # thread id -> Session
+        self.labels = {}  # code object -> (label, category)
+        self.wake = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.switch_interval = sys.getswitchinterval()
+
+    def start(self, session):
+        with self.lock:
+            if not self.sessions:
+                # A busy request thread only hands over the GIL every switch
+                # interval (5 ms by default), so shorten it while sampling
+                self.switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(min(self.switch_interval, self.interval / 2))
+            self.sessions[threading.get_ident()] = session
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def stop(self):
+        with self.lock:
+            session = self.sessions.pop(threading.get_ident(), None)
+            if session is not None and not self.sessions:
+                sys.setswitchinterval(self.switch_interval)
+        if session is not None:
+            session.finish()
+        return session
+
+    def run(self):
+        while True:
+            if not self.sessions:
+                self.wake.clear()
+                # Re-checked after clearing, so a start() in between isn't missed
+                if not self.sessions:
+                    self.wake.wait()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for thread_id, session in list(self.sessions.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    session.add(self.stack(frame, session.root), now)
+            del frames
+
+    def label(self, code):
+        """(label, category) of a code object; category is 'jinja' for
+        templates and Jinja itself, 'dynamodb' for the AWS SDK"""
+        entry = self.labels.get(code)
+        if entry is None:
+            filename = code.co_filename
+            if filename.startswith(self.template_dirs) or filename.endswith('.html'):
+                entry = (f"{os.path.basename(filename)}:{code.co_name}", 'template')
+            else:
+                category = 'jinja' if JINJA_PACKAGE in filename else (
+                    'dynamodb' if any(package in filename for package in DYNAMODB_PACKAGES) else None)
+                name = getattr(code, 'co_qualname', code.co_name)
+                entry = (f"{name} ({os.path.basename(filename)}:{code.co_firstlineno})", category)
+            self.labels[code] = entry
+        return entry
+
+    def stack(self, frame, root):
+        """Labels from the root frame to `frame`, with the markers added"""
+        entries = []
+        while frame is not None and frame is not root:
+            entries.append(self.label(frame.f_code) + (frame,))
+            frame = frame.f_back
+        entries.reverse()
+
+        stack = []
+        section = None
+        for index, (label, category, frame) in enumerate(entries):
+            if category == 'template' and section != 'jinja':
+                stack.append(f"[jinja] {label.split(':')[0]}")
+                section = 'jinja'
+            elif category and category != 'template' and category != section:
+                if category == 'jinja':
+                    # Name the template being rendered: the next template frame
+                    template = next((entry[0] for entry in entries[index:] if entry[1] == 'template'), '')
+                    stack.append(f"[jinja] {template.split(':')[0]}".rstrip())
+                else:
+                    stack.append(f"[{category}]")
+                section = category
+            stack.append(label)
+        if entries and section is None:
+            frame = entries[-1][2]
+            if SQLITE_CALL.search(linecache.getline(frame.f_code.co_filename, frame.f_lineno)):
+                stack.append('[sqlite]')
+        return tuple(stack)
+
+
+def category(stack):
+    """Where a sample's time went: the innermost marker, else 'python'"""
+    for label in reversed(stack):
+        if label.startswith('['):
+            return label[1:label.index(']')]
+    return 'python'
+
+
+def speedscope(session, metadata):
+    frames = []
+    index = {}
+    samples = []
+    weights = []
+    for stack, seconds in session.samples:
+        sample = []
+        for label in stack:
+            if label not in index:
+                index[label] = len(frames)
+                frames.append({'name': label})
+            sample.append(index[label])
+        samples.append(sample)
+        weights.append(round(seconds * 1e6))
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': session.name,
+            'unit': 'microseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+        'name': session.name,
+        'activeProfileIndex': 0,
+        'exporter': 'DriveEzzy profiling.py',
+        'metadata': metadata,
+    }
+
+
+def collapsed(session):
+    """flamegraph.pl input: `frame;frame;frame microseconds` per stack"""
+    totals = {}
+    for stack, seconds in session.samples:
+        line = ';'.join(label.replace(';', ',') for label in stack) or '<idle>'
+        totals[line] = totals.get(line, 0) + seconds
+    return ''.join(f"{line} {round(seconds * 1e6)}\n" for line, seconds in sorted(totals.items()))
+
+
+class Profiler:
+    """Decides which requests to profile and keeps the results"""
+
+    def __init__(self, directory, secret=None, sample_rate=0.0, interval=0.001, max_files=200,
+                 template_dirs=()):
+        self.directory = directory
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self.sampler = Sampler(interval, template_dirs)
+        self.toggle_path = os.path.join(directory, 'toggle.json')
+        self.toggle = None  # (until, path prefix) read from toggle_path
+        self.toggle_checked = float('-inf')
+
+    def wanted(self):
+        """Whether to profile the current request, and why (or None)"""
+        token = request.environ.get('HTTP_X_PROFILE')
+        if token is not None and self.secret and valid_token(self.secret, token):
+            return 'header'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sample'
+        now = time.monotonic()
+        if now - self.toggle_checked >= TOGGLE_CHECK_SECONDS:
+            self.toggle = self.read_toggle()
+            self.toggle_checked = now
+        if self.toggle is not None and time.time() < self.toggle[0] and request.path.startswith(self.toggle[1]):
+            return 'toggle'
+        return None
+
+    def read_toggle(self):
+        try:
+            with open(self.toggle_path) as f:
+                toggle = json.load(f)
+            return toggle['until'], toggle.get('path') or '/'
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set_toggle(self, seconds, path='/'):
+        """Profile requests under `path` on every worker for `seconds` (0 turns it off)"""
+        os.makedirs(self.directory, exist_ok=True)
+        if seconds <= 0:
+            try:
+                os.remove(self.toggle_path)
+            except FileNotFoundError:
+                pass
+        else:
+            tmp_path = f"{self.toggle_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'until': time.time() + seconds, 'path': path}, f)
+            os.replace(tmp_path, self.toggle_path)
+        self.toggle = self.read_toggle()
+        self.toggle_checked = time.monotonic()
+        return self.toggle_status()
+
+    def toggle_status(self):
+        toggle = self.read_toggle()
+        if toggle is None or toggle[0] <= time.time():
+            return {'enabled': False}
+        return {'enabled': True, 'path': toggle[1], 'seconds_left': round(toggle[0] - time.time())}
+
+    def start_request(self):
+        reason = self.wanted()
+        if reason is None:
+            return
+        # Stacks are cut at Flask's wsgi_app, the frame that dispatches the request
+        root = sys._getframe(1)
+        while root is not None and root.f_code.co_name != 'wsgi_app':
+            root = root.f_back
+        profile_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        g.profile = Session(profile_id, f"{request.method} {request.path}", root)
+        g.profile_reason = reason
+        self.sampler.start(g.profile)
+
+    def tag_response(self, response):
+        session = g.get('profile')
+        if session is not None:
+            response.headers[PROFILE_ID_HEADER] = session.profile_id
+        return response
+
+    def finish_request(self, exc=None):
+        if g.get('profile') is None:
+            return
+        session = self.sampler.stop()
+        g.profile = None
+        if session is None:
+            return
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        by_category = {}
+        for stack, seconds in session.samples:
+            name = category(stack)
+            by_category[name] = by_category.get(name, 0) + seconds
+        metadata = {
+            'id': session.profile_id,
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'reason': g.get('profile_reason'),
+            'error': repr(exc) if exc is not None else None,
+            'ms': round((session.finished - session.started) * 1000, 2),
+            'samples': session.count,
+            'ms_by_category': {name: round(seconds * 1000, 2) for name, seconds in sorted(by_category.items())},
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        self.save(session, metadata)
+
+    def path(self, profile_id, fmt):
+        return os.path.join(self.directory, profile_id + FORMATS[fmt][0])
+
+    def save(self, session, metadata):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(session.profile_id, 'speedscope'), 'w') as f:
+            json.dump(speedscope(session, metadata), f)
+        with open(self.path(session.profile_id, 'collapsed'), 'w') as f:
+            f.write(collapsed(session))
+        for profile_id in self.profile_ids()[self.max_files:]:
+            for fmt in FORMATS:
+                try:
+                    os.remove(self.path(profile_id, fmt))
+                except FileNotFoundError:
+                    pass
+
+    def profile_ids(self):
+        """Saved profiles, newest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        suffix = FORMATS['speedscope'][0]
+        return sorted((name[:-len(suffix)] for name in names if name.endswith(suffix)), reverse=True)
+
+    def profiles(self, limit=50):
+        """Metadata of the newest saved profiles"""
+        found = []
+        for profile_id in self.profile_ids()[:limit]:
+            try:
+                with open(self.path(profile_id, 'speedscope')) as f:
+                    found.append(json.load(f).get('metadata') or {'id': profile_id})
+            except (OSError, ValueError):
+                continue  # removed or still being written by another worker
+        return found
+
+
+def init_profiling(app):
+    """Profile requests on demand; the admin endpoints are in admin.py"""
+    if not app.config.get('PROFILING_ENABLED', True):
+        return None
+
+    profiler = Profiler(
+        app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles'),
+        secret=app.config.get('PROFILE_SECRET'),
+        sample_rate=app.config.get('PROFILE_SAMPLE_RATE', 0.0),
+        interval=app.config.get('PROFILE_INTERVAL_SECONDS', 0.001),
+        max_files=app.config.get('PROFILE_MAX_FILES', 200),
+        template_dirs=[os.path.join(app.root_path, app.template_folder)]
+    )
+    app.before_request(profiler.start_request)
+    app.after_request(profiler.tag_response)
+    app.teardown_request(profiler.finish_request)
+    app.extensions['profiler'] = profiler
+    return profiler
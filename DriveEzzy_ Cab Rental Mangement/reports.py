@@ -0,0 +1,81 @@
+"""Booking reports for the admin dashboard, built from the daily rollups
+
+Every report reads Storage.rollups only: at most one row per day, car type
+and status, kept up to date as bookings are made and cancelled. A report
+costs the same however many bookings there are; it grows only with the
+number of days it covers (at most MAX_REPORT_DAYS).
+
+The rollups of an existing database are built once with
+`flask backfill-rollups` (SQLite migrations also backfill them).
+"""
+from datetime import date
+from decimal import Decimal
+
+MAX_REPORT_DAYS = 366
+
+
+def report_range(start=None, end=None, today=None):
+    """(start_day, end_day) ISO dates for a report; this month so far by
+    default. Raises ValueError for bad or oversized ranges."""
+    today = today or date.today()
+    end_day = date.fromisoformat(end) if end else today
+    start_day = date.fromisoformat(start) if start else end_day.replace(day=1)
+    if start_day > end_day:
+        raise ValueError("start is after end")
+    if (end_day - start_day).days >= MAX_REPORT_DAYS:
+        raise ValueError(f"Reports cover at most {MAX_REPORT_DAYS} days")
+    return start_day.isoformat(), end_day.isoformat()
+
+
+def empty_totals():
+    return {'bookings': 0, 'revenue': Decimal(0), 'cancellations': 0, 'cancelled_revenue': Decimal(0)}
+
+
+def add_row(totals, row):
+    if row['status'] == 'cancelled':
+        totals['cancellations'] += row['bookings']
+        totals['cancelled_revenue'] += row['revenue']
+    else:
+        totals['bookings'] += row['bookings']
+        totals['revenue'] += row['revenue']
+
+
+def finish(totals):
+    """Add net revenue and the cancellation rate to a totals dict"""
+    totals['net_revenue'] = totals['revenue'] - totals['cancelled_revenue']
+    totals['cancellation_rate'] = (totals['cancellations'] / totals['bookings']) if totals['bookings'] else 0.0
+    return totals
+
+
+def booking_report(storage, start_day, end_day):
+    """Bookings, revenue and cancellations per car type per day
+
+    Revenue is counted on the day a booking is made, cancellations (and the
+    revenue they give back) on the day they happen; the cancellation rate is
+    cancellations over bookings made in the same period.
+    """
+    rows = storage.rollups(start_day, end_day)
+    car_types = sorted({row['car_type'] for row in rows})
+    days = {}
+    by_car_type = {car_type: empty_totals() for car_type in car_types}
+    overall = empty_totals()
+
+    for row in rows:
+        day = days.setdefault(row['day'], {'day': row['day'], 'total': empty_totals(), 'car_types': {}})
+        add_row(day['car_types'].setdefault(row['car_type'], empty_totals()), row)
+        add_row(day['total'], row)
+        add_row(by_car_type[row['car_type']], row)
+        add_row(overall, row)
+
+    for day in days.values():
+        finish(day['total'])
+        for totals in day['car_types'].values():
+            finish(totals)
+    return {
+        'start': start_day,
+        'end': end_day,
+        'car_types': car_types,
+        'days': [days[day] for day in sorted(days)],
+        'by_car_type': {car_type: finish(totals) for car_type, totals in by_car_type.items()},
+        'total': finish(overall)
+    }
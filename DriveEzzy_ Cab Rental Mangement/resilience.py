@@ -0,0 +1,375 @@
+"""Retries, client-side throttling and coalesced reads for the DynamoDB clients
+
+Provisioned tables (DYNAMODB_READ_CAPACITY / DYNAMODB_WRITE_CAPACITY units,
+5 by default) answer a burst of traffic with
+ProvisionedThroughputExceededException. Every client DynamoDBStorage builds
+gets:
+
+    retries      botocore's adaptive mode: backoff with jitter, plus a send
+                 rate for the whole client that drops while DynamoDB throttles
+                 (DYNAMODB_RETRY_MODE, DYNAMODB_MAX_ATTEMPTS) and timeouts
+                 well inside gunicorn's 30 s worker timeout
+    throttle     with DYNAMODB_CLIENT_THROTTLE, a read and a write token bucket
+                 per table, refilled at the table's capacity (one token per
+                 item). A table that throttles anyway halves its bucket's rate,
+                 which recovers as requests succeed. A request that would wait
+                 more than DYNAMODB_THROTTLE_WAIT seconds fails at once instead
+                 of queueing behind the others.
+    coalescing   identical GetItem, Query and Scan requests in flight at the
+                 same time go out once and share the response. Strongly
+                 consistent reads are never coalesced: one already in flight
+                 may have been sent before the caller's last write.
+    StorageBusy  throttling that outlasts the retries is raised as
+                 storage.StorageBusy, which the views turn into a "try again"
+                 message. Transactions cancelled for throttling, which
+                 botocore does not retry, are retried here the same way.
+
+FaultInjector stands in for a throttled table locally (DYNAMODB_FAULTS, in
+front of moto or DynamoDB Local). Requests over a per-table capacity, or a
+random share of them, get the throttling errors DynamoDB sends before they
+leave the client, so retries and throttling run as they would against AWS.
+`python benchmark.py throttle` drives the booking flow through it.
+"""
+import copy
+import io
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+
+from storage import StorageBusy
+
+READS = frozenset({'GetItem', 'Query', 'Scan', 'BatchGetItem', 'TransactGetItems'})
+WRITES = frozenset({'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'})
+
+# Reads that can share one response
+COALESCED = frozenset({'GetItem', 'Query', 'Scan'})
+
+THROTTLING_CODES = frozenset({'ProvisionedThroughputExceededException', 'ThrottlingException',
+                              'RequestLimitExceeded'})
+
+# CancellationReasons of a transaction cancelled for capacity
+THROTTLED_REASONS = frozenset({'ThrottlingError', 'ProvisionedThroughputExceeded'})
+
+MAX_ATTEMPTS = 4
+
+# Full-jitter backoff for throttled transactions, in seconds
+BASE_BACKOFF = 0.05
+MAX_BACKOFF = 2.0
+
+
+def retry_config(config):
+    """botocore Config for the DynamoDB clients"""
+    return Config(
+        retries={
+            'mode': config.get('DYNAMODB_RETRY_MODE', 'adaptive'),
+            # Attempts including the first: at most ~7 s of backoff in all,
+            # still well within a request
+            'total_max_attempts': config.get('DYNAMODB_MAX_ATTEMPTS', MAX_ATTEMPTS)
+        },
+        connect_timeout=config.get('DYNAMODB_CONNECT_TIMEOUT', 2),
+        read_timeout=config.get('DYNAMODB_READ_TIMEOUT', 5)
+    )
+
+
+def request_units(params):
+    """{table: items} a request reads or writes (one for a single-item call)"""
+    if 'TableName' in params:
+        return {params['TableName']: 1}
+    units = Counter()
+    for table, request in params.get('RequestItems', {}).items():
+        # BatchGetItem has {'Keys': [...]} per table, BatchWriteItem a list
+        units[table] += len(request['Keys']) if isinstance(request, dict) else len(request)
+    for action in params.get('TransactItems', ()):
+        request, = action.values()
+        units[request['TableName']] += 1
+    return units
+
+
+def is_throttled(parsed):
+    """Whether a parsed error response means DynamoDB is out of capacity"""
+    if parsed.get('Error', {}).get('Code') in THROTTLING_CODES:
+        return True
+    # A transaction that also failed a condition failed for that reason
+    codes = {reason.get('Code') for reason in parsed.get('CancellationReasons') or ()}
+    return bool(codes & THROTTLED_REASONS) and 'ConditionalCheckFailed' not in codes
+
+
+class TokenBucket:
+    """Tokens refill at `rate` per second up to `burst`. The rate halves
+    when the table throttles anyway and creeps back as requests succeed."""
+
+    def __init__(self, rate, burst):
+        self.max_rate = self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, tokens=1, timeout=0.0):
+        """Take tokens, sleeping until they have refilled; False (and nothing
+        taken) if that would be longer than timeout seconds"""
+        tokens = min(tokens, self.burst)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(tokens - self.tokens, 0.0) / self.rate
+            if wait > timeout:
+                return False
+            # Taken now, so later callers wait behind this one
+            self.tokens -= tokens
+        if wait:
+            time.sleep(wait)
+        return True
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.rate / 2, self.max_rate / 16)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class TableThrottle:
+    """A read and a write TokenBucket per table"""
+
+    def __init__(self, read_rate, write_rate, burst_seconds=1.0, max_wait=1.0):
+        self.rates = {'read': read_rate, 'write': write_rate}
+        self.burst_seconds = burst_seconds
+        self.max_wait = max_wait
+        self.buckets = {}  # (table, kind) -> TokenBucket
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def bucket(self, table, kind):
+        bucket = self.buckets.get((table, kind))
+        if bucket is None:
+            with self.lock:
+                rate = self.rates[kind]
+                bucket = self.buckets.setdefault((table, kind), TokenBucket(rate, rate * self.burst_seconds))
+        return bucket
+
+    def acquire(self, kind, units):
+        for table, count in units.items():
+            if not self.bucket(table, kind).take(count, self.max_wait):
+                self.rejected += 1
+                raise StorageBusy(f"Over the client-side {kind} rate for {table}")
+
+    def record(self, kind, units, throttled):
+        for table in units:
+            bucket = self.bucket(table, kind)
+            bucket.throttled() if throttled else bucket.succeeded()
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None  # (http response, parsed) once it has arrived
+
+
+class RequestCoalescer:
+    """Lets identical reads in flight at the same time share one response"""
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self.flights = {}  # request -> Flight
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def join(self, key, context):
+        """The response of an identical request in flight, or None if this
+        one has to be sent (and will be shared)"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                context['flight'] = (key, self.flights.setdefault(key, Flight()))
+                return None
+        # If the first request fails outright, this one is sent after all
+        if flight.done.wait(self.timeout) and flight.response is not None:
+            http_response, parsed = flight.response
+            self.coalesced += 1
+            # The resource client rewrites responses in place
+            return http_response, copy.deepcopy(parsed)
+        return None
+
+    def finish(self, context, response):
+        key, flight = context.pop('flight', (None, None))
+        if flight is None:
+            return
+        flight.response = response
+        with self.lock:
+            self.flights.pop(key, None)
+        flight.done.set()
+
+
+class Resilience:
+    """Installs the throttle, the coalescer and the fault injector on a
+    DynamoDB client through botocore's event hooks"""
+
+    def __init__(self, throttle=None, coalescer=None, faults=None, max_attempts=MAX_ATTEMPTS):
+        self.throttle = throttle
+        self.coalescer = coalescer
+        self.faults = faults
+        self.max_attempts = max_attempts
+        self.busy = 0  # throttled responses that reached the caller
+
+    def instrument(self, client):
+        events = client.meta.events
+        events.register('provide-client-params.dynamodb', self.provide_params)
+        events.register('before-call.dynamodb', self.before_call)
+        # First, to copy responses before the resource client rewrites them
+        events.register_first('after-call.dynamodb', self.share_response)
+        # Last, so metrics still record the call before StorageBusy is raised
+        events.register_last('after-call.dynamodb', self.after_call)
+        events.register('after-call-error.dynamodb', self.call_failed)
+        # Last: botocore's own retry handler answers first for everything else
+        events.register_last('needs-retry.dynamodb', self.retry_cancelled)
+        if self.faults is not None:
+            # Ahead of moto, which also answers requests from this hook
+            events.register_first('before-send.dynamodb', self.faults.before_send)
+
+    def instrument_async(self, client):
+        """aioboto3 clients get StorageBusy only: the throttle and the
+        coalescer wait on threads, which would block the event loop"""
+        client.meta.events.register_last('after-call.dynamodb', self.after_call)
+        client.meta.events.register_last('needs-retry.dynamodb', self.retry_cancelled)
+
+    def provide_params(self, params, model, context, **kwargs):
+        kind = 'read' if model.name in READS else 'write' if model.name in WRITES else None
+        if kind is None:
+            return
+        context['units'] = (kind, request_units(params))
+        if self.coalescer is not None and model.name in COALESCED and not params.get('ConsistentRead'):
+            context['coalesce'] = True
+
+    def before_call(self, model, params, context, **kwargs):
+        if context.get('coalesce'):
+            response = self.coalescer.join((model.name, params['url_path'], params['body']), context)
+            if response is not None:
+                return response
+        if self.throttle is not None and 'units' in context:
+            try:
+                self.throttle.acquire(*context['units'])
+            except StorageBusy:
+                self.call_failed(context)
+                raise
+        return None
+
+    def share_response(self, http_response, parsed, context, **kwargs):
+        if 'flight' in context:
+            self.coalescer.finish(context, (http_response, copy.deepcopy(parsed)))
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        throttled = http_response.status_code >= 300 and is_throttled(parsed)
+        if self.throttle is not None and 'units' in context:
+            self.throttle.record(*context['units'], throttled)
+        if throttled:
+            self.busy += 1
+            raise StorageBusy(f"DynamoDB is throttling {model.name}")
+
+    def retry_cancelled(self, response, attempts, **kwargs):
+        """Backoff before resending a transaction cancelled for throttling"""
+        if response is None or attempts >= self.max_attempts:
+            return None
+        http_response, parsed = response
+        if http_response.status_code < 300 or 'CancellationReasons' not in parsed or not is_throttled(parsed):
+            return None
+        return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempts))
+
+    def call_failed(self, context, **kwargs):
+        if self.coalescer is not None:
+            self.coalescer.finish(context, None)
+
+    def stats(self):
+        return {
+            'coalesced': self.coalescer.coalesced if self.coalescer else 0,
+            'client_throttled': self.throttle.rejected if self.throttle else 0,
+            'busy': self.busy,
+            'injected': sum(self.faults.throttled.values()) if self.faults else 0
+        }
+
+
+FAULT_URL = 'https://fault-injected.invalid/'
+
+
+class FaultBody(io.BytesIO):
+    def stream(self, **kwargs):
+        yield self.getvalue()
+
+
+class FaultInjector:
+    """Answers DynamoDB requests with throttling errors before they are sent:
+    those over `capacity` items per second per table (with a second's
+    burst), and a `throttle_rate` share of all others"""
+
+    def __init__(self, capacity=None, throttle_rate=0.0, seed=None):
+        self.capacity = capacity
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.buckets = {}  # (table, kind) -> TokenBucket
+        self.lock = threading.Lock()
+        self.requests = Counter()  # operation -> requests seen, retries included
+        self.throttled = Counter()  # operation -> requests throttled
+
+    def before_send(self, request, **kwargs):
+        target = request.headers.get('X-Amz-Target') or b''
+        operation = (target.decode() if isinstance(target, bytes) else target).rpartition('.')[2]
+        kind = 'read' if operation in READS else 'write' if operation in WRITES else None
+        if kind is None:
+            return None
+        units = request_units(json.loads(request.body))
+        with self.lock:
+            self.requests[operation] += 1
+            throttle = self.random.random() < self.throttle_rate
+            if self.capacity is not None and not throttle:
+                for table, count in units.items():
+                    bucket = self.buckets.setdefault((table, kind), TokenBucket(self.capacity, self.capacity))
+                    throttle = not bucket.take(count) or throttle
+            if not throttle:
+                return None
+            self.throttled[operation] += 1
+
+        if operation.startswith('Transact'):
+            # DynamoDB cancels a throttled transaction rather than throttling it
+            body = {
+                '__type': 'com.amazonaws.dynamodb.v20120810#TransactionCanceledException',
+                'message': 'Transaction cancelled, please refer cancellation reasons for specific reasons',
+                'CancellationReasons': [{'Code': 'ThrottlingError', 'Message': 'Throughput exceeds the current '
+                                         'capacity of your table or index.'}] * sum(units.values())
+            }
+        else:
+            body = {
+                '__type': 'com.amazonaws.dynamodb.v20120810#ProvisionedThroughputExceededException',
+                'message': 'The level of configured provisioned throughput for the table was exceeded.'
+            }
+        headers = {'Content-Type': 'application/x-amz-json-1.0', 'x-amzn-RequestId': 'fault-injected'}
+        url = request.url
+        # Every before-send handler runs; this one's response wins, but a
+        # later one (moto's) would still apply the request. Retries build a
+        # new request, so only this attempt goes nowhere.
+        request.url = FAULT_URL
+        return AWSResponse(url, 400, headers, FaultBody(json.dumps(body).encode()))
+
+
+def create_resilience(config):
+    """Build the Resilience selected by Flask-style config"""
+    throttle = None
+    if config.get('DYNAMODB_CLIENT_THROTTLE', False):
+        # DYNAMODB_THROTTLE_SHARE: this process's part of each table's
+        # capacity, e.g. 1 / the number of workers using the tables
+        share = config.get('DYNAMODB_THROTTLE_SHARE', 1.0)
+        throttle = TableThrottle(
+            config.get('DYNAMODB_READ_CAPACITY', 5) * share,
+            config.get('DYNAMODB_WRITE_CAPACITY', 5) * share,
+            max_wait=config.get('DYNAMODB_THROTTLE_WAIT', 1.0)
+        )
+    coalescer = RequestCoalescer() if config.get('DYNAMODB_COALESCE_READS', True) else None
+    faults = FaultInjector(**config['DYNAMODB_FAULTS']) if config.get('DYNAMODB_FAULTS') else None
+    return Resilience(throttle, coalescer, faults, config.get('DYNAMODB_MAX_ATTEMPTS', MAX_ATTEMPTS))
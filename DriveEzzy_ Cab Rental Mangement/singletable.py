@@ -0,0 +1,323 @@
+"""Single-table DynamoDB layout for users and bookings (DYNAMODB_LAYOUT=single)
+
+The default layout (dynamo.py) keeps users and bookings in two tables, each
+with a GSI projecting ALL attributes. Every booking and every cancellation
+is written to the GSI as well, and the GSI is eventually consistent, so a
+booking made a moment ago can be missing from My Bookings. Here both live in
+one table, and every lookup is a strongly consistent read on the primary key:
+
+    PK               SK                                  item
+    USER#<id>        PROFILE                             the user
+    USER#<user_id>   BOOKING#<created_at>#<booking_id>   a booking
+    EMAIL#<email>    EMAIL                               a copy of the user
+    BOOKING#<id>     KEY                                 owner, days and price
+
+My Bookings is one Query on the user's partition, newest first. The EMAIL
+item makes an address unique and a login one GetItem. The KEY item makes a
+booking_id unique (a retried form gets the same id but a new created_at) and
+lets a cancel find the booking from its id; it is ~150 bytes and never
+changes, so a cancellation writes the booking item only. Each is written in
+the same transaction as the item it points to. Booking items also carry the
+keys of the sparse ChangesIndex and ActiveIndex (see dynamo.py), which the
+availability engine and bulk cancel query instead of scanning the table. Inventory, fleet, outbox,
+rate and rollup tables are the same as in the default layout.
+
+Existing data is copied with `flask --app app migrate-dynamodb`
+(migrate_to_single_table), after which DYNAMODB_LAYOUT=single switches the app.
+"""
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.table import BatchWriter
+
+from dynamo import (BOOKING_INDEX_DEFINITIONS, BOOKING_LIST_ATTRIBUTES, TABLE_SCHEMAS, THROUGHPUT, DynamoDBStorage,
+                    booking_indexes, create_tables, projection, table_names)
+from storage import decode_cursor
+
+SINGLE_TABLE = 'CabRental'
+
+# Users and bookings move into 'main'; the other tables stay as they are
+SINGLE_TABLE_SCHEMAS = {name: schema for name, schema in TABLE_SCHEMAS.items() if name not in ('users', 'bookings')}
+SINGLE_TABLE_SCHEMAS['main'] = {
+    'KeySchema': [
+        {'AttributeName': 'PK', 'KeyType': 'HASH'},
+        {'AttributeName': 'SK', 'KeyType': 'RANGE'}
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'PK', 'AttributeType': 'S'},
+        {'AttributeName': 'SK', 'AttributeType': 'S'},
+        *BOOKING_INDEX_DEFINITIONS
+    ],
+    # Sparse: only booking items carry their keys
+    'GlobalSecondaryIndexes': booking_indexes(('PK', 'SK')),
+    'ProvisionedThroughput': THROUGHPUT
+}
+
+BOOKING_PREFIX = 'BOOKING#'
+
+# What a booking's KEY item keeps: all cancel_booking needs except the status
+KEY_ATTRIBUTES = ('booking_id', 'user_id', 'created_at', 'car_type', 'pickup', 'dropoff', 'total_price')
+
+# Parallel Scan segments per source table in migrate_to_single_table
+MIGRATION_SEGMENTS = 8
+
+
+def single_table_names(prefix=''):
+    """Physical table name for every logical table of the single-table layout"""
+    names = {name: table for name, table in table_names(prefix).items() if name in SINGLE_TABLE_SCHEMAS}
+    names['main'] = prefix + SINGLE_TABLE
+    return names
+
+
+def user_key(user_id):
+    return {'PK': f"USER#{user_id}", 'SK': 'PROFILE'}
+
+
+def email_key(email):
+    return {'PK': f"EMAIL#{email}", 'SK': 'EMAIL'}
+
+
+def booking_sort_key(booking):
+    return f"{BOOKING_PREFIX}{booking['created_at']}#{booking['booking_id']}"
+
+
+def without_keys(item):
+    """An item without its PK and SK, as the default layout would return it"""
+    if item is None:
+        return None
+    return {name: value for name, value in item.items() if name not in ('PK', 'SK')}
+
+
+class SingleTableStorage(DynamoDBStorage):
+    """DynamoDBStorage with users and bookings in one table"""
+
+    BOOKINGS_TABLE = 'main'
+
+    def __init__(self, dynamodb=None, table_prefix='', raw_client=None, client_options=None,
+                 billing_mode='PROVISIONED', throughput=None, resilience=None):
+        super().__init__(dynamodb, table_prefix, raw_client, client_options, billing_mode, throughput, resilience)
+        self.names = single_table_names(table_prefix)
+
+    def warm_up(self, connections=1):
+        self.tables['main'].get_item(Key=user_key('warm-up'))
+        self.raw_client.query(**self.list_bookings_query('warm-up', 1, None))
+
+    def init_db(self):
+        create_tables(self.dynamodb, self.names, SINGLE_TABLE_SCHEMAS, self.billing_mode, self.throughput)
+        self.backfill_booking_indexes()
+
+    def schema_id(self):
+        digest = hashlib.sha1(json.dumps(SINGLE_TABLE_SCHEMAS, sort_keys=True).encode()).hexdigest()[:12]
+        meta = self.client.meta
+        return f"dynamodb:{meta.region_name}:{meta.endpoint_url}:{self.names['main']}:{digest}"
+
+    def get_item(self, key, **kwargs):
+        """Strongly consistent GetItem on the main table"""
+        return self.tables['main'].get_item(Key=key, ConsistentRead=True, **kwargs).get('Item')
+
+    def get_user(self, user_id):
+        return without_keys(self.get_item(user_key(user_id)))
+
+    def get_user_by_email(self, email):
+        return without_keys(self.get_item(email_key(email)))
+
+    def create_user(self, user):
+        self.client.transact_write_items(TransactItems=self.user_actions(user))
+
+    def user_items(self, user):
+        """The PROFILE and EMAIL items of a user"""
+        return [dict(user, **user_key(user['id'])), dict(user, **email_key(user['email']))]
+
+    def user_actions(self, user):
+        """TransactWriteItems actions of create_user; they fail if the user
+        or the email address exists"""
+        return [{
+            'Put': {
+                'TableName': self.names['main'],
+                'Item': item,
+                'ConditionExpression': 'attribute_not_exists(PK)'
+            }
+        } for item in self.user_items(user)]
+
+    def update_password(self, user_id, password):
+        # Both copies of the user change together
+        user = self.get_user(user_id)
+        if user is not None:
+            self.client.transact_write_items(TransactItems=self.password_actions(user, password))
+
+    def password_actions(self, user, password):
+        """TransactWriteItems actions of update_password"""
+        return [{
+            'Update': {
+                'TableName': self.names['main'],
+                'Key': key,
+                'UpdateExpression': 'SET #password = :password',
+                'ExpressionAttributeNames': {'#password': 'password'},
+                'ExpressionAttributeValues': {':password': password}
+            }
+        } for key in (user_key(user['id']), email_key(user['email']))]
+
+    def booking_key(self, booking):
+        return {'PK': f"USER#{booking['user_id']}", 'SK': booking_sort_key(booking)}
+
+    def booking_id_key(self, booking_id):
+        return {'PK': f"{BOOKING_PREFIX}{booking_id}", 'SK': 'KEY'}
+
+    def booking_item(self, booking):
+        return dict(super().booking_item(booking), **self.booking_key(booking))
+
+    def key_item(self, booking):
+        """The KEY item of a booking"""
+        item = {name: booking[name] for name in KEY_ATTRIBUTES}
+        item['total_price'] = Decimal(str(booking['total_price']))
+        return dict(item, **self.booking_id_key(booking['booking_id']))
+
+    def booking_items(self, booking):
+        return [self.key_item(booking), self.booking_item(booking)]
+
+    def booking_puts(self, booking):
+        # The booking's sort key changes with created_at, so the KEY put is
+        # the one that fails on a retried booking_id
+        return [{
+            'Put': {
+                'TableName': self.names['main'],
+                'Item': self.key_item(booking),
+                'ConditionExpression': 'attribute_not_exists(PK)'
+            }
+        }, {
+            'Put': {
+                'TableName': self.names['main'],
+                'Item': self.booking_item(booking)
+            }
+        }]
+
+    def iter_bookings_scan(self, since, page_size):
+        kwargs = {
+            'TableName': self.names['main'],
+            'Limit': page_size,
+            'FilterExpression': 'begins_with(SK, :prefix)',
+            'ExpressionAttributeValues': {':prefix': {'S': BOOKING_PREFIX}}
+        }
+        if since:
+            kwargs['FilterExpression'] += ' AND created_at >= :since'
+            kwargs['ExpressionAttributeValues'][':since'] = {'S': since}
+        return kwargs
+
+    def get_booking(self, booking_id):
+        key = self.get_item(self.booking_id_key(booking_id), **projection(('booking_id', 'user_id', 'created_at')))
+        return without_keys(self.get_item(self.booking_key(key))) if key else None
+
+    def list_bookings_query(self, user_id, limit, cursor):
+        # The user's partition holds the profile and the bookings, which sort
+        # newest first by SK. The read is strongly consistent, so a booking
+        # made a moment ago is on the page. The cursor carries only the SK:
+        # it can't reach into another user's partition.
+        partition = {'S': f"USER#{user_id}"}
+        query = {
+            'TableName': self.names['main'],
+            'KeyConditionExpression': 'PK = :pk AND begins_with(SK, :prefix)',
+            'ExpressionAttributeValues': {':pk': partition, ':prefix': {'S': BOOKING_PREFIX}},
+            'ScanIndexForward': False,
+            'ConsistentRead': True,
+            'Limit': limit + 1,  # see DynamoDBStorage.list_bookings_query
+            **projection(BOOKING_LIST_ATTRIBUTES)
+        }
+        if cursor:
+            sort_key = decode_cursor(cursor).get('SK')
+            if not isinstance(sort_key, str) or not sort_key.startswith(BOOKING_PREFIX):
+                raise ValueError("Invalid cursor")
+            query['ExclusiveStartKey'] = {'PK': partition, 'SK': {'S': sort_key}}
+        return query
+
+    @staticmethod
+    def list_cursor_key(record):
+        return {'SK': booking_sort_key({'created_at': record.created_at, 'booking_id': record.booking_id})}
+
+    def cancel_lookup(self, booking_id):
+        # The KEY item has all but the status, which the transaction's condition checks
+        return {
+            'TableName': self.names['main'],
+            'Key': self.booking_id_key(booking_id),
+            'ConsistentRead': True,
+            **projection(KEY_ATTRIBUTES)
+        }
+
+    @staticmethod
+    def cancellable(booking, user_id):
+        return bool(booking) and (user_id is None or booking['user_id'] == user_id)
+
+    def scan_bookings(self, condition=None, **kwargs):
+        is_booking = Attr('SK').begins_with(BOOKING_PREFIX)
+        kwargs['FilterExpression'] = is_booking if condition is None else is_booking & condition
+        return [without_keys(item) for item in self.scan(self.tables['main'], **kwargs)]
+
+    def query_booking_index(self, index_name, key_condition, **kwargs):
+        return [without_keys(item) for item in super().query_booking_index(index_name, key_condition, **kwargs)]
+
+
+class MigrationReport:
+    def __init__(self, segments):
+        self.segments = segments
+        self.users = 0
+        self.bookings = 0
+        self.items = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'segments': self.segments,
+            'users': self.users,
+            'bookings': self.bookings,
+            'items_written': self.items,
+            'seconds': round(self.seconds, 3),
+            'items_per_second': round(self.items / self.seconds) if self.seconds else 0
+        }
+
+
+def migrate_to_single_table(source, target, segments=MIGRATION_SEGMENTS):
+    """Copy every user and booking from the tables of `source` (a
+    DynamoDBStorage) into the single table of `target` (a SingleTableStorage,
+    created if missing); returns a MigrationReport.
+
+    Each source table is read as `segments` parallel Scan segments, and
+    every segment writes its items with its own BatchWriteItem buffer. Items
+    are written whole, so a second run overwrites them with the source's
+    current version: copy once while the app runs, then again with writes
+    paused to pick up what changed, and switch DYNAMODB_LAYOUT.
+    """
+    target.init_db()
+    report = MigrationReport(segments)
+
+    def copy_segment(table, segment):
+        # Clients are thread-safe (resources aren't); one writer per thread
+        kwargs = {'TableName': source.names[table], 'Segment': segment, 'TotalSegments': segments}
+        copied = written = 0
+        with BatchWriter(target.names['main'], target.client, overwrite_by_pkeys=['PK', 'SK']) as batch:
+            while True:
+                response = source.client.scan(**kwargs)
+                for item in response['Items']:
+                    items = target.user_items(item) if table == 'users' else target.booking_items(item)
+                    for new_item in items:
+                        batch.put_item(Item=new_item)
+                    copied += 1
+                    written += len(items)
+                if 'LastEvaluatedKey' not in response:
+                    return table, copied, written
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    work = [(table, segment) for table in ('users', 'bookings') for segment in range(segments)]
+    with ThreadPoolExecutor(segments) as pool:
+        for table, copied, written in pool.map(lambda args: copy_segment(*args), work):
+            if table == 'users':
+                report.users += copied
+            else:
+                report.bookings += copied
+            report.items += written
+
+    report.seconds = time.perf_counter() - report.started
+    return report
@@ -0,0 +1,940 @@
+"""Storage backends shared by cab.py, app.py and app3.py
+
+Every backend exposes the same small repository interface for users and
+bookings, so the Flask views never talk to SQLite or DynamoDB directly.
+Items are passed around as plain dictionaries using the column names of the
+original SQLite schema, except for pages of bookings, which come back as
+compact BookingRecord objects. The DynamoDB backend lives in dynamo.py.
+"""
+import base64
+import json
+import os
+import queue
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from flask import g, has_app_context
+
+from availability import booked_days
+from cache import CachedStorage, create_cache
+from migrations import (DEFAULT_RATES, HOT_QUERIES, MIGRATIONS, ROLLUP_BACKFILL, default_fleet, migrate,
+                        schema_version)
+from pricing import from_paise, to_paise
+
+# Prices are Decimals; SQLite stores them in the REAL total_price column
+sqlite3.register_adapter(Decimal, str)
+
+
+@dataclass(slots=True)
+class BookingRecord:
+    """One row of My Bookings; money stays a Decimal until it is rendered"""
+    booking_id: str
+    user_id: str
+    created_at: str
+    car_type: str
+    pickup: str
+    dropoff: str
+    num_days: int
+    total_price: Decimal
+    status: str
+
+
+# Columns a BookingRecord is built from
+BOOKING_RECORD_COLUMNS = "booking_id, user_id, created_at, car_type, pickup, dropoff, num_days, total_price, status"
+
+
+def booking_record(row):
+    """Build a BookingRecord from a dict or sqlite3.Row"""
+    return BookingRecord(
+        row['booking_id'], row['user_id'], row['created_at'], row['car_type'],
+        row['pickup'], row['dropoff'], row['num_days'],
+        Decimal(str(row['total_price'])), row['status']
+    )
+
+
+def bookings_page(records, limit):
+    """Split limit + 1 newest-first BookingRecords into (page, next_cursor)"""
+    page = records[:limit]
+    next_cursor = None
+    if len(records) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor({'created_at': last.created_at, 'booking_id': last.booking_id})
+    return page, next_cursor
+
+
+# What a My Bookings cursor must carry: the last row's sort key
+CURSOR_FIELDS = ('created_at', 'booking_id')
+
+
+def encode_cursor(key):
+    """Turn the last-seen key of a page into an opaque URL-safe cursor"""
+    data = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields=()):
+    """Inverse of encode_cursor; raises ValueError for tampered or truncated
+    cursors, including ones where any of `fields` is missing or not a string"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, dict) or not all(isinstance(key.get(field), str) for field in fields):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def event_row(event):
+    """Parameters of SQLiteStorage.INSERT_EVENT for an outbox event"""
+    return (event['event_id'], event['event_type'], json.dumps(event['payload'], default=str),
+            event['created_at'], event['created_at'])
+
+
+class DuplicateBooking(Exception):
+    """The booking_id already exists (a retried form submission)"""
+
+
+class BookingUnavailable(Exception):
+    """No car of the requested type is free for every day of the booking"""
+
+
+class StorageBusy(Exception):
+    """The database is throttling requests; the caller should ask the user to retry"""
+
+
+class BookingTooLong(ValueError):
+    """The booking spans more than MAX_BOOKING_DAYS days"""
+
+
+# Longest booking every backend takes. DynamoDB claims one inventory counter
+# per day in a transaction of at most 100 actions, next to the booking, its
+# KEY item (single-table layout), outbox event and rollup row.
+MAX_BOOKING_DAYS = 90
+
+
+def inventory_days(booking):
+    """Inventory slots a booking occupies: (lower-cased car type, ISO days)"""
+    days = booked_days(booking['pickup'], booking['dropoff'])
+    return booking['car_type'].lower(), [date.fromordinal(day).isoformat() for day in days]
+
+
+def claimable_days(booking):
+    """inventory_days of a new booking; raises BookingTooLong past
+    MAX_BOOKING_DAYS (existing bookings are cancelled whatever their length)"""
+    car_type, days = inventory_days(booking)
+    if len(days) > MAX_BOOKING_DAYS:
+        raise BookingTooLong(f"Bookings are limited to {MAX_BOOKING_DAYS} days")
+    return car_type, days
+
+
+def rollup_key(booking, status, at):
+    """Daily rollup row a booking counts towards when it is made (status
+    'confirmed', at its created_at) or cancelled (at its cancelled_at)"""
+    return at[:10], booking['car_type'].lower(), status
+
+
+def tally_rollups(bookings, since=''):
+    """Rollup totals for booking dicts, counting days from `since` on:
+    {(day, car type, status): [bookings, revenue in paise]}"""
+    totals = {}
+    for booking in bookings:
+        marks = [('confirmed', booking.get('created_at'))]
+        if booking.get('status') == 'cancelled':
+            marks.append(('cancelled', booking.get('cancelled_at')))
+        for status, at in marks:
+            if at and at[:10] >= since:
+                entry = totals.setdefault(rollup_key(booking, status, at), [0, 0])
+                entry[0] += 1
+                entry[1] += to_paise(booking['total_price'])
+    return totals
+
+
+def tally_cancellations(bookings, cancelled_at):
+    """Rollup totals that cancelling these bookings at cancelled_at adds"""
+    totals = {}
+    for booking in bookings:
+        entry = totals.setdefault(rollup_key(booking, 'cancelled', cancelled_at), [0, 0])
+        entry[0] += 1
+        entry[1] += to_paise(booking['total_price'])
+    return totals
+
+
+def released_days(bookings):
+    """Inventory slots cancelled bookings give back: {(car type, day): cars}"""
+    released = Counter()
+    for booking in bookings:
+        car_type, days = inventory_days(booking)
+        released.update((car_type, day) for day in days)
+    return released
+
+
+def rollup_rows(totals):
+    """Rollup totals as the dicts Storage.rollups returns, in day order"""
+    return [
+        {'day': day, 'car_type': car_type, 'status': status, 'bookings': count, 'revenue': from_paise(paise)}
+        for (day, car_type, status), (count, paise) in sorted(totals.items())
+    ]
+
+
+class Storage:
+    """Repository interface implemented by every backend"""
+
+    metrics = None
+
+    def init_db(self):
+        """Create tables/indexes if they don't exist"""
+
+    def schema_id(self):
+        """Identifies this database and the schema the code expects (None if
+        there is nothing to check); used as the key in the schema marker"""
+        return None
+
+    def check_schema(self):
+        """Cheap read-only check that init_db has been run"""
+        return True
+
+    def init_app(self, app):
+        """Hook backend resources into the Flask request lifecycle"""
+
+    def warm_up(self, connections=1):
+        """Open up to `connections` connections and prepare the hot queries,
+        so a new worker's first requests don't pay for them (see warmup.py)"""
+
+    def instrument(self, metrics):
+        """Report database calls to a metrics.Metrics registry"""
+        self.metrics = metrics
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def get_user_by_email(self, email):
+        raise NotImplementedError
+
+    def create_user(self, user):
+        raise NotImplementedError
+
+    def update_password(self, user_id, password):
+        """Replace a user's stored password hash"""
+        raise NotImplementedError
+
+    def create_booking(self, booking, event=None):
+        """Insert a booking and claim inventory for each of its days
+
+        If an outbox event is given ({event_id, event_type, payload,
+        created_at}) it is written in the same transaction. Raises
+        DuplicateBooking if the booking_id already exists and
+        BookingUnavailable if any day is sold out and BookingTooLong past
+        MAX_BOOKING_DAYS; nothing is written then.
+        """
+        raise NotImplementedError
+
+    def import_bookings(self, bookings):
+        """Insert a chunk of bulk-imported bookings (no outbox events)
+
+        Returns the rejected ones as (booking, reason) pairs; every other
+        booking was written and claimed its inventory, exactly as
+        create_booking would have.
+        """
+        rejected = []
+        for booking in bookings:
+            try:
+                self.create_booking(booking)
+            except DuplicateBooking:
+                rejected.append((booking, 'duplicate booking_id'))
+            except BookingUnavailable:
+                rejected.append((booking, f"no {booking['car_type']} available for those dates"))
+            except BookingTooLong as e:
+                rejected.append((booking, str(e)))
+        return rejected
+
+    def iter_bookings(self, since=None, page_size=500):
+        """Yield every booking created at or after `since` as BookingRecords,
+        reading one page at a time"""
+        raise NotImplementedError
+
+    def get_booking(self, booking_id):
+        raise NotImplementedError
+
+    def list_bookings(self, user_id, limit=20, cursor=None):
+        """Return one page of a user's bookings, newest first
+
+        Returns (bookings, next_cursor): a list of BookingRecord and an opaque
+        cursor for the next page, or None on the last page.
+        """
+        raise NotImplementedError
+
+    def cancel_booking(self, booking_id, cancelled_at, user_id=None):
+        """Mark a confirmed booking cancelled and give back its inventory
+
+        The booking is only cancelled if it is still confirmed and, when
+        user_id is given, belongs to that user; the check is part of the
+        write, so of two concurrent cancels exactly one succeeds. Returns
+        True if this call cancelled it, False otherwise (no such booking,
+        someone else's, or already cancelled).
+        """
+        raise NotImplementedError
+
+    def confirmed_bookings_between(self, car_type, start_day, end_day):
+        """Confirmed bookings of a (lower-cased) car type with a day between
+        start_day and end_day (ISO dates, both included), as dicts with
+        booking_id, user_id, car_type, pickup, dropoff and total_price"""
+        raise NotImplementedError
+
+    def cancel_bookings(self, bookings, cancelled_at):
+        """Cancel a chunk of bookings from confirmed_bookings_between; returns
+        the booking_ids this call cancelled (the rest were cancelled meanwhile)"""
+        return [booking['booking_id'] for booking in bookings
+                if self.cancel_booking(booking['booking_id'], cancelled_at)]
+
+    def rollups(self, start_day, end_day):
+        """Daily booking rollups from start_day to end_day (ISO dates, both
+        included) as dicts with day, car_type, status, bookings and revenue
+
+        A 'confirmed' row counts the bookings made that day, a 'cancelled'
+        row the bookings cancelled that day. Both are kept up to date by
+        create_booking, import_bookings and cancel_booking, so reading them
+        never touches the bookings themselves.
+        """
+        raise NotImplementedError
+
+    def rebuild_rollups(self, since=None):
+        """Recompute the rollups of every day from `since` on (all of them
+        if None) from the bookings; returns the number of rollup rows written"""
+        raise NotImplementedError
+
+    def get_fleet(self):
+        """Return every vehicle as {vehicle_id, car_type, location}"""
+        raise NotImplementedError
+
+    def active_bookings(self, today):
+        """Return confirmed bookings that have not been dropped off before today"""
+        raise NotImplementedError
+
+    def changed_bookings(self, since):
+        """Return bookings created or cancelled at or after the `since` timestamp"""
+        raise NotImplementedError
+
+    def claim_events(self, limit, now, lease_until):
+        """Lease up to `limit` pending outbox events that are due at `now`
+
+        Other workers won't see a leased event until lease_until. Returns
+        dicts with event_id, event_type, payload and attempts.
+        """
+        raise NotImplementedError
+
+    def complete_event(self, event_id):
+        """Remove a delivered event from the outbox"""
+        raise NotImplementedError
+
+    def retry_event(self, event_id, attempts, available_at, error, dead=False):
+        """Record a failed delivery: try again at available_at, or park the
+        event as 'dead' once it is out of attempts"""
+        raise NotImplementedError
+
+    def latest_rate_version(self):
+        """Version number of the newest rate table"""
+        raise NotImplementedError
+
+    def get_rate_table(self, version):
+        """The rate table document saved as `version` (never changes)"""
+        raise NotImplementedError
+
+    def save_rate_table(self, rates, created_at):
+        """Store rates as a new version and return its number"""
+        raise NotImplementedError
+
+
+class MemoryStorage(Storage):
+    """Keeps everything in process memory (tests and benchmarks)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.bookings = {}
+        self.fleet = default_fleet()
+        self.inventory = Counter()
+        self.outbox = {}
+        self.rollup_totals = {}  # (day, car type, status) -> [bookings, revenue in paise]
+        self.rate_tables = [json.loads(json.dumps(DEFAULT_RATES))]
+
+    def get_user(self, user_id):
+        user = self.users.get(user_id)
+        return dict(user) if user else None
+
+    def get_user_by_email(self, email):
+        for user in self.users.values():
+            if user['email'] == email:
+                return dict(user)
+        return None
+
+    def create_user(self, user):
+        with self.lock:
+            self.users[user['id']] = dict(user)
+
+    def update_password(self, user_id, password):
+        with self.lock:
+            self.users[user_id]['password'] = password
+
+    def create_booking(self, booking, event=None):
+        car_type, days = claimable_days(booking)
+        with self.lock:
+            if booking['booking_id'] in self.bookings:
+                raise DuplicateBooking(booking['booking_id'])
+            capacity = sum(1 for v in self.fleet if v['car_type'] == car_type)
+            if any(self.inventory[car_type, day] >= capacity for day in days):
+                raise BookingUnavailable(car_type)
+            for day in days:
+                self.inventory[car_type, day] += 1
+            self.bookings[booking['booking_id']] = dict(booking, cancelled_at=None)
+            self.add_rollup(rollup_key(booking, 'confirmed', booking['created_at']), booking['total_price'])
+            if event:
+                self.outbox[event['event_id']] = dict(event, status='pending', attempts=0,
+                                                      available_at=event['created_at'])
+
+    def get_booking(self, booking_id):
+        booking = self.bookings.get(booking_id)
+        return dict(booking) if booking else None
+
+    def iter_bookings(self, since=None, page_size=500):
+        bookings = sorted(list(self.bookings.values()), key=lambda b: (b['created_at'], b['booking_id']))
+        for booking in bookings:
+            if since is None or booking['created_at'] >= since:
+                yield booking_record(booking)
+
+    def list_bookings(self, user_id, limit=20, cursor=None):
+        bookings = [b for b in self.bookings.values() if b['user_id'] == user_id]
+        bookings.sort(key=lambda x: (x.get('created_at', ''), x['booking_id']), reverse=True)
+        if cursor:
+            key = decode_cursor(cursor, CURSOR_FIELDS)
+            after = (key['created_at'], key['booking_id'])
+            bookings = [b for b in bookings if (b['created_at'], b['booking_id']) < after]
+
+        return bookings_page([booking_record(b) for b in bookings[:limit + 1]], limit)
+
+    def cancel_booking(self, booking_id, cancelled_at, user_id=None):
+        with self.lock:
+            booking = self.bookings.get(booking_id)
+            if not booking or booking['status'] != 'confirmed':
+                return False
+            if user_id is not None and booking['user_id'] != user_id:
+                return False
+            booking['status'] = 'cancelled'
+            booking['cancelled_at'] = cancelled_at
+            car_type, days = inventory_days(booking)
+            for day in days:
+                self.inventory[car_type, day] -= 1
+            self.add_rollup(rollup_key(booking, 'cancelled', cancelled_at), booking['total_price'])
+            return True
+
+    def confirmed_bookings_between(self, car_type, start_day, end_day):
+        return [dict(b) for b in list(self.bookings.values())
+                if b['status'] == 'confirmed' and b['car_type'].lower() == car_type
+                and b['pickup'] <= end_day and b['dropoff'] > start_day]
+
+    def add_rollup(self, key, total_price):
+        entry = self.rollup_totals.setdefault(key, [0, 0])
+        entry[0] += 1
+        entry[1] += to_paise(total_price)
+
+    def rollups(self, start_day, end_day):
+        return rollup_rows({key: entry for key, entry in list(self.rollup_totals.items())
+                            if start_day <= key[0] <= end_day})
+
+    def rebuild_rollups(self, since=None):
+        since = (since or '')[:10]
+        with self.lock:
+            totals = tally_rollups(self.bookings.values(), since)
+            self.rollup_totals = {key: entry for key, entry in self.rollup_totals.items() if key[0] < since}
+            self.rollup_totals.update(totals)
+        return len(totals)
+
+    def get_fleet(self):
+        return [dict(v) for v in self.fleet]
+
+    def active_bookings(self, today):
+        return [dict(b) for b in list(self.bookings.values())
+                if b['status'] == 'confirmed' and b['dropoff'] > today]
+
+    def changed_bookings(self, since):
+        return [dict(b) for b in list(self.bookings.values())
+                if b['created_at'] >= since or (b['cancelled_at'] or '') >= since]
+
+    def claim_events(self, limit, now, lease_until):
+        with self.lock:
+            due = sorted((e for e in self.outbox.values()
+                          if e['status'] == 'pending' and e['available_at'] <= now),
+                         key=lambda e: e['available_at'])[:limit]
+            for event in due:
+                event['available_at'] = lease_until
+            return [{k: event[k] for k in ('event_id', 'event_type', 'payload', 'attempts')} for event in due]
+
+    def complete_event(self, event_id):
+        with self.lock:
+            self.outbox.pop(event_id, None)
+
+    def retry_event(self, event_id, attempts, available_at, error, dead=False):
+        with self.lock:
+            event = self.outbox.get(event_id)
+            if event:
+                event.update(attempts=attempts, available_at=available_at, last_error=error,
+                             status='dead' if dead else 'pending')
+
+    def latest_rate_version(self):
+        return len(self.rate_tables)
+
+    def get_rate_table(self, version):
+        return self.rate_tables[version - 1]
+
+    def save_rate_table(self, rates, created_at):
+        with self.lock:
+            self.rate_tables.append(rates)
+            return len(self.rate_tables)
+
+
+class SQLiteStorage(Storage):
+    """SQLite backend used by cab.py
+
+    Connections are long-lived and kept in a pool. Inside a Flask request one
+    connection is borrowed into `g` and handed back on teardown, so a request
+    never pays for a file open or a schema parse.
+    """
+
+    # Applied to every new connection. WAL lets readers run while the booking
+    # writer commits; synchronous=NORMAL is durable enough under WAL.
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA cache_size = -16000",  # ~16 MB page cache per connection
+        "PRAGMA mmap_size = 268435456",  # 256 MB memory-mapped I/O
+        "PRAGMA temp_store = MEMORY",
+    )
+
+    # Statements shared with the aiosqlite backend (aiostorage.py)
+    INSERT_BOOKING = """INSERT INTO bookings
+        (booking_id, user_id, car_type, num_days, pickup, dropoff, special_requests,
+        payment_mode, total_price, status, created_at)
+        VALUES (:booking_id, :user_id, :car_type, :num_days, :pickup, :dropoff, :special_requests,
+        :payment_mode, :total_price, :status, :created_at)"""
+    INSERT_EVENT = """INSERT INTO outbox (event_id, event_type, payload, available_at, created_at)
+        VALUES (?, ?, ?, ?, ?)"""
+    # Claims one car on one day; refuses (rowcount 0) once the day is full
+    CLAIM_DAY = """INSERT INTO inventory (car_type, day, booked) VALUES (?, ?, 1)
+        ON CONFLICT (car_type, day) DO UPDATE SET booked = booked + 1 WHERE booked < ?"""
+
+    # Gives back cars on one day: (cars, car_type, day)
+    RELEASE_DAYS = "UPDATE inventory SET booked = booked - ? WHERE car_type = ? AND day = ?"
+
+    # Adds to one daily rollup row: (day, car_type, status, bookings, revenue_paise)
+    ROLLUP_UPSERT = """INSERT INTO booking_rollups (day, car_type, status, bookings, revenue_paise)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (day, car_type, status) DO UPDATE SET
+        bookings = bookings + excluded.bookings, revenue_paise = revenue_paise + excluded.revenue_paise"""
+
+    def __init__(self, database_path, pool_size=8, statement_cache_size=128):
+        self.database_path = database_path
+        self.statement_cache_size = statement_cache_size
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.connection_class = sqlite3.Connection
+
+    def instrument(self, metrics):
+        # Applies to connections opened from now on, so call it before the first request
+        self.metrics = metrics
+        self.connection_class = metrics.connection_factory()
+
+    def init_db(self):
+        """Create or upgrade the database schema in place"""
+        with self.get_db_connection() as conn:
+            migrate(conn)
+
+    def schema_id(self):
+        # The inode changes if the file is deleted and recreated
+        path = os.path.abspath(self.database_path)
+        try:
+            inode = os.stat(path).st_ino
+        except OSError:
+            inode = 'new'
+        return f"sqlite:{path}:{inode}:v{len(MIGRATIONS)}"
+
+    def check_schema(self):
+        with self.get_db_connection() as conn:
+            return schema_version(conn) >= len(MIGRATIONS)
+
+    def connect(self):
+        """Open a new tuned connection to the SQLite database"""
+        conn = sqlite3.connect(
+            self.database_path,
+            timeout=5,
+            check_same_thread=False,  # connections move between worker threads via the pool
+            cached_statements=self.statement_cache_size,
+            factory=self.connection_class
+        )
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if it is empty"""
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def warm_up(self, connections=1):
+        # Borrowed all at once so each is a separate connection, then pooled.
+        # Stepping each hot query once compiles it into the statement cache
+        # and pulls the schema and index roots into the page cache. The
+        # UPDATE among them matches nothing but opens a write transaction,
+        # which is rolled back before the next connection needs the lock.
+        opened = [self.acquire() for _ in range(min(connections, self.pool.maxsize))]
+        try:
+            for conn in opened:
+                for query, params in HOT_QUERIES:
+                    conn.execute(query, params).fetchone()
+                conn.rollback()
+        finally:
+            for conn in opened:
+                self.release(conn)
+
+    def init_app(self, app):
+        app.teardown_appcontext(self.teardown)
+
+    def teardown(self, exception=None):
+        conn = g.pop('sqlite_conn', None)
+        if conn is not None:
+            self.release(conn)
+
+    @contextmanager
+    def get_db_connection(self):
+        """Borrow a pooled connection for the current request (or just this call)"""
+        if has_app_context():
+            if 'sqlite_conn' not in g:
+                g.sqlite_conn = self.acquire()
+            yield g.sqlite_conn
+            return
+
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def fetch_one(self, query, params):
+        with self.get_db_connection() as conn:
+            row = conn.execute(query, params).fetchone()
+            return dict(row) if row else None
+
+    def execute(self, query, params):
+        with self.get_db_connection() as conn:
+            with conn:  # commits, or rolls back on error
+                conn.execute(query, params)
+
+    def get_user(self, user_id):
+        return self.fetch_one("SELECT * FROM users WHERE id = ?", (user_id,))
+
+    def get_user_by_email(self, email):
+        return self.fetch_one("SELECT * FROM users WHERE email = ?", (email,))
+
+    def create_user(self, user):
+        self.execute(
+            "INSERT INTO users (id, name, email, password, mobile_number, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (user['id'], user['name'], user['email'], user['password'], user['mobile_number'], user['created_at'])
+        )
+
+    def update_password(self, user_id, password):
+        self.execute("UPDATE users SET password = ? WHERE id = ?", (password, user_id))
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE transaction: takes the write lock up front, so
+        read-then-write sequences inside it can't interleave with others"""
+        with self.get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def create_booking(self, booking, event=None):
+        car_type, days = claimable_days(booking)
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM bookings WHERE booking_id = ?", (booking['booking_id'],)).fetchone():
+                raise DuplicateBooking(booking['booking_id'])
+
+            # Claim one car per day; the upsert refuses once a day is full
+            capacity = conn.execute("SELECT COUNT(*) FROM fleet WHERE car_type = ?", (car_type,)).fetchone()[0]
+            for day in days:
+                cursor = conn.execute(self.CLAIM_DAY, (car_type, day, capacity))
+                if capacity < 1 or cursor.rowcount != 1:
+                    raise BookingUnavailable(car_type)
+
+            conn.execute(self.INSERT_BOOKING, booking)
+            conn.execute(self.ROLLUP_UPSERT, rollup_key(booking, 'confirmed', booking['created_at'])
+                         + (1, to_paise(booking['total_price'])))
+            if event:
+                conn.execute(self.INSERT_EVENT, event_row(event))
+
+    def import_bookings(self, bookings):
+        # One transaction per chunk: existing ids are skipped, inventory is
+        # claimed with one upsert per (car type, day) and the bookings go in
+        # with a single executemany. If any day would overflow, the chunk is
+        # rolled back and retried row by row so only the bookings that don't
+        # fit are rejected.
+        if not bookings:
+            return []
+        rejected, fresh, seen = [], [], set()
+        with self.transaction() as conn:
+            placeholders = ', '.join('?' * len(bookings))
+            existing = {row[0] for row in conn.execute(
+                f"SELECT booking_id FROM bookings WHERE booking_id IN ({placeholders})",
+                [booking['booking_id'] for booking in bookings]
+            )}
+            claims = Counter()
+            for booking in bookings:
+                if booking['booking_id'] in existing or booking['booking_id'] in seen:
+                    rejected.append((booking, 'duplicate booking_id'))
+                    continue
+                try:
+                    car_type, days = claimable_days(booking)
+                except BookingTooLong as e:
+                    rejected.append((booking, str(e)))
+                    continue
+                seen.add(booking['booking_id'])
+                fresh.append(booking)
+                claims.update((car_type, day) for day in days)
+
+            capacity = dict(conn.execute("SELECT car_type, COUNT(*) FROM fleet GROUP BY car_type").fetchall())
+            if any(count > capacity.get(car_type, 0) for (car_type, _), count in claims.items()):
+                fits = False
+            else:
+                cursor = conn.executemany(
+                    """INSERT INTO inventory (car_type, day, booked) VALUES (?, ?, ?)
+                    ON CONFLICT (car_type, day) DO UPDATE SET booked = booked + excluded.booked
+                    WHERE booked + excluded.booked <= ?""",
+                    [(car_type, day, count, capacity[car_type]) for (car_type, day), count in claims.items()]
+                )
+                fits = cursor.rowcount == len(claims)
+            if fits:
+                conn.executemany(self.INSERT_BOOKING, fresh)
+                conn.executemany(self.ROLLUP_UPSERT,
+                                 [key + tuple(entry) for key, entry in tally_rollups(fresh).items()])
+                return rejected
+            conn.rollback()
+        return rejected + super().import_bookings(fresh)
+
+    def iter_bookings(self, since=None, page_size=500):
+        # Keyset pages in (created_at, booking_id) order, so no read
+        # transaction stays open while the caller writes out a page
+        key = (since or '', '')
+        while True:
+            with self.get_db_connection() as conn:
+                rows = conn.execute(
+                    f"SELECT {BOOKING_RECORD_COLUMNS} FROM bookings WHERE (created_at, booking_id) > (?, ?) "
+                    "ORDER BY created_at, booking_id LIMIT ?",
+                    key + (page_size,)
+                ).fetchall()
+            for row in rows:
+                yield booking_record(row)
+            if len(rows) < page_size:
+                return
+            key = (rows[-1]['created_at'], rows[-1]['booking_id'])
+
+    def get_booking(self, booking_id):
+        return self.fetch_one("SELECT * FROM bookings WHERE booking_id = ?", (booking_id,))
+
+    @staticmethod
+    def list_bookings_query(user_id, limit, cursor):
+        """(query, params) for one page of list_bookings
+
+        Keyset pagination: seek past the last (created_at, booking_id) seen
+        and fetch one extra row to know whether another page exists.
+        """
+        if cursor:
+            key = decode_cursor(cursor, CURSOR_FIELDS)
+            return (f"SELECT {BOOKING_RECORD_COLUMNS} FROM bookings "
+                    "WHERE user_id = ? AND (created_at, booking_id) < (?, ?) "
+                    "ORDER BY created_at DESC, booking_id DESC LIMIT ?",
+                    (user_id, key['created_at'], key['booking_id'], limit + 1))
+        return (f"SELECT {BOOKING_RECORD_COLUMNS} FROM bookings "
+                "WHERE user_id = ? ORDER BY created_at DESC, booking_id DESC LIMIT ?",
+                (user_id, limit + 1))
+
+    def list_bookings(self, user_id, limit=20, cursor=None):
+        query, params = self.list_bookings_query(user_id, limit, cursor)
+        with self.get_db_connection() as conn:
+            rows = [booking_record(booking) for booking in conn.execute(query, params).fetchall()]
+        return bookings_page(rows, limit)
+
+    def cancel_booking(self, booking_id, cancelled_at, user_id=None):
+        return bool(self.cancel_rows([booking_id], cancelled_at, user_id))
+
+    def confirmed_bookings_between(self, car_type, start_day, end_day):
+        return self.fetch_all(
+            "SELECT booking_id, user_id, car_type, pickup, dropoff, total_price FROM bookings "
+            "WHERE lower(car_type) = ? AND status = 'confirmed' AND dropoff > ? AND pickup <= ?",
+            (car_type, start_day, end_day)
+        )
+
+    def cancel_bookings(self, bookings, cancelled_at):
+        return [row['booking_id'] for row in self.cancel_rows([b['booking_id'] for b in bookings], cancelled_at)]
+
+    def cancel_rows(self, booking_ids, cancelled_at, user_id=None):
+        """Cancel whichever of booking_ids are still confirmed in one
+        statement, give back their days and count them in the rollups"""
+        query, params = self.cancel_query(booking_ids, cancelled_at, user_id)
+        with self.transaction() as conn:
+            rows = conn.execute(query, params).fetchall()
+            if rows:
+                inventory, rollups = self.release_params(rows, cancelled_at)
+                conn.executemany(self.RELEASE_DAYS, inventory)
+                conn.executemany(self.ROLLUP_UPSERT, rollups)
+        return rows
+
+    @staticmethod
+    def cancel_query(booking_ids, cancelled_at, user_id=None):
+        """(query, params) of the conditional UPDATE that cancels booking_ids
+        still confirmed (and owned by user_id, if given), returning what
+        giving their days back needs"""
+        # The unary + keeps the planner on the primary key: without it, for
+        # more than a few IDs it prefers scanning every confirmed booking
+        # through idx_bookings_status_dropoff
+        placeholders = ', '.join('?' * len(booking_ids))
+        query = (f"UPDATE bookings SET status = 'cancelled', cancelled_at = ? "
+                 f"WHERE booking_id IN ({placeholders}) AND +status = 'confirmed'")
+        params = [cancelled_at, *booking_ids]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        return query + " RETURNING booking_id, car_type, pickup, dropoff, total_price", params
+
+    @staticmethod
+    def release_params(bookings, cancelled_at):
+        """executemany parameters of RELEASE_DAYS and ROLLUP_UPSERT for
+        bookings that were just cancelled"""
+        return (
+            [(count, car_type, day) for (car_type, day), count in released_days(bookings).items()],
+            [key + tuple(entry) for key, entry in tally_cancellations(bookings, cancelled_at).items()]
+        )
+
+    def rollups(self, start_day, end_day):
+        rows = self.fetch_all(
+            "SELECT day, car_type, status, bookings, revenue_paise FROM booking_rollups "
+            "WHERE day BETWEEN ? AND ? ORDER BY day, car_type, status",
+            (start_day, end_day)
+        )
+        return rollup_rows({(row['day'], row['car_type'], row['status']): (row['bookings'], row['revenue_paise'])
+                            for row in rows})
+
+    def rebuild_rollups(self, since=None):
+        since = (since or '')[:10]
+        with self.transaction() as conn:
+            delete, insert = ROLLUP_BACKFILL
+            conn.execute(delete, (since,))
+            return conn.execute(insert, (since, since)).rowcount
+
+    def fetch_all(self, query, params=()):
+        with self.get_db_connection() as conn:
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+    def get_fleet(self):
+        return self.fetch_all("SELECT vehicle_id, car_type, location FROM fleet")
+
+    def active_bookings(self, today):
+        return self.fetch_all(
+            "SELECT * FROM bookings WHERE status = 'confirmed' AND dropoff > ?", (today,)
+        )
+
+    def changed_bookings(self, since):
+        # UNION ALL lets each half use its own index instead of an OR scan;
+        # a booking may appear twice, which the availability engine tolerates
+        return self.fetch_all(
+            "SELECT * FROM bookings WHERE created_at >= ? "
+            "UNION ALL SELECT * FROM bookings WHERE cancelled_at >= ?",
+            (since, since)
+        )
+
+    def claim_events(self, limit, now, lease_until):
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT event_id, event_type, payload, attempts FROM outbox "
+                "WHERE status = 'pending' AND available_at <= ? ORDER BY available_at LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            conn.executemany("UPDATE outbox SET available_at = ? WHERE event_id = ?",
+                             [(lease_until, row['event_id']) for row in rows])
+        return [dict(row, payload=json.loads(row['payload'])) for row in rows]
+
+    def complete_event(self, event_id):
+        self.execute("DELETE FROM outbox WHERE event_id = ?", (event_id,))
+
+    def retry_event(self, event_id, attempts, available_at, error, dead=False):
+        self.execute(
+            "UPDATE outbox SET attempts = ?, available_at = ?, last_error = ?, status = ? WHERE event_id = ?",
+            (attempts, available_at, error, 'dead' if dead else 'pending', event_id)
+        )
+
+    def latest_rate_version(self):
+        with self.get_db_connection() as conn:
+            return conn.execute("SELECT MAX(version) FROM rate_tables").fetchone()[0]
+
+    def get_rate_table(self, version):
+        row = self.fetch_one("SELECT rates FROM rate_tables WHERE version = ?", (version,))
+        return json.loads(row['rates']) if row else None
+
+    def save_rate_table(self, rates, created_at):
+        with self.transaction() as conn:
+            version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM rate_tables").fetchone()[0]
+            conn.execute("INSERT INTO rate_tables (version, rates, created_at) VALUES (?, ?, ?)",
+                         (version, json.dumps(rates), created_at))
+        return version
+
+
+def create_storage(config):
+    """Build the storage backend selected by config['STORAGE_BACKEND']"""
+    backend = config.get('STORAGE_BACKEND', 'sqlite')
+
+    if backend == 'sqlite':
+        return SQLiteStorage(
+            config.get('DATABASE_PATH', 'car_rental.db'),
+            pool_size=config.get('SQLITE_POOL_SIZE', 8)
+        )
+
+    if backend == 'memory':
+        return MemoryStorage()
+
+    if backend == 'dynamodb':
+        from dynamo import create_dynamodb_storage
+
+        return create_dynamodb_storage(config)
+
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def init_storage(app):
+    """Create the configured backend (behind the read-through cache, unless
+    CACHE_BACKEND is 'none') and attach it to the Flask app"""
+    storage = create_storage(app.config)
+    storage.init_app(app)
+    cache = create_cache(app.config)
+    if cache is not None:
+        storage = CachedStorage(storage, cache)
+        app.extensions['cache'] = cache
+    app.extensions['storage'] = storage
+    return storage
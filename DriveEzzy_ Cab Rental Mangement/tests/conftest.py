@@ -0,0 +1,112 @@
+"""Shared fixtures: storage backends and a Flask app on a temporary SQLite file
+
+The DynamoDB backends run against moto's in-process DynamoDB and are skipped
+when moto isn't installed. Set DYNAMODB_ENDPOINT_URL to run them against
+DynamoDB Local instead.
+"""
+import os
+import sys
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import MemoryStorage, SQLiteStorage  # noqa: E402
+
+BACKENDS = ['memory', 'sqlite', 'dynamodb', 'dynamodb-single']
+
+
+def make_booking(user_id='user-1', pickup=date(2031, 1, 1), days=2, car_type='suv', **fields):
+    booking = {
+        'booking_id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'car_type': car_type,
+        'num_days': days,
+        'pickup': pickup.isoformat(),
+        'dropoff': (pickup + timedelta(days=days)).isoformat(),
+        'special_requests': '',
+        'payment_mode': 'upi',
+        'total_price': Decimal('5000'),
+        'status': 'confirmed',
+        'created_at': datetime.now().isoformat()
+    }
+    booking.update(fields)
+    return booking
+
+
+@pytest.fixture
+def aws():
+    """moto's DynamoDB (or DynamoDB Local via DYNAMODB_ENDPOINT_URL) for the test"""
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+    if os.environ.get('DYNAMODB_ENDPOINT_URL'):
+        yield
+        return
+    moto = pytest.importorskip('moto')
+    with moto.mock_aws():
+        yield
+
+
+def dynamodb_storage(layout, **config):
+    from dynamo import create_dynamodb_storage
+
+    storage = create_dynamodb_storage({
+        'DYNAMODB_LAYOUT': layout,
+        'DYNAMODB_ENDPOINT_URL': os.environ.get('DYNAMODB_ENDPOINT_URL'),
+        # Fresh tables per test, also on a shared DynamoDB Local
+        'DYNAMODB_TABLE_PREFIX': f"test-{uuid.uuid4().hex[:8]}-",
+        **config
+    })
+    storage.init_db()
+    return storage
+
+
+@pytest.fixture(params=BACKENDS)
+def storage(request, tmp_path):
+    """Every storage backend in turn, with the schema created"""
+    if request.param == 'memory':
+        return MemoryStorage()
+    if request.param == 'sqlite':
+        storage = SQLiteStorage(str(tmp_path / 'test.db'))
+        storage.init_db()
+        return storage
+    request.getfixturevalue('aws')
+    return dynamodb_storage('single' if request.param == 'dynamodb-single' else 'tables')
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'test.db'))
+    storage.init_db()
+    return storage
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The Flask app on a migrated SQLite file; no background threads"""
+    from factory import create_app, init_db
+
+    app = create_app({
+        'TESTING': True,
+        'DATABASE_PATH': str(tmp_path / 'app.db'),
+        'SCHEMA_MARKER': str(tmp_path / 'schema-ready.json'),
+        'OUTBOX_ENABLED': False,
+        'PASSWORD_HASH_COST': 12,
+    })
+    init_db(app)
+    yield app
+    app.extensions['credentials'].shutdown()
+
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as a freshly registered user"""
+    client = app.test_client()
+    client.post('/register', data={'name': 'Test', 'email': 'test@example.com',
+                                   'password': 'secret', 'mobile_number': '1'})
+    client.post('/login', data={'email': 'test@example.com', 'password': 'secret'})
+    return client
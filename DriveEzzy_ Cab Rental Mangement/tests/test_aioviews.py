@@ -0,0 +1,82 @@
+"""The Quart app's booking flow (aioviews.py) on SQLite"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('quart')
+pytest.importorskip('aiosqlite')
+
+
+@pytest.fixture
+def async_app(tmp_path):
+    from factory import create_async_app, init_db
+
+    app = create_async_app({
+        'TESTING': True,
+        'DATABASE_PATH': str(tmp_path / 'app.db'),
+        'SCHEMA_MARKER': str(tmp_path / 'schema-ready.json'),
+        'OUTBOX_ENABLED': False,
+        'PASSWORD_HASH_COST': 12,
+    })
+    init_db(app)
+    return app
+
+
+def run(app, flow):
+    """Run flow(client) against the app, with startup and shutdown"""
+    async def main():
+        async with app.test_app() as test_app:
+            return await flow(test_app.test_client())
+    return asyncio.run(main())
+
+
+async def log_in(client):
+    await client.post('/register', form={'name': 'Test', 'email': 'test@example.com',
+                                         'password': 'secret', 'mobile_number': '1'})
+    await client.post('/login', form={'email': 'test@example.com', 'password': 'secret'})
+
+
+def test_booking_and_cancelling_change_the_bookings_version(async_app):
+    storage = async_app.extensions['storage']
+    versions = async_app.extensions['pages'].versions
+
+    async def flow(client):
+        await log_in(client)
+        user_id = storage.get_user_by_email('test@example.com')['id']
+        seen = [versions.get(user_id)]
+
+        response = await client.post('/book/suv', form={'check_in': '2031-01-01', 'check_out': '2031-01-03',
+                                                        'special_requests': '', 'payment_mode': 'upi'})
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith('/thank_you')
+        [booking], _ = storage.list_bookings(user_id)
+        assert (booking.num_days, booking.status) == (2, 'confirmed')
+        seen.append(versions.get(user_id))
+
+        response = await client.post(f'/cancel_booking/{booking.booking_id}')
+        assert response.headers['Location'].endswith('/my_bookings')
+        assert storage.get_booking(booking.booking_id)['status'] == 'cancelled'
+        seen.append(versions.get(user_id))
+
+        page = await client.get('/my_bookings')
+        assert b'Booking cancelled successfully.' in await page.get_data()
+        return seen
+
+    seen = run(async_app, flow)
+    assert len(set(seen)) == 3
+
+
+def test_a_taken_email_is_refused_before_hashing(async_app, monkeypatch):
+    credentials = async_app.extensions['credentials']
+    hashed = []
+    hash_password = credentials.hash
+    monkeypatch.setattr(credentials, 'hash', lambda password: hashed.append(password) or hash_password(password))
+
+    async def flow(client):
+        form = {'name': 'Test', 'email': 'test@example.com', 'password': 'secret', 'mobile_number': '1'}
+        await client.post('/register', form=form)
+        response = await client.post('/register', form=dict(form, password='other'))
+        assert response.headers['Location'].endswith('/login')
+
+    run(async_app, flow)
+    assert hashed == ['secret']
@@ -0,0 +1,60 @@
+"""The in-memory availability engine and /api/availability"""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from availability import AvailabilityEngine
+from storage import MAX_BOOKING_DAYS, MemoryStorage
+
+from .conftest import make_booking
+
+
+@pytest.fixture
+def engine():
+    return AvailabilityEngine(MemoryStorage(), refresh_interval=3600)
+
+
+def test_reserve_and_release(engine):
+    check_in, check_out = date(2031, 1, 1), date(2031, 1, 3)
+    capacity = engine.available('suv', check_in, check_out)
+    bookings = [make_booking(f"user-{i}", check_in) for i in range(capacity)]
+    assert all(engine.reserve(booking) for booking in bookings)
+    assert not engine.reserve(make_booking(pickup=check_in))
+    assert engine.summary(check_in, check_out)['suv'] == 0
+    assert engine.available('suv', check_out, check_out + timedelta(days=1)) == capacity
+
+    engine.release(bookings[0]['booking_id'])
+    assert engine.available('suv', check_in, check_out) == 1
+
+
+def test_refresh_picks_up_bookings_made_elsewhere(engine):
+    engine.load()
+    capacity = engine.available('suv', date(2031, 1, 1), date(2031, 1, 2))
+    booking = make_booking(pickup=date(2031, 1, 1))
+    engine.storage.create_booking(booking)
+    engine.refresh(force=True)
+    assert engine.available('suv', date(2031, 1, 1), date(2031, 1, 2)) == capacity - 1
+
+    engine.storage.cancel_booking(booking['booking_id'], datetime.now().isoformat())
+    engine.refresh(force=True)
+    assert engine.available('suv', date(2031, 1, 1), date(2031, 1, 2)) == capacity
+
+
+def test_api_availability(client):
+    response = client.get('/api/availability?check_in=2031-01-01&check_out=2031-01-04')
+    assert response.status_code == 200
+    assert response.get_json()['suv'] == 6
+
+
+@pytest.mark.parametrize('query', [
+    'check_in=0001-01-01&check_out=9999-12-31',
+    f"check_in=2031-01-01&check_out={date(2031, 1, 1) + timedelta(days=MAX_BOOKING_DAYS + 1)}",
+    'check_in=2031-01-04&check_out=2031-01-01',
+    'check_in=2031-01-04&check_out=2031-01-04',
+    'check_in=2031-01-04',
+    'check_in=tomorrow&check_out=2031-01-04',
+])
+def test_api_availability_refuses_bad_ranges(client, query):
+    response = client.get(f"/api/availability?{query}")
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,135 @@
+"""LRUCache, RedisCache on FakeRedis, and CachedStorage's read-through and invalidation"""
+import pytest
+
+import cache
+from cache import CachedStorage, FakeRedis, LRUCache, RedisCache
+from storage import MemoryStorage
+
+
+class Clock:
+    """Stands in for the time module inside cache.py"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'fake-redis'])
+def lookup_cache(request, clock):
+    if request.param == 'memory':
+        return LRUCache(max_entries=100, ttl=60)
+    return RedisCache(FakeRedis(), ttl=60)
+
+
+class CountingStorage(MemoryStorage):
+    """MemoryStorage that counts user lookups reaching it"""
+
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+
+    def get_user(self, user_id):
+        self.lookups += 1
+        return super().get_user(user_id)
+
+    def get_user_by_email(self, email):
+        self.lookups += 1
+        return super().get_user_by_email(email)
+
+
+@pytest.fixture
+def cached(lookup_cache):
+    storage = CachedStorage(CountingStorage(), lookup_cache)
+    storage.create_user({'id': 'user-1', 'name': 'Asha', 'email': 'asha@example.com', 'password': 'hash-1',
+                         'mobile_number': '99999', 'created_at': '2030-06-01T00:00:00'})
+    return storage
+
+
+def test_hits_and_misses_are_counted(lookup_cache):
+    assert lookup_cache.get('k') is None
+    lookup_cache.set('k', {'v': 1})
+    assert lookup_cache.get('k') == {'v': 1}
+    assert lookup_cache.get('k') == {'v': 1}
+
+    stats = lookup_cache.stats.as_dict()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert stats['hit_rate'] == pytest.approx(2 / 3)
+
+
+def test_entries_expire_after_the_ttl(lookup_cache, clock):
+    lookup_cache.set('k', {'v': 1})
+    clock.now += 59
+    assert lookup_cache.get('k') == {'v': 1}
+    clock.now += 1
+    assert lookup_cache.get('k') is None
+
+
+def test_returned_values_are_copies(lookup_cache):
+    user = {'id': 'user-1', 'password': 'hash-1'}
+    lookup_cache.set('k', user)
+    user['password'] = 'changed before the read'
+    lookup_cache.get('k')['password'] = 'changed after the read'
+
+    assert lookup_cache.get('k') == {'id': 'user-1', 'password': 'hash-1'}
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    lru = LRUCache(max_entries=2, ttl=60)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+
+    assert lru.get('b') is None
+    assert (lru.get('a'), lru.get('c')) == (1, 3)
+    assert lru.stats.evictions == 1
+
+
+def test_lookups_are_read_through(cached):
+    for _ in range(3):
+        assert cached.get_user('user-1')['email'] == 'asha@example.com'
+        assert cached.get_user_by_email('asha@example.com')['id'] == 'user-1'
+    assert cached.storage.lookups == 2
+
+
+def test_unknown_users_are_not_cached(cached):
+    assert cached.get_user('nobody') is None
+    cached.create_user({'id': 'nobody', 'name': 'N', 'email': 'n@example.com', 'password': 'hash',
+                        'mobile_number': '1', 'created_at': '2030-06-01T00:00:00'})
+    assert cached.get_user('nobody')['email'] == 'n@example.com'
+
+
+def test_create_user_invalidates_its_keys(cached):
+    # Whatever was cached under the new user's keys must not survive the insert
+    cached.cache.set('user:email:new@example.com', {'id': 'stale'})
+    cached.create_user({'id': 'user-2', 'name': 'B', 'email': 'new@example.com', 'password': 'hash',
+                        'mobile_number': '2', 'created_at': '2030-06-01T00:00:00'})
+    assert cached.get_user_by_email('new@example.com')['id'] == 'user-2'
+
+
+def test_update_password_invalidates_both_keys(cached):
+    cached.get_user('user-1')
+    cached.get_user_by_email('asha@example.com')
+
+    cached.update_password('user-1', 'hash-2')
+
+    assert cached.get_user('user-1')['password'] == 'hash-2'
+    assert cached.get_user_by_email('asha@example.com')['password'] == 'hash-2'
+
+
+def test_rate_tables_are_cached_by_version(cached):
+    rates = cached.get_rate_table(1)
+    hits = cached.cache.stats.hits
+
+    cached.get_rate_table(1)['car_types'] = {}
+    assert cached.get_rate_table(1) == rates
+    assert cached.cache.stats.hits == hits + 2
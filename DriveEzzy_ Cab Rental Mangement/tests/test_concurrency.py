@@ -0,0 +1,78 @@
+"""Many threads racing for the same cars never double-book them
+
+moto isn't thread-safe, so this runs on the in-process backends only; run
+`python benchmark.py stress dynamodb` against DynamoDB Local for DynamoDB.
+"""
+import threading
+from collections import Counter
+from datetime import date, timedelta
+
+import pytest
+
+from availability import booked_days
+from storage import BookingUnavailable, DuplicateBooking, MemoryStorage, SQLiteStorage
+
+from .conftest import make_booking
+
+THREADS = 16
+ATTEMPTS = 50
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def shared_storage(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStorage()
+    storage = SQLiteStorage(str(tmp_path / 'stress.db'))
+    storage.init_db()
+    return storage
+
+
+def test_racing_bookings_never_exceed_the_fleet(shared_storage):
+    capacity = sum(1 for vehicle in shared_storage.get_fleet() if vehicle['car_type'] == 'suv')
+    outcomes = Counter()
+    lock = threading.Lock()
+    errors = []
+
+    def worker(n):
+        previous = None
+        try:
+            for i in range(ATTEMPTS):
+                # Overlapping ranges in a 10-day window; every 4th attempt is
+                # a browser retry that reuses the previous booking_id
+                pickup = date(2031, 1, 1) + timedelta(days=i % 10)
+                booking = make_booking(f"user-{n}", pickup, days=1 + i % 3)
+                if i % 4 == 3 and previous is not None:
+                    booking['booking_id'] = previous
+                previous = booking['booking_id']
+                try:
+                    shared_storage.create_booking(booking)
+                    result = 'confirmed'
+                except BookingUnavailable:
+                    result = 'unavailable'
+                except DuplicateBooking:
+                    result = 'duplicate'
+                with lock:
+                    outcomes[result] += 1
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert errors == []
+    assert sum(outcomes.values()) == THREADS * ATTEMPTS
+    assert outcomes['unavailable'] > 0  # the fleet really was fought over
+
+    # Recount from the stored bookings, independent of the inventory counters
+    per_day = Counter()
+    confirmed = 0
+    for n in range(THREADS):
+        bookings, _ = shared_storage.list_bookings(f"user-{n}", limit=ATTEMPTS)
+        confirmed += len(bookings)
+        for booking in bookings:
+            per_day.update(booked_days(booking.pickup, booking.dropoff))
+    assert confirmed == outcomes['confirmed']
+    assert max(per_day.values()) <= capacity
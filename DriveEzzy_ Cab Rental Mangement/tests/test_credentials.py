@@ -0,0 +1,56 @@
+"""Password hashing and its admission control"""
+import time
+
+import pytest
+
+from credentials import HasherBusy, PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(cost=4, workers=1, max_pending=2)
+    yield hasher
+    hasher.shutdown()
+
+
+def fill_queue(hasher):
+    """Take every pending slot; returns how many were taken"""
+    taken = 0
+    while hasher.pending.acquire(blocking=False):
+        taken += 1
+    return taken
+
+
+def test_hash_and_verify(hasher):
+    stored = hasher.hash('secret')
+    assert hasher.verify('secret', stored) == (True, False)
+    assert hasher.verify('wrong', stored) == (False, False)
+    # Legacy plaintext rows match and are flagged for rehashing
+    assert hasher.verify('secret', 'secret') == (True, True)
+
+
+def test_a_full_queue_fails_at_once(hasher):
+    taken = fill_queue(hasher)
+    start = time.monotonic()
+    with pytest.raises(HasherBusy):
+        hasher.hash('secret')
+    assert time.monotonic() - start < 0.1
+    assert hasher.pool is None  # nothing was submitted
+    for _ in range(taken):
+        hasher.pending.release()
+
+
+def test_login_answers_503_while_the_hasher_is_busy(app, client):
+    hasher = app.extensions['credentials']
+    client.get('/logout')
+    taken = fill_queue(hasher)
+    try:
+        start = time.monotonic()
+        # A password that isn't in the verified cache needs the pool
+        response = client.post('/login', data={'email': 'test@example.com', 'password': 'not-the-secret'})
+        assert time.monotonic() - start < 1.0
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        for _ in range(taken):
+            hasher.pending.release()
@@ -0,0 +1,90 @@
+"""DynamoDB specifics: the booking indexes that replace Scans, and paging"""
+from datetime import date
+
+import pytest
+
+from dynamo import TABLE_SCHEMAS, create_tables
+
+from .conftest import dynamodb_storage, make_booking
+
+
+@pytest.fixture(params=['tables', 'single'])
+def dynamodb(request, aws):
+    return dynamodb_storage(request.param)
+
+
+def scans_of(storage):
+    """Names of the tables Scanned through the storage's client"""
+    scanned = []
+    storage.client.meta.events.register(
+        'before-call.dynamodb.Scan', lambda params, **kwargs: scanned.append(params['TableName'])
+    )
+    return scanned
+
+
+def test_availability_and_bulk_cancel_never_scan_the_bookings(dynamodb):
+    dynamodb.create_booking(make_booking(created_at='2030-06-01T10:00:00'))
+    dynamodb.get_fleet()
+    dynamodb.capacity('suv')  # the Fleet table is scanned once, before the reads below
+    scanned = scans_of(dynamodb)
+
+    assert len(dynamodb.active_bookings('2030-06-01')) == 1
+    assert len(dynamodb.changed_bookings('2030-06-01T00:00:00')) == 1
+    assert len(dynamodb.confirmed_bookings_between('suv', '2031-01-01', '2031-01-31')) == 1
+    assert scanned == []
+
+
+def test_confirmed_bookings_between_overlaps_the_range(dynamodb):
+    inside = make_booking(pickup=date(2031, 1, 5))
+    before = make_booking(pickup=date(2030, 12, 1))
+    after = make_booking(pickup=date(2031, 2, 1))
+    cancelled = make_booking(pickup=date(2031, 1, 5))
+    for booking in (inside, before, after, cancelled):
+        dynamodb.create_booking(booking)
+    dynamodb.cancel_booking(cancelled['booking_id'], '2030-06-02T00:00:00')
+
+    found = dynamodb.confirmed_bookings_between('suv', '2031-01-01', '2031-01-31')
+    assert [b['booking_id'] for b in found] == [inside['booking_id']]
+
+
+def test_an_exactly_full_last_page_has_no_cursor(dynamodb):
+    # DynamoDB sends a LastEvaluatedKey whenever a Query stops at its Limit,
+    # even with nothing after it; moto only does when more items follow
+    limits = []
+    events = dynamodb.raw_client.meta.events
+    events.register('provide-client-params.dynamodb.Query', lambda params, **kwargs: limits.append(params.get('Limit')))
+
+    def like_dynamodb(parsed, **kwargs):
+        if parsed.get('Count') == limits[-1] and 'LastEvaluatedKey' not in parsed:
+            parsed['LastEvaluatedKey'] = {'booking_id': {'S': 'end-of-limit'}}
+    events.register('after-call.dynamodb.Query', like_dynamodb)
+
+    for i in range(4):
+        dynamodb.create_booking(make_booking(pickup=date(2031, 1, 1 + i * 3), created_at=f"2030-06-01T10:00:0{i}"))
+
+    first, cursor = dynamodb.list_bookings('user-1', limit=2)
+    second, cursor = dynamodb.list_bookings('user-1', limit=2, cursor=cursor)
+    assert [len(first), len(second), cursor] == [2, 2, None]
+    assert limits == [3, 3]
+
+
+def test_init_db_adds_the_indexes_to_existing_tables(aws):
+    # Tables as they were before ChangesIndex and ActiveIndex, with a booking
+    storage = dynamodb_storage('tables')
+    old_schemas = dict(TABLE_SCHEMAS)
+    old_schemas['bookings'] = dict(
+        TABLE_SCHEMAS['bookings'],
+        AttributeDefinitions=TABLE_SCHEMAS['bookings']['AttributeDefinitions'][:3],
+        GlobalSecondaryIndexes=TABLE_SCHEMAS['bookings']['GlobalSecondaryIndexes'][:1]
+    )
+    storage.names = {name: f"old-{table}" for name, table in storage.names.items()}
+    storage.__dict__.pop('tables', None)
+    create_tables(storage.dynamodb, storage.names, old_schemas)
+    booking = make_booking()
+    storage.tables['bookings'].put_item(Item=dict(booking))
+    assert not storage.check_schema()
+
+    storage.init_db()
+    assert storage.check_schema()
+    assert [b['booking_id'] for b in storage.active_bookings('2030-06-01')] == [booking['booking_id']]
+    assert [b['booking_id'] for b in storage.changed_bookings(booking['created_at'])] == [booking['booking_id']]
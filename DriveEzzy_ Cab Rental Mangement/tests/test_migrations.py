@@ -0,0 +1,51 @@
+"""SQLite schema migrations and the query plans of the hot queries"""
+import sqlite3
+
+import pytest
+
+from migrations import HOT_QUERIES, MIGRATIONS, migrate, schema_version, unindexed_queries
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'test.db'))
+    yield conn
+    conn.close()
+
+
+def test_migrate_creates_the_latest_schema(conn):
+    migrate(conn)
+    assert schema_version(conn) == len(MIGRATIONS)
+
+
+def test_migrate_is_idempotent(conn, capsys):
+    migrate(conn)
+    capsys.readouterr()
+    migrate(conn)
+    assert capsys.readouterr().out == ''
+    assert schema_version(conn) == len(MIGRATIONS)
+
+
+def test_migrate_upgrades_an_existing_database_in_place(conn):
+    # A database created by the original init_db: version 1, with data
+    for statement in MIGRATIONS[0]:
+        conn.execute(statement)
+    conn.execute("PRAGMA user_version = 1")
+    conn.execute("INSERT INTO users (id, name, email, password) VALUES ('u1', 'A', 'a@example.com', 'x')")
+    conn.commit()
+
+    migrate(conn)
+    assert schema_version(conn) == len(MIGRATIONS)
+    assert conn.execute("SELECT email FROM users WHERE id = 'u1'").fetchone() == ('a@example.com',)
+
+
+def test_every_hot_query_uses_an_index(conn):
+    migrate(conn)
+    assert unindexed_queries(conn) == []
+
+
+@pytest.mark.parametrize('query, params', HOT_QUERIES, ids=lambda value: str(value)[:60])
+def test_hot_query_plan_has_no_scan_or_sort(conn, query, params):
+    migrate(conn)
+    plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+    assert not any(step.startswith('SCAN') or 'TEMP B-TREE' in step for step in plan), plan
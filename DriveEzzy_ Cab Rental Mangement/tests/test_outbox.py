@@ -0,0 +1,156 @@
+"""The transactional outbox and OutboxWorker, delivering to FakeNotifier"""
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from notifications import FakeNotifier, OutboxWorker, booking_confirmed_event
+from storage import BookingUnavailable, DuplicateBooking, MemoryStorage, SQLiteStorage
+
+from .conftest import make_booking
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStorage()
+    storage = SQLiteStorage(str(tmp_path / 'outbox.db'))
+    storage.init_db()
+    return storage
+
+
+def outbox(storage):
+    """{event_id: (status, attempts, available_at)} for every outbox row"""
+    if isinstance(storage, MemoryStorage):
+        return {e['event_id']: (e['status'], e['attempts'], e['available_at']) for e in storage.outbox.values()}
+    with storage.get_db_connection() as conn:
+        rows = conn.execute("SELECT event_id, status, attempts, available_at FROM outbox").fetchall()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def book(storage, booking=None):
+    booking = booking or make_booking()
+    storage.create_booking(booking, booking_confirmed_event(booking, 'Asha'))
+    return booking
+
+
+def later(seconds):
+    return (datetime.now() + timedelta(seconds=seconds)).isoformat()
+
+
+def test_the_event_is_written_with_the_booking(storage):
+    booking = book(storage)
+    assert outbox(storage) == {
+        f"booking_confirmed:{booking['booking_id']}": ('pending', 0, booking['created_at'])
+    }
+
+
+def test_refused_bookings_write_no_event(storage):
+    capacity = sum(1 for vehicle in storage.get_fleet() if vehicle['car_type'] == 'suv')
+    bookings = [book(storage, make_booking(f"user-{i}")) for i in range(capacity)]
+    before = outbox(storage)
+
+    with pytest.raises(BookingUnavailable):
+        book(storage)
+    with pytest.raises(DuplicateBooking):
+        book(storage, bookings[0])
+    assert outbox(storage) == before
+
+
+def test_a_failed_event_insert_rolls_back_the_booking(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'outbox.db'))
+    storage.init_db()
+    first = book(storage)
+    booking = make_booking(pickup=date(2032, 1, 1))
+    event = dict(booking_confirmed_event(booking, 'Asha'), event_id=f"booking_confirmed:{first['booking_id']}")
+
+    with pytest.raises(sqlite3.IntegrityError):
+        storage.create_booking(booking, event)
+    assert storage.get_booking(booking['booking_id']) is None
+    assert len(outbox(storage)) == 1
+    # The claimed inventory went back with the booking
+    assert storage.confirmed_bookings_between('suv', '2032-01-01', '2032-01-02') == []
+
+
+def test_a_claimed_event_is_leased(storage):
+    booking = book(storage)
+    now, lease_until = later(0), later(60)
+
+    claimed = storage.claim_events(10, now, lease_until)
+    assert [e['event_id'] for e in claimed] == [f"booking_confirmed:{booking['booking_id']}"]
+    assert claimed[0]['payload']['booking_id'] == booking['booking_id']
+    assert storage.claim_events(10, now, lease_until) == []
+    # An unfinished lease expires and the event goes to the next claimant
+    assert len(storage.claim_events(10, later(61), later(120))) == 1
+
+
+def test_concurrent_claims_hand_out_each_event_once(storage):
+    for i in range(40):
+        book(storage, make_booking(f"user-{i}", pickup=date(2031, 1, 1) + timedelta(days=2 * i)))
+    now, lease_until = later(0), later(60)
+    claimed = []
+    barrier = threading.Barrier(8)
+
+    def claim():
+        barrier.wait()
+        while True:
+            events = storage.claim_events(3, now, lease_until)
+            if not events:
+                return
+            claimed.extend(e['event_id'] for e in events)
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(claimed) == 40
+    assert len(set(claimed)) == 40
+
+
+def test_failed_sends_back_off(storage):
+    booking = book(storage)
+    notifier = FakeNotifier(failure_rate=1.0)
+    worker = OutboxWorker(storage, notifier, max_attempts=3, backoff_base=2.0)
+
+    earliest = later(1)
+    assert worker.process_batch() == 1
+    latest = later(2)
+    status, attempts, available_at = outbox(storage)[f"booking_confirmed:{booking['booking_id']}"]
+    # First retry waits backoff_base seconds, jittered down to half of it
+    assert (status, attempts) == ('pending', 1)
+    assert earliest <= available_at <= latest
+    assert worker.stats() == {'delivered': 0, 'retried': 1, 'dead': 0}
+    assert worker.process_batch() == 0
+
+
+def test_an_event_is_parked_after_max_attempts(storage):
+    booking = book(storage)
+    notifier = FakeNotifier(failure_rate=1.0)
+    worker = OutboxWorker(storage, notifier, max_attempts=3, backoff_base=0.0)
+
+    while worker.process_batch():
+        pass
+
+    status, attempts, _ = outbox(storage)[f"booking_confirmed:{booking['booking_id']}"]
+    assert (status, attempts) == ('dead', 3)
+    assert notifier.failures == 3
+    assert worker.stats() == {'delivered': 0, 'retried': 2, 'dead': 1}
+    assert storage.claim_events(10, later(3600), later(3660)) == []
+
+
+def test_a_retried_booking_is_delivered_once(storage):
+    booking = book(storage)
+    with pytest.raises(DuplicateBooking):
+        book(storage, dict(booking))
+    notifier = FakeNotifier()
+    worker = OutboxWorker(storage, notifier)
+
+    worker.drain()
+    worker.drain()
+
+    assert [e['event_id'] for e in notifier.sent] == [f"booking_confirmed:{booking['booking_id']}"]
+    assert worker.stats() == {'delivered': 1, 'retried': 0, 'dead': 0}
+    assert outbox(storage) == {}
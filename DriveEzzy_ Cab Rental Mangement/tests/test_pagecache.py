@@ -0,0 +1,109 @@
+"""ETags and 304s on the cached pages, and the per-user booking version"""
+import pytest
+
+
+def clear_flashes(client):
+    with client.session_transaction() as session:
+        session.pop('_flashes', None)
+
+
+def get_tagged(client, path):
+    """GET a page with no flashes waiting; returns it with its ETag"""
+    clear_flashes(client)
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.headers.get('ETag')
+    return response
+
+
+def revalidate(client, path, response):
+    return client.get(path, headers={'If-None-Match': response.headers['ETag']})
+
+
+@pytest.fixture
+def list_calls(app, monkeypatch):
+    """Calls reaching storage.list_bookings"""
+    storage = app.extensions['storage']
+    calls = []
+    list_bookings = storage.list_bookings
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return list_bookings(*args, **kwargs)
+
+    monkeypatch.setattr(storage, 'list_bookings', counting)
+    return calls
+
+
+def book(client, check_in='2031-01-01', check_out='2031-01-03'):
+    response = client.post('/book/suv', data={'check_in': check_in, 'check_out': check_out,
+                                              'special_requests': '', 'payment_mode': 'upi'})
+    assert response.headers['Location'].endswith('/thank_you')
+
+
+def booking_ids(app):
+    storage = app.extensions['storage']
+    with app.app_context():
+        user = storage.get_user_by_email('test@example.com')
+        return [b.booking_id for b in storage.list_bookings(user['id'])[0]]
+
+
+def test_unchanged_my_bookings_is_a_304_without_a_query(client, list_calls):
+    page = get_tagged(client, '/my_bookings')
+    assert page.headers['Cache-Control'] in ('private, no-cache', 'no-cache, private')
+    del list_calls[:]
+
+    response = revalidate(client, '/my_bookings', page)
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == page.headers['ETag']
+    assert list_calls == []
+
+
+def test_a_booking_changes_the_my_bookings_etag(app, client):
+    page = get_tagged(client, '/my_bookings')
+
+    book(client)
+
+    response = revalidate(client, '/my_bookings', page)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != page.headers['ETag']
+    assert booking_ids(app)[0].encode() in response.data
+
+
+def test_a_cancellation_changes_the_my_bookings_etag(app, client):
+    book(client)
+    [booking_id] = booking_ids(app)
+    page = get_tagged(client, '/my_bookings')
+
+    client.post(f'/cancel_booking/{booking_id}')
+    clear_flashes(client)
+
+    response = revalidate(client, '/my_bookings', page)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != page.headers['ETag']
+
+
+@pytest.mark.parametrize('path', ['/', '/car_type', '/thank_you'])
+def test_shared_pages_are_revalidated(client, path):
+    page = get_tagged(client, path)
+
+    response = revalidate(client, path, page)
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+@pytest.mark.parametrize('path', ['/car_type', '/my_bookings'])
+def test_pages_with_flashed_messages_are_not_cached(client, path):
+    page = get_tagged(client, path)
+    with client.session_transaction() as session:
+        session['_flashes'] = [('info', 'Flashed for this test')]
+
+    response = revalidate(client, path, page)
+
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert b'Flashed for this test' in response.data
+    # Shown once, so the next view is cacheable again
+    assert client.get(path).headers['ETag'] == page.headers['ETag']
@@ -0,0 +1,102 @@
+"""Rate tables compiled into running totals, and the quote API"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from availability import booked_days
+from pricing import CompiledRates, PricingEngine, UnknownCarType
+from storage import MAX_BOOKING_DAYS, MemoryStorage
+
+# Weekend surcharge, a season straddling the new year and a weekly discount
+RATES = {
+    'car_types': {'suv': {'daily': 4000, 'weekend': 4500}, 'sedan': {'daily': 2499.99}},
+    'seasons': [{'start': '2031-12-20', 'end': '2032-01-05', 'multiplier': 1.25}],
+    'duration_tiers': [{'min_days': 7, 'discount_percent': 10}, {'min_days': 30, 'discount_percent': 20}]
+}
+
+ORIGIN = date(2031, 6, 1).toordinal()
+
+
+def per_day(compiled, car_type, check_in, check_out):
+    return sum(compiled.day_price(car_type, day) for day in booked_days(check_in, check_out))
+
+
+@pytest.mark.parametrize('check_in, check_out', [
+    (date(2031, 6, 1), date(2031, 6, 2)),
+    (date(2031, 12, 18), date(2032, 1, 8)),  # into and out of the season
+    (date(2031, 7, 4), date(2031, 9, 30)),
+    (date(2033, 5, 1), date(2033, 5, 20)),  # past the compiled window
+    (date(2033, 5, 25), date(2033, 6, 10)),  # straddling its end
+])
+@pytest.mark.parametrize('car_type', ['suv', 'sedan'])
+def test_running_totals_match_the_per_day_price(car_type, check_in, check_out):
+    compiled = CompiledRates(1, RATES, ORIGIN, 730)
+    days = booked_days(check_in, check_out)
+    assert compiled.subtotal(car_type, days) == per_day(compiled, car_type, check_in, check_out)
+
+
+def test_day_price_applies_weekend_and_season():
+    compiled = CompiledRates(1, RATES, ORIGIN, 730)
+    assert compiled.day_price('suv', date(2031, 6, 2).toordinal()) == 400000  # a Monday
+    assert compiled.day_price('suv', date(2031, 6, 7).toordinal()) == 450000  # a Saturday
+    assert compiled.day_price('suv', date(2031, 12, 22).toordinal()) == 500000  # Monday in season
+
+
+@pytest.fixture
+def engine():
+    return PricingEngine(MemoryStorage(), refresh_interval=3600)
+
+
+def test_quote_applies_the_duration_discount(engine):
+    engine.storage.save_rate_table(RATES, '2030-06-01T00:00:00')
+    check_in = date.today() + timedelta(days=10)
+    quote = engine.quote('SUV', check_in, check_in + timedelta(days=7))
+    compiled = engine.refresh()
+
+    subtotal = Decimal(per_day(compiled, 'suv', check_in, check_in + timedelta(days=7))) / 100
+    assert (quote.car_type, quote.num_days, quote.subtotal) == ('suv', 7, subtotal)
+    assert quote.discount == subtotal / 10
+    assert quote.total == subtotal - quote.discount
+
+
+def test_a_new_rate_version_is_picked_up_and_priced_the_same_both_ways(engine):
+    check_in = date.today() + timedelta(days=3)
+    check_out = check_in + timedelta(days=40)
+    first = engine.quote('suv', check_in, check_out)
+    assert first.total == Decimal(4000 * 40)
+
+    version = engine.storage.save_rate_table(RATES, '2030-06-01T00:00:00')
+    assert engine.quote('suv', check_in, check_out).rate_version == first.rate_version  # not due yet
+    engine.refresh(force=True)
+    second = engine.quote('suv', check_in, check_out)
+
+    compiled = engine.refresh()
+    assert second.rate_version == version == compiled.version
+    assert second.subtotal * 100 == per_day(compiled, 'suv', check_in, check_out)
+    assert second.subtotal * 100 == compiled.subtotal('suv', booked_days(check_in, check_out))
+    assert second.subtotal != first.subtotal
+
+
+def test_unknown_car_type(engine):
+    with pytest.raises(UnknownCarType):
+        engine.quote('limousine', date(2031, 1, 1), date(2031, 1, 2))
+
+
+def test_api_quote(client):
+    response = client.get('/api/quote?car_type=suv&check_in=2031-01-01&check_out=2031-01-04')
+    assert response.status_code == 200
+    assert response.get_json()['num_days'] == 3
+
+
+@pytest.mark.parametrize('query, status', [
+    ('car_type=suv&check_in=0001-01-01&check_out=9999-12-31', 400),
+    (f"car_type=suv&check_in=2031-01-01&check_out={date(2031, 1, 1) + timedelta(days=MAX_BOOKING_DAYS + 1)}", 400),
+    ('car_type=suv&check_in=2031-01-04&check_out=2031-01-01', 400),
+    ('car_type=suv&check_in=2031-01-01', 400),
+    ('car_type=limousine&check_in=2031-01-01&check_out=2031-01-04', 404),
+])
+def test_api_quote_refuses_bad_stays(client, query, status):
+    response = client.get(f"/api/quote?{query}")
+    assert response.status_code == status
+    assert 'error' in response.get_json()
@@ -0,0 +1,124 @@
+"""Retries, client-side throttling and StorageBusy (resilience.py) on moto"""
+import pytest
+
+from resilience import TableThrottle, TokenBucket, is_throttled, request_units
+from storage import StorageBusy
+
+from .conftest import dynamodb_storage, make_booking
+
+
+class Draws:
+    """Stands in for FaultInjector.random: `throttled` draws that throttle,
+    then none that do"""
+
+    def __init__(self, throttled):
+        self.throttled = throttled
+
+    def random(self):
+        self.throttled -= 1
+        return 0.0 if self.throttled >= 0 else 1.0
+
+
+@pytest.fixture
+def faulty(aws):
+    """A DynamoDB storage whose requests go through a FaultInjector that
+    throttles nothing until throttle_next() says so"""
+    return dynamodb_storage('tables', DYNAMODB_FAULTS={'throttle_rate': 0.0}, DYNAMODB_MAX_ATTEMPTS=3)
+
+
+def throttle_next(storage, requests):
+    """Throttle the storage's next `requests` DynamoDB requests"""
+    faults = storage.resilience.faults
+    faults.throttle_rate = 0.5
+    faults.random = Draws(requests)
+    return faults
+
+
+def test_token_bucket_refuses_past_its_burst():
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.take()
+    assert bucket.take()
+    assert not bucket.take(timeout=0.0)  # a second away, nothing taken
+    assert bucket.take(timeout=2.0)
+
+
+def test_token_bucket_backs_off_when_throttled_and_recovers():
+    bucket = TokenBucket(rate=16, burst=16)
+    for _ in range(10):
+        bucket.throttled()
+    assert bucket.rate == 1  # never below a sixteenth
+    for _ in range(1500):
+        bucket.succeeded()
+    assert bucket.rate == 16
+
+
+def test_table_throttle_raises_storage_busy_without_waiting():
+    throttle = TableThrottle(read_rate=1, write_rate=1, max_wait=0.0)
+    throttle.acquire('write', {'Bookings': 1})
+    with pytest.raises(StorageBusy):
+        throttle.acquire('write', {'Bookings': 1})
+    throttle.acquire('read', {'Bookings': 1})  # reads have their own bucket
+    assert throttle.rejected == 1
+
+
+def test_request_units_counts_items_per_table():
+    assert request_units({'TableName': 'Users'}) == {'Users': 1}
+    assert request_units({'RequestItems': {'Users': {'Keys': [{}, {}]}, 'Bookings': [{}, {}, {}]}}) == {
+        'Users': 2, 'Bookings': 3
+    }
+    assert request_units({'TransactItems': [{'Put': {'TableName': 'Bookings'}},
+                                            {'Update': {'TableName': 'Inventory'}},
+                                            {'Update': {'TableName': 'Inventory'}}]}) == {
+        'Bookings': 1, 'Inventory': 2
+    }
+
+
+@pytest.mark.parametrize('parsed, throttled', [
+    ({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, True),
+    ({'Error': {'Code': 'ConditionalCheckFailedException'}}, False),
+    ({'CancellationReasons': [{'Code': 'None'}, {'Code': 'ThrottlingError'}]}, True),
+    # Cancelled for its condition as well: retrying would fail the same way
+    ({'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'ThrottlingError'}]}, False),
+])
+def test_is_throttled(parsed, throttled):
+    assert is_throttled(parsed) is throttled
+
+
+def test_a_throttled_read_is_retried(faulty):
+    faulty.create_user({'id': 'u1', 'name': 'A', 'email': 'a@example.com', 'password': '-',
+                        'mobile_number': '1', 'created_at': '2030-06-01T00:00:00'})
+    faults = throttle_next(faulty, 1)
+
+    assert faulty.get_user('u1')['email'] == 'a@example.com'
+    assert faults.throttled['GetItem'] == 1
+    assert faults.requests['GetItem'] == 2
+
+
+def test_a_transaction_cancelled_for_throttling_is_retried(faulty):
+    faulty.capacity('suv')
+    faults = throttle_next(faulty, 1)
+    booking = make_booking()
+
+    faulty.create_booking(booking)
+    assert faults.throttled['TransactWriteItems'] == 1
+    assert faults.requests['TransactWriteItems'] == 2
+    assert faulty.get_booking(booking['booking_id']) is not None
+
+
+def test_throttling_past_the_retries_is_storage_busy(faulty):
+    faults = throttle_next(faulty, 3)  # every one of the 3 attempts
+
+    with pytest.raises(StorageBusy):
+        faulty.get_user('u1')
+    assert faults.requests['GetItem'] == 3
+    assert faulty.resilience.busy == 1
+
+
+def test_storage_busy_is_a_503(client, app, monkeypatch):
+    def busy(*args, **kwargs):
+        raise StorageBusy("throttled")
+
+    monkeypatch.setattr(app.extensions['storage'], 'list_bookings', busy)
+    response = client.get('/api/bookings')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,38 @@
+"""Importing an entry point does no I/O and stays within the startup budget
+
+Each import runs in a fresh interpreter with socket connects and
+sqlite3.connect refused; `python benchmark.py startup` prints the timings.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Importing an entry point must stay under this many seconds (fresh interpreter)
+STARTUP_BUDGET_SECONDS = 1.0
+
+PROBE = """
+import socket, sqlite3, sys, time
+def refuse(*args, **kwargs):
+    raise RuntimeError('I/O at import time')
+socket.socket.connect = refuse
+sqlite3.connect = refuse
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(time.perf_counter() - start)
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('module', ['cab', 'app', 'app3'])
+def test_entry_point_imports_without_io_within_budget(module, tmp_path):
+    env = dict(os.environ, DATABASE_PATH=str(tmp_path / 'startup.db'))
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+    result = subprocess.run([sys.executable, '-c', PROBE, module], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert float(result.stdout.split()[-1]) < STARTUP_BUDGET_SECONDS
+    assert not (tmp_path / 'startup.db').exists()
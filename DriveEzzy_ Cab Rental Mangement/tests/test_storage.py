@@ -0,0 +1,201 @@
+"""Contract every storage backend must keep (memory, SQLite, DynamoDB on moto)"""
+from datetime import date, timedelta
+
+import pytest
+
+from storage import MAX_BOOKING_DAYS, BookingTooLong, BookingUnavailable, DuplicateBooking, encode_cursor
+
+from .conftest import make_booking
+
+
+def test_users_round_trip(storage):
+    user = {'id': 'user-1', 'name': 'Asha', 'email': 'asha@example.com',
+            'password': 'hash', 'mobile_number': '99999', 'created_at': '2030-06-01T00:00:00'}
+    storage.create_user(user)
+
+    assert storage.get_user('user-1')['email'] == 'asha@example.com'
+    assert storage.get_user_by_email('asha@example.com')['id'] == 'user-1'
+    assert storage.get_user('nobody') is None
+    assert storage.get_user_by_email('nobody@example.com') is None
+
+    storage.update_password('user-1', 'new-hash')
+    assert storage.get_user('user-1')['password'] == 'new-hash'
+
+
+def test_create_and_get_booking(storage):
+    booking = make_booking()
+    storage.create_booking(booking)
+
+    stored = storage.get_booking(booking['booking_id'])
+    assert stored['user_id'] == 'user-1'
+    assert stored['status'] == 'confirmed'
+    assert (stored['pickup'], stored['dropoff']) == (booking['pickup'], booking['dropoff'])
+    assert storage.get_booking('no-such-booking') is None
+
+
+def test_duplicate_booking_id_is_refused(storage):
+    booking = make_booking()
+    storage.create_booking(booking)
+    with pytest.raises(DuplicateBooking):
+        storage.create_booking(dict(booking))
+
+
+def test_sold_out_days_are_refused(storage):
+    capacity = sum(1 for vehicle in storage.get_fleet() if vehicle['car_type'] == 'suv')
+    for i in range(capacity):
+        storage.create_booking(make_booking(f"user-{i}"))
+
+    # Overlaps the last day of the sold-out range
+    with pytest.raises(BookingUnavailable):
+        storage.create_booking(make_booking(pickup=date(2031, 1, 2)))
+    # The day the others are dropped off is free again
+    storage.create_booking(make_booking(pickup=date(2031, 1, 3)))
+
+
+def test_bookings_past_the_maximum_length_are_refused(storage):
+    with pytest.raises(BookingTooLong):
+        storage.create_booking(make_booking(days=MAX_BOOKING_DAYS + 1))
+    assert storage.active_bookings('2030-06-01') == []
+    storage.create_booking(make_booking(days=MAX_BOOKING_DAYS))
+
+
+def test_list_bookings_pages_newest_first(storage):
+    created = []
+    for i in range(5):
+        booking = make_booking(pickup=date(2031, 1, 1) + timedelta(days=i * 3),
+                               created_at=f"2030-06-01T10:00:0{i}")
+        storage.create_booking(booking)
+        created.append(booking['booking_id'])
+    storage.create_booking(make_booking('someone-else'))
+
+    seen = []
+    page, cursor = storage.list_bookings('user-1', limit=2)
+    seen.extend(b.booking_id for b in page)
+    while cursor:
+        page, cursor = storage.list_bookings('user-1', limit=2, cursor=cursor)
+        seen.extend(b.booking_id for b in page)
+    assert seen == created[::-1]
+
+
+def test_an_exactly_full_last_page_has_no_cursor(storage):
+    for i in range(4):
+        storage.create_booking(make_booking(pickup=date(2031, 1, 1) + timedelta(days=i * 3),
+                                            created_at=f"2030-06-01T10:00:0{i}"))
+
+    page, cursor = storage.list_bookings('user-1', limit=2)
+    assert len(page) == 2
+    page, cursor = storage.list_bookings('user-1', limit=2, cursor=cursor)
+    assert len(page) == 2
+    assert cursor is None
+    assert storage.list_bookings('user-1', limit=4) == (storage.list_bookings('user-1', limit=5)[0], None)
+
+
+def test_cancel_is_a_single_conditional_write(storage):
+    booking = make_booking()
+    storage.create_booking(booking)
+
+    assert not storage.cancel_booking(booking['booking_id'], '2030-06-02T00:00:00', user_id='someone-else')
+    assert storage.cancel_booking(booking['booking_id'], '2030-06-02T00:00:00', user_id='user-1')
+    assert not storage.cancel_booking(booking['booking_id'], '2030-06-02T00:00:01', user_id='user-1')
+    assert storage.get_booking(booking['booking_id'])['status'] == 'cancelled'
+
+
+def test_cancel_gives_back_inventory(storage):
+    capacity = sum(1 for vehicle in storage.get_fleet() if vehicle['car_type'] == 'suv')
+    bookings = [make_booking(f"user-{i}") for i in range(capacity)]
+    for booking in bookings:
+        storage.create_booking(booking)
+    assert storage.cancel_booking(bookings[0]['booking_id'], '2030-06-02T00:00:00')
+    storage.create_booking(make_booking())
+
+
+def test_import_bookings_reports_rejected_rows(storage):
+    booking = make_booking()
+    storage.create_booking(booking)
+    fresh = make_booking(pickup=date(2032, 1, 1))
+
+    rejected = storage.import_bookings([dict(booking), fresh])
+    assert [b['booking_id'] for b, _ in rejected] == [booking['booking_id']]
+    assert storage.get_booking(fresh['booking_id']) is not None
+
+
+def test_import_bookings_rejects_rows_past_the_maximum_length(storage):
+    too_long = make_booking(days=MAX_BOOKING_DAYS + 1)
+    fits = make_booking(pickup=date(2032, 1, 1))
+
+    rejected = storage.import_bookings([too_long, fits])
+    assert [(b['booking_id'], reason) for b, reason in rejected] == [
+        (too_long['booking_id'], f"Bookings are limited to {MAX_BOOKING_DAYS} days")
+    ]
+    assert storage.get_booking(too_long['booking_id']) is None
+    assert storage.get_booking(fits['booking_id']) is not None
+
+
+def test_active_and_changed_bookings(storage):
+    past = make_booking(pickup=date(2020, 1, 1), created_at='2019-12-01T00:00:00')
+    current = make_booking(pickup=date(2031, 1, 1), created_at='2030-06-01T00:00:00')
+    storage.create_booking(past)
+    storage.create_booking(current)
+
+    active = {b['booking_id'] for b in storage.active_bookings('2030-06-01')}
+    assert active == {current['booking_id']}
+    changed = {b['booking_id'] for b in storage.changed_bookings('2030-01-01T00:00:00')}
+    assert changed == {current['booking_id']}
+
+
+def test_a_cancelled_booking_changes_and_stops_being_active(storage):
+    booking = make_booking(pickup=date(2031, 1, 1), created_at='2030-06-01T00:00:00')
+    storage.create_booking(booking)
+    storage.cancel_booking(booking['booking_id'], '2030-07-01T00:00:00')
+
+    assert storage.active_bookings('2030-06-01') == []
+    changed = storage.changed_bookings('2030-06-15T00:00:00')
+    assert [(b['booking_id'], b['status']) for b in changed] == [(booking['booking_id'], 'cancelled')]
+
+
+def test_rate_tables_are_versioned(storage):
+    first = storage.latest_rate_version()
+    rates = dict(storage.get_rate_table(first))
+    version = storage.save_rate_table(rates, '2030-06-01T00:00:00')
+    assert version == first + 1
+    assert storage.latest_rate_version() == version
+    assert storage.get_rate_table(version) == rates
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    'eyJjcmVhdGVkX2F0Ijo',  # truncated
+    'WzEsMl0',  # a JSON list
+    'eyJib29raW5nX2lkIjoxfQ',  # {"booking_id": 1}
+    'eyJjcmVhdGVkX2F0IjoiMjAzMCIsImJvb2tpbmdfaWQiOjF9',  # booking_id not a string
+    encode_cursor({'created_at': 5, 'booking_id': 'b', 'user_id': 'user-1'}),
+])
+def test_tampered_cursor_is_a_value_error(storage, cursor):
+    storage.create_booking(make_booking())
+    with pytest.raises(ValueError):
+        storage.list_bookings('user-1', limit=1, cursor=cursor)
+
+
+@pytest.mark.parametrize('key', [
+    {'created_at': '2030-06-01T00:00:00', 'booking_id': 'b'},  # no user_id (DynamoDB's index key)
+    {'created_at': '2030-06-01T00:00:00', 'booking_id': 'b', 'user_id': 'someone-else'},
+    {'created_at': '2030-06-01T00:00:00', 'booking_id': 'b', 'user_id': 'user-1', 'extra': 'x'},
+    {'SK': 'BOOKING#2030'},
+])
+def test_foreign_cursor_never_fails_with_anything_but_value_error(storage, key):
+    storage.create_booking(make_booking())
+    try:
+        storage.list_bookings('user-1', limit=1, cursor=encode_cursor(key))
+    except ValueError:
+        pass
+
+
+def test_sqlite_warm_up_prepares_several_connections(sqlite_storage):
+    booking = make_booking()
+    sqlite_storage.create_booking(booking)
+
+    sqlite_storage.warm_up(4)
+    assert sqlite_storage.pool.qsize() == 4
+    # None of them is left holding the write lock or changed anything
+    sqlite_storage.create_booking(make_booking(pickup=date(2032, 1, 1)))
+    assert sqlite_storage.get_booking(booking['booking_id'])['status'] == 'confirmed'
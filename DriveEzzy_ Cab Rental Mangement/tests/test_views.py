@@ -0,0 +1,31 @@
+"""Booking routes through the Flask test client (SQLite)"""
+import pytest
+
+from storage import MAX_BOOKING_DAYS
+from views import InvalidStay, new_booking
+
+
+def test_api_bookings_refuses_a_tampered_cursor(client):
+    response = client.get('/api/bookings?cursor=eyJjcmVhdGVkX2F0Ijo')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
+
+
+def test_new_booking_refuses_stays_past_the_maximum(app):
+    with app.app_context():
+        new_booking('b1', 'user-1', 'suv', '2031-01-01', '2031-04-01')  # MAX_BOOKING_DAYS nights
+        with pytest.raises(InvalidStay):
+            new_booking('b2', 'user-1', 'suv', '2031-01-01', '2131-01-01')
+
+
+def test_booking_form_refuses_a_hundred_year_booking(app, client):
+    response = client.post('/book/suv', data={'check_in': '2031-01-01', 'check_out': '2131-01-01',
+                                              'special_requests': '', 'payment_mode': 'upi'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/book/suv')
+    storage = app.extensions['storage']
+    with app.app_context():
+        user = storage.get_user_by_email('test@example.com')
+        assert storage.list_bookings(user['id'])[0] == []
+    with client.session_transaction() as session:
+        assert session['_flashes'][-1] == ('danger', f"Bookings are limited to {MAX_BOOKING_DAYS} days.")
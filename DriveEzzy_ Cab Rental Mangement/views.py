@@ -0,0 +1,409 @@
+from flask import current_app, render_template, request, redirect, url_for, flash, session, jsonify
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import uuid
+
+from credentials import HasherBusy
+from notifications import booking_confirmed_event
+from pricing import UnknownCarType
+from storage import MAX_BOOKING_DAYS, BookingUnavailable, DuplicateBooking, StorageBusy
+
+# Bookings shown per page on My Bookings (and the API default)
+BOOKINGS_PAGE_SIZE = 20
+MAX_BOOKINGS_PAGE_SIZE = 100
+
+# Shown when the database throttles a request through all its retries
+BUSY_MESSAGE = "We're handling a lot of requests right now. Please try again in a moment."
+
+# Shown (with a 503) when the password hasher's queue is full
+HASHER_BUSY_MESSAGE = "We're handling a lot of logins right now. Please try again in a moment."
+
+def format_money(value):
+    """Template filter: 12000 -> '12,000', 1234.5 -> '1,234.50'"""
+    value = Decimal(str(value))
+    if value == value.to_integral_value():
+        return f"{value:,.0f}"
+    return f"{value:,.2f}"
+
+def get_storage():
+    """Return the storage backend attached to the current app"""
+    return current_app.extensions['storage']
+
+def get_availability():
+    """Return the fleet availability engine attached to the current app"""
+    return current_app.extensions['availability']
+
+def get_credentials():
+    """Return the password hasher attached to the current app"""
+    return current_app.extensions['credentials']
+
+def get_pricing():
+    """Return the pricing engine attached to the current app"""
+    return current_app.extensions['pricing']
+
+def get_pages():
+    """Return the page cache attached to the current app"""
+    return current_app.extensions['pages']
+
+class InvalidStay(ValueError):
+    pass
+
+def parse_stay(check_in, check_out):
+    """Pickup and dropoff dates of a stay, from YYYY-MM-DD strings.
+
+    Raises ValueError for dates that don't parse and InvalidStay if dropoff
+    is not after pickup or the stay is longer than MAX_BOOKING_DAYS.
+    """
+    check_in_date = datetime.strptime(check_in, "%Y-%m-%d").date()
+    check_out_date = datetime.strptime(check_out, "%Y-%m-%d").date()
+    num_days = (check_out_date - check_in_date).days
+    if num_days < 1:
+        raise InvalidStay("Dropoff date must be after the pickup date.")
+    if num_days > MAX_BOOKING_DAYS:
+        raise InvalidStay(f"Bookings are limited to {MAX_BOOKING_DAYS} days.")
+    return check_in_date, check_out_date
+
+def new_booking(booking_id, user_id, car_type, check_in, check_out, special_requests='',
+                payment_mode='', created_at=None, pricing=None):
+    """Validate and price a booking the way the booking form does.
+
+    Raises ValueError and InvalidStay as parse_stay does, and UnknownCarType
+    for car types without a rate.
+    """
+    check_in_date, check_out_date = parse_stay(check_in, check_out)
+    num_days = (check_out_date - check_in_date).days
+
+    # Price the stay from the current rate table
+    quote = (pricing or get_pricing()).quote(car_type, check_in_date, check_out_date)
+
+    return {
+        'booking_id': booking_id,
+        'user_id': user_id,
+        'car_type': car_type,
+        'num_days': num_days,
+        'pickup': check_in,
+        'dropoff': check_out,
+        'special_requests': special_requests,
+        'payment_mode': payment_mode,
+        'total_price': quote.total,
+        'status': 'confirmed',
+        'created_at': created_at or datetime.now().isoformat()
+    }
+
+# The helpers below are shared with aioviews.py, so they take the form, the
+# session and the app's extensions rather than reading Flask's proxies
+
+def booking_from_form(form, user_id, car_type, pricing=None):
+    """Validate and price the booking a submitted booking form asks for.
+
+    The same form submitted twice maps to the same booking ID. Raises
+    KeyError for missing fields, and what new_booking raises.
+    """
+    idempotency_key = form.get('idempotency_key') or str(uuid.uuid4())
+    booking_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{user_id}:{idempotency_key}"))
+    return new_booking(booking_id, user_id, car_type, form['check_in'], form['check_out'],
+                       form['special_requests'], form['payment_mode'], pricing=pricing)
+
+def new_user(form, password_hash):
+    """The users row for a submitted registration form"""
+    return {
+        'id': str(uuid.uuid4()),
+        'name': form['name'],
+        'email': form['email'],
+        'password': password_hash,
+        'mobile_number': form['mobile_number'],
+        'created_at': datetime.now().isoformat()
+    }
+
+def booking_created(extensions, session, user_id):
+    """After a booking commits: send its confirmation without waiting for
+    the next poll, and change the user's My Bookings ETag"""
+    extensions['outbox'].wake()
+    extensions['pages'].versions.bump(user_id, session)
+
+def booking_cancelled(extensions, session, booking_id, user_id):
+    """After a cancellation commits: free its days and change the user's
+    My Bookings ETag"""
+    extensions['availability'].release(booking_id)
+    extensions['pages'].versions.bump(user_id, session)
+
+# Home Route
+def home():
+    return get_pages().page(lambda: render_template('home.html'))
+
+# Register Route
+def register():
+    if request.method == 'POST':
+        try:
+            storage = get_storage()
+
+            # Check if user already exists (before paying for the hash)
+            if storage.get_user_by_email(request.form['email']):
+                flash("Email already registered. Please login.", "danger")
+                return redirect(url_for('login'))
+
+            # Create new user
+            storage.create_user(new_user(request.form, get_credentials().hash(request.form['password'])))
+
+            flash("Thanks for registering!", "success")
+            return redirect(url_for('login'))
+        except HasherBusy:
+            flash(HASHER_BUSY_MESSAGE, "danger")
+            return render_template('register.html'), 503, {'Retry-After': '1'}
+        except StorageBusy:
+            flash(BUSY_MESSAGE, "danger")
+        except Exception as e:
+            flash(f"Error: {str(e)}", "danger")
+
+    return render_template('register.html')
+
+# Login Route
+def login():
+    if request.method == 'POST':
+        email = request.form['email']
+        password = request.form['password']
+
+        try:
+            # Query for user with email
+            storage = get_storage()
+            credentials = get_credentials()
+            user = storage.get_user_by_email(email)
+
+            if user:
+                matches, needs_rehash = credentials.verify(password, user['password'])
+            else:
+                matches, needs_rehash = credentials.verify_unknown_user(password), False
+
+            if matches:
+                # Upgrade plaintext rows and hashes made with an old cost setting
+                if needs_rehash:
+                    storage.update_password(user['id'], credentials.hash(password))
+                session['user_id'] = user['id']
+                session['username'] = user['name']
+                flash("Login successful!", "success")
+                return redirect(url_for('car_type'))
+            else:
+                flash("Invalid login. Please try again.", "danger")
+        except HasherBusy:
+            flash(HASHER_BUSY_MESSAGE, "danger")
+            return render_template('login.html'), 503, {'Retry-After': '1'}
+        except StorageBusy:
+            flash(BUSY_MESSAGE, "danger")
+        except Exception as e:
+            flash(f"Error: {str(e)}", "danger")
+
+    return render_template('login.html')
+
+# Check Car types
+def car_type():
+    if request.method == 'POST':
+        car_type = request.form['car_type']  # Retrieve the car type from the form
+        return redirect(url_for('book', car_type=car_type))  # Pass car_type
+
+    # Cars free today and the current daily rates, shown on each card
+    today = date.today()
+    try:
+        availability = get_availability().summary(today, today + timedelta(days=1))
+    except Exception as e:
+        print(f"Error loading availability: {str(e)}")
+        availability = None
+    try:
+        rates = get_pricing().daily_rates()
+    except Exception as e:
+        print(f"Error loading rates: {str(e)}")
+        rates = {}
+    # Rendered once per day's availability and rate table
+    return get_pages().page(lambda: render_template('car_type.html', availability=availability, rates=rates),
+                            availability, rates)
+
+# Availability JSON API for a date range
+def api_availability():
+    # summary() walks every day under the lock reserve() needs, so the
+    # range is capped like a booking's
+    try:
+        check_in, check_out = parse_stay(request.args['check_in'], request.args['check_out'])
+    except InvalidStay as e:
+        return jsonify(error=str(e)), 400
+    except (KeyError, ValueError):
+        return jsonify(error="check_in and check_out must be YYYY-MM-DD dates"), 400
+
+    return jsonify(get_availability().summary(check_in, check_out))
+
+# Price quote JSON API, called by the booking form as the dates change
+def api_quote():
+    # Never prices more days than a booking could hold
+    try:
+        car_type = request.args['car_type']
+        check_in, check_out = parse_stay(request.args['check_in'], request.args['check_out'])
+    except InvalidStay as e:
+        return jsonify(error=str(e)), 400
+    except (KeyError, ValueError):
+        return jsonify(error="car_type, check_in and check_out (YYYY-MM-DD) are required"), 400
+
+    try:
+        return jsonify(get_pricing().quote(car_type, check_in, check_out))
+    except UnknownCarType:
+        return jsonify(error=f"Unknown car type: {car_type}"), 404
+
+def book(car_type):
+    if 'user_id' not in session:
+        flash("Please login first to book a car", "danger")
+        return redirect(url_for('login'))
+
+    daily_rate = get_pricing().daily_rates().get(car_type.lower())
+    if daily_rate is None:
+        flash(f"Unknown car type: {car_type}", "danger")
+        return redirect(url_for('car_type'))
+
+    if request.method == 'GET':
+        # Pass the correct price based on the car type to the HTML, plus a
+        # fresh idempotency key so a resubmitted form can't book twice
+        return render_template('booking.html', car_type=car_type, price_per_day=daily_rate,
+                               idempotency_key=str(uuid.uuid4()))
+
+    try:
+        # Get user ID from session
+        user_id = session.get('user_id')
+
+        try:
+            booking = booking_from_form(request.form, user_id, car_type)
+        except InvalidStay as e:
+            flash(str(e), "danger")
+            return redirect(url_for('book', car_type=car_type))
+        booking_id = booking['booking_id']
+
+        # Cheap in-memory check first; the storage write below is the one
+        # that guarantees no overbooking across workers
+        storage = get_storage()
+        availability = get_availability()
+        if not availability.reserve(booking):
+            if storage.get_booking(booking_id):
+                return redirect(url_for('thank_you'))  # retry of a booking that took the last car
+            flash(f"Sorry, no {car_type} is available for those dates.", "danger")
+            return redirect(url_for('car_type'))
+
+        # The confirmation is queued in the same transaction and sent by the
+        # outbox worker, so a slow email/SMS gateway never delays this request
+        event = booking_confirmed_event(booking, session.get('username'))
+        try:
+            storage.create_booking(booking, event)
+        except DuplicateBooking:
+            return redirect(url_for('thank_you'))
+        except BookingUnavailable:
+            availability.release(booking_id)
+            availability.refresh(force=True)
+            flash(f"Sorry, no {car_type} is available for those dates.", "danger")
+            return redirect(url_for('car_type'))
+        except Exception:
+            availability.release(booking_id)
+            raise
+
+        booking_created(current_app.extensions, session, user_id)
+
+        return redirect(url_for('thank_you'))
+
+    except StorageBusy:
+        flash(BUSY_MESSAGE, "danger")
+        return redirect(url_for('book', car_type=car_type))
+    except Exception as e:
+        flash(f"Error creating booking: {str(e)}", "danger")
+        return redirect(url_for('car_type'))
+
+# Thank You Route
+def thank_you():
+    return get_pages().page(lambda: render_template('thank_you.html'))
+
+# My Bookings Route
+def my_bookings():
+    user_id = session.get('user_id')
+    if not user_id:
+        flash("You need to log in to view your bookings.", "danger")
+        return redirect(url_for('login'))
+
+    try:
+        cursor = request.args.get('cursor')
+        # Unchanged since the browser's copy: no query, no render
+        pages = get_pages()
+        tag = pages.user_etag(user_id, cursor)
+        response = pages.not_modified(tag)
+        if response is not None:
+            return response
+        bookings_list, next_cursor = get_storage().list_bookings(
+            user_id, limit=BOOKINGS_PAGE_SIZE, cursor=cursor
+        )
+        return pages.respond(render_template('my_bookings.html', bookings=bookings_list,
+                                             next_cursor=next_cursor, is_first_page=not cursor), tag)
+    except StorageBusy:
+        flash(BUSY_MESSAGE, "danger")
+        return render_template('my_bookings.html', bookings=[])
+    except Exception as e:
+        flash(f"Error retrieving bookings: {str(e)}", "danger")
+        return render_template('my_bookings.html', bookings=[])
+
+# Bookings JSON API (one page per call, follow next_cursor for more)
+def api_bookings():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify(error="Login required"), 401
+
+    limit = min(request.args.get('limit', BOOKINGS_PAGE_SIZE, type=int), MAX_BOOKINGS_PAGE_SIZE)
+    try:
+        bookings_list, next_cursor = get_storage().list_bookings(
+            user_id, limit=max(limit, 1), cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except StorageBusy:
+        return jsonify(error=BUSY_MESSAGE), 503, {'Retry-After': '1'}
+
+    return jsonify(bookings=bookings_list, next_cursor=next_cursor)
+
+# Cancel a booking
+def cancel_booking(booking_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        flash("You need to log in to cancel bookings.", "danger")
+        return redirect(url_for('login'))
+
+    try:
+        # Ownership and status are conditions of the cancelling write itself,
+        # so there is no separate read and no race with a second cancel
+        if not get_storage().cancel_booking(booking_id, datetime.now().isoformat(), user_id):
+            flash("Booking not found or already cancelled.", "danger")
+            return redirect(url_for('my_bookings'))
+        booking_cancelled(current_app.extensions, session, booking_id, user_id)
+
+        flash("Booking cancelled successfully.", "success")
+    except StorageBusy:
+        flash(BUSY_MESSAGE, "danger")
+    except Exception as e:
+        flash(f"Error cancelling booking: {str(e)}", "danger")
+
+    return redirect(url_for('my_bookings'))
+
+# Logout Route
+def logout():
+    session.clear()
+    flash("You have been logged out.", "success")
+    return redirect(url_for('home'))
+
+# Database throttled outside a view's own error handling
+def storage_busy(error):
+    return BUSY_MESSAGE, 503, {'Retry-After': '1'}
+
+def register_views(app):
+    """Register the booking routes on a Flask app"""
+    app.add_template_filter(format_money, 'money')
+    app.add_url_rule('/', view_func=home)
+    app.add_url_rule('/register', view_func=register, methods=['GET', 'POST'])
+    app.add_url_rule('/login', view_func=login, methods=['GET', 'POST'])
+    app.add_url_rule('/car_type', view_func=car_type, methods=['GET', 'POST'])
+    app.add_url_rule('/book/<car_type>', view_func=book, methods=['GET', 'POST'])
+    app.add_url_rule('/api/availability', view_func=api_availability)
+    app.add_url_rule('/api/quote', view_func=api_quote)
+    app.add_url_rule('/thank_you', view_func=thank_you)
+    app.add_url_rule('/my_bookings', view_func=my_bookings)
+    app.add_url_rule('/api/bookings', view_func=api_bookings)
+    app.add_url_rule('/cancel_booking/<booking_id>', view_func=cancel_booking, methods=['POST'])
+    app.add_url_rule('/logout', view_func=logout)
+    app.register_error_handler(StorageBusy, storage_busy)
@@ -0,0 +1,152 @@
+"""Per-worker warmup and the /readyz and /healthz probes
+
+Each worker process warms up before it takes traffic (gunicorn.conf.py runs
+warm_up after every fork):
+
+    schema       the once-per-host schema check (factory.ensure_schema)
+    storage      open pooled connections and prepare the hot queries
+    templates    compile every Jinja template
+    availability load the fleet and active bookings
+    pricing      compile the current rate table
+    assets       read the static asset manifest
+    pages        pre-render the pages every visitor sees alike (pagecache.py)
+    credentials  start the password hashing processes
+    background   start the outbox worker
+
+GET /readyz answers 503 until every step has succeeded, and again once the
+worker is shutting down, so a load balancer only routes to warm workers.
+GET /healthz only says the process is serving. Under a server without the
+gunicorn hook the first /readyz probe starts the warmup in the background.
+A worker whose warmup fails (say the database is unreachable) still starts
+but stays unready; the next probe tries again.
+"""
+import threading
+import time
+
+from flask import current_app, jsonify
+
+# Endpoints that report on warmup instead of waiting for it
+PROBE_ENDPOINTS = frozenset({'readyz', 'healthz'})
+
+
+class Readiness:
+    """Warmup progress of this worker process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()  # one warmup at a time
+        self.ready = False
+        self.warming = False
+        self.stopping = False
+        self.steps = {}  # step -> seconds it took
+        self.error = None
+
+    def as_dict(self):
+        if self.stopping:
+            status = 'stopping'
+        elif self.ready:
+            status = 'ready'
+        else:
+            status = 'warming' if self.warming else 'cold'
+        return {
+            'status': status,
+            'steps': {name: round(seconds * 1000, 1) for name, seconds in self.steps.items()},
+            'error': self.error
+        }
+
+
+def compile_templates(app):
+    """Load every template into the Jinja environment's cache"""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def warmup_steps(app, connections):
+    from factory import ensure_schema, start_background_work  # factory imports this module
+
+    return [
+        ('schema', lambda: ensure_schema(app)),
+        ('storage', lambda: app.extensions['storage'].warm_up(connections)),
+        ('templates', lambda: compile_templates(app)),
+        ('availability', app.extensions['availability'].refresh),
+        ('pricing', app.extensions['pricing'].refresh),
+        ('assets', app.extensions['assets'].load),
+        ('pages', app.extensions['pages'].warm_up),
+        ('credentials', app.extensions['credentials'].warm_up),
+        ('background', lambda: start_background_work(app)),
+    ]
+
+
+def warm_up(app, connections=None):
+    """Run every warmup step in this process and mark it ready
+
+    Returns {step: seconds}. Raises the first step that fails; the worker
+    then stays unready. `connections` is how many pooled database
+    connections to open (one per server thread; WARMUP_CONNECTIONS if None).
+    """
+    readiness = app.extensions['readiness']
+    with readiness.lock:
+        if readiness.ready:
+            return dict(readiness.steps)
+        readiness.warming = True
+        connections = connections or app.config.get('WARMUP_CONNECTIONS', 1)
+        try:
+            for name, step in warmup_steps(app, connections):
+                start = time.perf_counter()
+                try:
+                    step()
+                except Exception as e:
+                    readiness.error = f"{name}: {e}"
+                    raise
+                readiness.steps[name] = time.perf_counter() - start
+            readiness.ready = True
+            readiness.error = None
+        finally:
+            readiness.warming = False
+        return dict(readiness.steps)
+
+
+def start_warm_up(app):
+    """Warm up on a background thread unless it is done or underway"""
+    readiness = app.extensions['readiness']
+    if readiness.ready or readiness.warming:
+        return
+
+    def run():
+        try:
+            warm_up(app)
+        except Exception as e:
+            app.logger.warning(f"Warmup failed: {e}")
+
+    threading.Thread(target=run, name='warmup', daemon=True).start()
+
+
+def shut_down(app):
+    """Turn unready and stop background work; gunicorn calls it as a worker
+    exits, after in-flight requests have finished"""
+    app.extensions['readiness'].stopping = True
+    app.extensions['outbox'].stop()
+    app.extensions['credentials'].shutdown()
+
+
+def readyz():
+    readiness = current_app.extensions['readiness']
+    if readiness.ready and not readiness.stopping:
+        return jsonify(readiness.as_dict())
+    if not readiness.stopping:
+        start_warm_up(current_app._get_current_object())
+    return jsonify(readiness.as_dict()), 503
+
+
+def healthz():
+    return jsonify(status='ok')
+
+
+def init_warmup(app):
+    """Track readiness and serve the probe endpoints"""
+    readiness = Readiness()
+    app.extensions['readiness'] = readiness
+    app.add_url_rule('/readyz', view_func=readyz)
+    app.add_url_rule('/healthz', view_func=healthz)
+    return readiness